@@ -0,0 +1,286 @@
+#!/usr/bin/env python3.5
+"""
+Chat command dispatch, a bounded worker pool for running command handlers, a thread per shard for
+their blocking work, per-user rate limiting and coalescing of identical read commands.
+"""
+import asyncio
+import functools
+import shlex
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+COMMAND_PREFIX = '!'
+
+# RateLimiter and RequestCoalescer drop stale entries once they track this many keys
+PRUNE_THRESHOLD = 1000
+
+
+class Command:
+    def __init__(self, name, handler, heavy=False, cached=False):
+        self.name = name
+        self.handler = handler
+        self.heavy = heavy  # Heavy commands are run on a separate pool from light ones
+        self.cached = cached  # Cached commands are read-only and return their reply text
+
+
+class CommandRouter:
+    """Maps command names (e.g. '!event') to handlers. Names are stored in a character trie so a
+    message is matched in a single pass over its first word, and messages that do not start with
+    COMMAND_PREFIX are rejected without further parsing."""
+
+    def __init__(self):
+        self._trie = {}
+
+    def add_command(self, name, handler, heavy=False, cached=False):
+        if not name.startswith(COMMAND_PREFIX) or len(name.split()) != 1:
+            raise ValueError("Invalid command name: {}".format(name))
+
+        node = self._trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[None] = Command(name, handler, heavy, cached)  # None marks the end of a command name
+
+    def command(self, name, heavy=False, cached=False):
+        """Decorator registering the decorated function as the handler for name."""
+        def decorator(handler):
+            self.add_command(name, handler, heavy, cached)
+            return handler
+        return decorator
+
+    def find(self, content):
+        """Returns the Command matching the first word of content, or None."""
+        if not content.startswith(COMMAND_PREFIX):
+            return None
+
+        node = self._trie
+        for char in content:
+            if char.isspace():
+                break
+            node = node.get(char)
+            if node is None:
+                return None
+        return node.get(None)
+
+    def dispatch(self, content):
+        """Returns (Command, args) for content, where args is the shell-style split of content
+        (args[0] is the command name), or None if content is not a registered command. Raises
+        ValueError if content has unbalanced quotes."""
+        command = self.find(content)
+        if command is None:
+            return None
+        return command, shlex.split(content)
+
+
+class WorkerPool:
+    """Runs submitted jobs (coroutine functions taking no arguments) on num_workers workers.
+    Submissions are rejected when max_queued jobs are waiting, or when the submitting user or
+    guild already has per_user or per_guild jobs queued or running.
+
+    Workers run on the event loop, so jobs must not block it: blocking work such as database
+    queries should be awaited through ShardExecutors.run."""
+
+    def __init__(self, num_workers, max_queued, per_user, per_guild):
+        self.num_workers = num_workers
+        self.max_queued = max_queued
+        self.per_user = per_user
+        self.per_guild = per_guild
+        self._queue = None
+        self._workers = []
+        self._user_jobs = {}
+        self._guild_jobs = {}
+
+    def start(self):
+        """Starts the workers if they are not already running. Must be called from within the
+        running event loop."""
+        if self._workers:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_queued)
+        self._workers = [asyncio.ensure_future(self._work()) for i in range(self.num_workers)]
+
+    async def stop(self):
+        """Waits for queued jobs to finish, then stops the workers."""
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def submit(self, job, user_key, guild_key):
+        """Queues job. Returns False if the job was rejected."""
+        if self._user_jobs.get(user_key, 0) >= self.per_user or \
+                self._guild_jobs.get(guild_key, 0) >= self.per_guild:
+            return False
+
+        try:
+            self._queue.put_nowait((job, user_key, guild_key))
+        except asyncio.QueueFull:
+            return False
+
+        self._user_jobs[user_key] = self._user_jobs.get(user_key, 0) + 1
+        self._guild_jobs[guild_key] = self._guild_jobs.get(guild_key, 0) + 1
+        return True
+
+    def _release(self, counts, key):
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
+
+    async def _work(self):
+        while True:
+            job, user_key, guild_key = await self._queue.get()
+            try:
+                await job()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._release(self._user_jobs, user_key)
+                self._release(self._guild_jobs, guild_key)
+                self._queue.task_done()
+
+
+class ShardExecutors:
+    """Runs blocking calls (e.g. PorgWrapper queries and rendering) off the event loop, on one
+    thread per key (e.g. per shard). A PorgWrapper's session may only be used by one thread at a
+    time, so every call using a shard's PorgWrapper is run on that shard's thread. Calls for a key
+    run one at a time in submission order, while the event loop and other keys' calls carry on.
+    Call shutdown(key) when a key is no longer used (e.g. from PorgShards.ShardManager's
+    on_close), or its thread is kept."""
+
+    def __init__(self):
+        self._executors = {}  # key -> single thread ThreadPoolExecutor
+
+    async def run(self, key, fn, *args):
+        """Returns fn(*args), called on key's thread."""
+        return await self.submit(key, fn, *args)
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args) on key's thread straight away, ahead of calls made later, and returns
+        an asyncio future of its result."""
+        executor = self._executors.get(key)
+        if executor is None:
+            executor = self._executors[key] = ThreadPoolExecutor(max_workers=1)
+        return asyncio.get_event_loop().run_in_executor(executor, functools.partial(fn, *args))
+
+    def shutdown(self, key=None, wait=True):
+        """Stops the thread for key (default every key) once the calls submitted to it have run."""
+        keys = [key] if key is not None else list(self._executors)
+        for k in keys:
+            executor = self._executors.pop(k, None)
+            if executor:
+                executor.shutdown(wait)
+
+
+class TokenBucket:
+    """Holds up to capacity tokens, refilled at rate tokens per second."""
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens=1, now=None):
+        """Takes tokens from the bucket. Returns False, taking nothing, if there are not enough."""
+        self.refill(now)
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class RateLimiter:
+    """Keeps a TokenBucket per key (e.g. per user). Each allowed request takes one token, so a key
+    can make burst requests at once and rate requests per second after that."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+
+    def allow(self, key, now=None):
+        """Returns True if key may make a request now."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= PRUNE_THRESHOLD:
+                self.prune(now)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket.consume(now=now)
+
+    def prune(self, now=None):
+        """Forgets keys whose buckets have refilled, as they behave the same as new buckets."""
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[key]
+
+
+class RequestCoalescer:
+    """Runs identical requests once. While a request for (namespace, key) is running, further
+    requests for it wait for and share its result, and the result is reused for ttl seconds after
+    it finishes. namespace groups keys that are invalidated together (e.g. one guild's data).
+    Results are only as fresh as the invalidations: every write to a namespace's data must be
+    followed by invalidate(), e.g. by flushing the EventBus it is subscribed to."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._in_flight = {}  # (namespace, key) -> (generation, Future)
+        self._results = {}  # (namespace, key) -> (expiry time, result)
+        self._generations = Counter()  # namespace -> number of invalidations
+
+    async def run(self, namespace, key, fn):
+        """Returns the result of awaiting fn() (a coroutine function taking no arguments), or the
+        result of an identical request that is running or finished less than ttl seconds ago.
+        Exceptions raised by fn are passed to every waiting request and are not cached."""
+        full_key = (namespace, key)
+        cached = self._results.get(full_key)
+        if cached:
+            if cached[0] > time.monotonic():
+                return cached[1]
+            del self._results[full_key]
+
+        # Requests started before an invalidation may have read the old data, so aren't joined
+        generation = self._generations[namespace]
+        in_flight = self._in_flight.get(full_key)
+        if in_flight is not None and in_flight[0] == generation:
+            return await asyncio.shield(in_flight[1])
+
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[full_key] = in_flight = (generation, future)
+        try:
+            result = await fn()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved in case nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            if len(self._results) >= PRUNE_THRESHOLD:
+                self.prune()
+            if self._generations[namespace] == generation:
+                self._results[full_key] = (time.monotonic() + self.ttl, result)
+            return result
+        finally:
+            if self._in_flight.get(full_key) is in_flight:
+                del self._in_flight[full_key]
+            if not future.done():  # fn was cancelled
+                future.cancel()
+
+    def prune(self):
+        """Forgets expired results."""
+        now = time.monotonic()
+        for full_key in [k for k, (expiry, result) in self._results.items() if expiry <= now]:
+            del self._results[full_key]
+
+    def invalidate(self, namespace):
+        """Forgets cached results in namespace, e.g. after its data changes. Requests already
+        running still return their result, but it is not cached or shared with later requests."""
+        self._generations[namespace] += 1
+        for full_key in [k for k in self._results if k[0] == namespace]:
+            del self._results[full_key]
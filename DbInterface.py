@@ -1,20 +1,93 @@
 #!/usr/bin/env python3.5
+from contextlib import contextmanager
 from config import porg_config
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text as sql_text
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
 
 
 class DbInterface():
     """Main class for handling database interfacing."""
 
-    def __init__(self):
-        self._engine = create_engine(porg_config.DB_URL)
+    def __init__(self, db_url=None):
+        """db_url defaults to porg_config.DB_URL."""
+        db_url = make_url(db_url or porg_config.DB_URL)
+        # sqlite3 caches only 100 prepared statements per connection by default. The session may be
+        # handed from thread to thread (see CommandRouter.ShardExecutors), though it is only used
+        # by one at a time.
+        connect_args = {'cached_statements': porg_config.STATEMENT_CACHE_SIZE,
+                        'check_same_thread': False} \
+            if db_url.get_backend_name() == 'sqlite' else {}
+        self._engine = create_engine(db_url, connect_args=connect_args)
         self.s = sessionmaker(bind=self._engine)()
+        self._depth = 0  # Number of transaction() blocks currently open
+        self._show_deleted = 0  # Number of showing_deleted() blocks currently open
+
+    def close(self):
+        """Closes the session and all database connections."""
+        self.s.close()
+        self._engine.dispose()
+
+    @contextmanager
+    def transaction(self):
+        """Groups changes into a single commit: inside the block add, update and delete only flush
+        their changes, which are committed when the outermost block exits or rolled back if an
+        exception propagates out of it. Blocks may be nested."""
+        self._depth += 1
+        try:
+            yield self.s
+        except BaseException:
+            self._depth -= 1
+            if not self._depth:
+                self.s.rollback()
+            raise
+        self._depth -= 1
+        if not self._depth:
+            self.s.commit()
+
+    def in_transaction(self):
+        """Returns whether a transaction() block is open."""
+        return self._depth > 0
+
+    @contextmanager
+    def showing_deleted(self):
+        """Inside the block get_obj also returns soft deleted objects (see
+        PorgWrapper.collect_garbage). Blocks may be nested."""
+        self._show_deleted += 1
+        try:
+            yield self.s
+        finally:
+            self._show_deleted -= 1
+
+    def next_id(self, model):
+        """Returns the id the next row inserted into model's table will get, and takes the
+        database's write lock so no other connection can insert until the current transaction
+        ends. Rows may then be inserted with ids from here on, e.g. to build id lists before
+        inserting in bulk. Ids are never reused (tables are AUTOINCREMENT), so this is past any
+        deleted ids too."""
+        table = model.__table__.name
+        # pysqlite only begins a transaction before a write, so the lock is taken by a no-op write
+        self.s.execute(sql_text('UPDATE sqlite_sequence SET seq = seq WHERE name = :name'),
+                       {'name': table})
+        max_id = self.s.execute(sql_text('SELECT max(id) FROM ' + table)).scalar()
+        seq = self.s.execute(sql_text('SELECT seq FROM sqlite_sequence WHERE name = :name'),
+                             {'name': table}).scalar()
+        return max(max_id or 0, seq or 0) + 1
+
+    def _commit(self):
+        if self._depth:
+            self.s.flush()
+        else:
+            self.s.commit()
 
     def _get_by_id(self, obj_id, obj_type):
-        """Returns an object in the database with matching object id and object type."""
+        """Returns an object in the database with matching object id and object type. Soft deleted
+        objects are not returned unless in a showing_deleted() block."""
         if obj_id:
-            return self.s.query(obj_type).get(obj_id)
+            o = self.s.query(obj_type).get(obj_id)
+            if o is not None and getattr(o, 'deleted_time', None) and not self._show_deleted:
+                return None
+            return o
 
     def get_obj(self, obj, obj_type):
         """Given obj (usually id or Object), returns corresponding object within the database.
@@ -34,7 +107,7 @@ class DbInterface():
     def add(self, obj):
         """Inserts given object to the database."""
         self.s.add(obj)
-        self.s.commit()
+        self._commit()
 
     def update(self, obj):
         """commits any changes done on obj to the database and performs any pre-commit processing
@@ -42,9 +115,9 @@ class DbInterface():
 
         Returns obj."""
 
-        self.s.commit()
+        self._commit()
         return obj
 
     def delete(self, obj):
         self.s.delete(obj)
-        self.s.commit()
+        self._commit()
@@ -1,23 +1,159 @@
+import calendar
+import itertools
 from config import porg_config
-from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, Unicode, PickleType, DateTime
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, Column, Integer, Unicode, PickleType, DateTime, Index, text
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import object_session
 
 engine = create_engine(porg_config.DB_URL, echo=False)
 Base = declarative_base(bind=engine)
 
-
-class User(Base):
+# Maximum number of ids in a single IN (...) clause when batch loading related objects
+LOAD_BATCH_SIZE = 500
+
+
+def _load_by_ids(session, obj_type, obj_ids):
+    """Returns a dict mapping id to object for every id in obj_ids that exists in the database,
+    using one query per LOAD_BATCH_SIZE ids."""
+    obj_ids = list(set(obj_ids))
+    res = {}
+    for i in range(0, len(obj_ids), LOAD_BATCH_SIZE):
+        for o in session.query(obj_type).filter(obj_type.id.in_(obj_ids[i:i + LOAD_BATCH_SIZE])):
+            res[o.id] = o
+    return res
+
+
+def insert_events(db_interface, mappings, owners):
+    """Inserts Events in bulk in db_interface's current transaction, each attended by its owner
+    (if any) as organiser. mappings are dicts of Event columns without an id, and owners maps
+    owner ids to Users, whose event id lists are updated. Ids are assigned up front (see
+    DbInterface.next_id), so each table takes a single executemany INSERT. Fills in each
+    mapping's id and returns the mappings of the owners' new Attendances."""
+    next_event_id = db_interface.next_id(Event)
+    next_attendance_id = db_interface.next_id(Attendance)
+
+    attendance_mappings = []
+    for event_id, mapping in enumerate(mappings, start=next_event_id):
+        mapping['id'] = event_id
+        mapping['attendance_ids'] = []
+        owner_id = mapping.get('owner_id')
+        if owner_id:
+            attendance_mappings.append({'id': next_attendance_id + len(attendance_mappings),
+                                        'user_id': owner_id, 'event_id': event_id,
+                                        'going_status': 'going', 'roles': ['organiser']})
+            mapping['attendance_ids'].append(attendance_mappings[-1]['id'])
+            owner = owners.get(owner_id)
+            if owner:
+                owner.add_event_organised(event_id)
+                owner.add_event_attending(event_id)
+
+    session = db_interface.s
+    session.bulk_insert_mappings(Event, mappings)
+    session.bulk_insert_mappings(Attendance, attendance_mappings)
+    session.bulk_insert_mappings(AttendanceRole, [
+        {'attendance_id': a['id'], 'user_id': a['user_id'], 'event_id': a['event_id'],
+         'role': 'organiser'} for a in attendance_mappings])
+    return attendance_mappings
+
+
+def preload(objs, *relations):
+    """Eagerly loads the named relations (see RelatedMixin) for every object in objs, using one
+    query per relation for all objects rather than one per object. Relations already loaded (and
+    not since changed) are not loaded again. objs must all be of the same type. Returns objs.
+
+    e.g. preload(events, 'owner', 'attendances')"""
+    objs = [o for o in objs if o is not None]
+    if not objs:
+        return objs
+
+    session = object_session(objs[0])
+    for name in relations:
+        id_attr, type_name = objs[0]._relations[name]
+        pending = [o for o in objs if not o._has_related(name)]
+        if not pending:
+            continue
+
+        related_ids = []
+        for o in pending:
+            ids = getattr(o, id_attr)
+            if isinstance(ids, list):
+                related_ids.extend(ids)
+            elif ids is not None:
+                related_ids.append(ids)
+
+        loaded = _load_by_ids(session, globals()[type_name], related_ids)
+        for o in pending:
+            o._set_related(name, loaded)
+    return objs
+
+
+class RelatedMixin(object):
+    """Lazy accessors for objects referenced through id columns. _relations maps a relation name
+    to (id attribute, related class name), where the id attribute holds either a single id or a
+    list of ids. Related objects are loaded in one query on first access and memoized until the
+    referenced ids change. Ids that cannot be found in the database are skipped."""
+    _relations = {}
+
+    def _has_related(self, name):
+        """Returns whether relation name is memoized for the current ids."""
+        ids = getattr(self, self._relations[name][0])
+        cached = self.__dict__.get('_related_cache', {}).get(name)
+        return cached is not None and cached[0] == (tuple(ids) if isinstance(ids, list) else ids)
+
+    def _get_related(self, name):
+        if self._has_related(name):
+            return self._related_cache[name][1]
+        id_attr, type_name = self._relations[name]
+        ids = getattr(self, id_attr)
+
+        session = object_session(self)
+        if session is None:  # Not yet added to the database, so nothing can be loaded
+            return [] if isinstance(ids, list) else None
+
+        related_ids = list(ids) if isinstance(ids, list) else [ids] if ids is not None else []
+        return self._set_related(name, _load_by_ids(session, globals()[type_name], related_ids))
+
+    def _set_related(self, name, loaded):
+        """Memoizes related objects for relation name from loaded, a dict mapping id to object."""
+        id_attr, type_name = self._relations[name]
+        ids = getattr(self, id_attr)
+        if isinstance(ids, list):
+            key = tuple(ids)
+            related = [loaded[obj_id] for obj_id in ids if obj_id in loaded]
+        else:
+            key = ids
+            related = loaded.get(ids)
+
+        self.__dict__.setdefault('_related_cache', {})[name] = (key, related)
+        return related
+
+
+class User(RelatedMixin, Base):
     """Usernames are assumed to be unique (e.g. Discord user id)."""
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_deleted', 'deleted_time', sqlite_where=text('deleted_time IS NOT NULL')),
+    )
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     username = Column(Unicode(40))
     events_organised_ids = Column(MutableList.as_mutable(PickleType))
     events_attending_ids = Column(MutableList.as_mutable(PickleType))
     survey_ids = Column(MutableList.as_mutable(PickleType))
     question_ids = Column(MutableList.as_mutable(PickleType))
     response_ids = Column(MutableList.as_mutable(PickleType))
+    deleted_time = Column(DateTime)  # Set when soft deleted, until collected - see PorgWrapper.collect_garbage
+
+    _relations = {
+        'events_organised': ('events_organised_ids', 'Event'),
+        'events_attending': ('events_attending_ids', 'Event'),
+        'surveys': ('survey_ids', 'Survey'),
+        'questions': ('question_ids', 'Question'),
+        'responses': ('response_ids', 'Response'),
+    }
 
     def __init__(self, username):
         assert isinstance(username, str)
@@ -29,6 +165,7 @@ class User(Base):
         self.survey_ids = []
         self.question_ids = []
         self.response_ids = []
+        self.deleted_time = None
 
     def __str__(self):
         return '{\n' + \
@@ -62,10 +199,35 @@ class User(Base):
     def get_response_ids(self):
         return self.response_ids
 
+    def get_deleted_time(self):
+        return self.deleted_time
+
+    def is_deleted(self):
+        return self.deleted_time is not None
+
+    def get_events_organised(self):
+        return self._get_related('events_organised')
+
+    def get_events_attending(self):
+        return self._get_related('events_attending')
+
+    def get_surveys(self):
+        return self._get_related('surveys')
+
+    def get_questions(self):
+        return self._get_related('questions')
+
+    def get_responses(self):
+        return self._get_related('responses')
+
     def set_username(self, username):
         assert isinstance(username, str)
         self.username = username
 
+    def set_deleted_time(self, deleted_time):
+        assert isinstance(deleted_time, datetime)
+        self.deleted_time = deleted_time
+
     def add_event_organised(self, event_obj):
         """event_obj may be an int denoting an Event id or an Event object. Event is not added
         if it already exists. Raises TypeError if event_obj is not either type."""
@@ -167,15 +329,41 @@ class User(Base):
             self.response_ids.remove(response_obj)
 
 
-class Event(Base):
+def _add_months(time, months):
+    """Returns time moved forward by months, clamping the day to the end of shorter months."""
+    month = time.month - 1 + months
+    year, month = time.year + month // 12, month % 12 + 1
+    return time.replace(year=year, month=month,
+                        day=min(time.day, calendar.monthrange(year, month)[1]))
+
+
+class Event(RelatedMixin, Base):
     __tablename__ = 'events'
+    __table_args__ = (
+        Index('ix_events_series_time', 'series_id', 'time', unique=True),
+        Index('ix_events_deleted', 'deleted_time', sqlite_where=text('deleted_time IS NOT NULL')),
+    )
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     name = Column(Unicode(40))
     owner_id = Column(Integer)
     location = Column(Unicode(40))
     time = Column(DateTime)
     attendance_ids = Column(MutableList.as_mutable(PickleType))
     survey_ids = Column(MutableList.as_mutable(PickleType))
+    recurrence = Column(Unicode(40))  # One of porg_config.RECURRENCE_TYPES, or None
+    recurrence_end = Column(DateTime)  # No occurrences after this time if not None
+    recurrence_count = Column(Integer)  # Number of occurrences (including this event) if not None
+    materialized_until = Column(DateTime)  # Time of the last occurrence created as an Event
+    series_id = Column(Integer)  # Id of the recurring Event this occurrence was created from
+    deleted_time = Column(DateTime)  # Set when soft deleted, until collected - see PorgWrapper.collect_garbage
+
+    _relations = {
+        'owner': ('owner_id', 'User'),
+        'attendances': ('attendance_ids', 'Attendance'),
+        'surveys': ('survey_ids', 'Survey'),
+    }
 
     def __init__(self, name, owner_id, location=None, time=None, survey_ids=[]):
         assert isinstance(name, str)
@@ -193,6 +381,12 @@ class Event(Base):
         self.time = time
         self.attendance_ids = []
         self.survey_ids = survey_ids
+        self.recurrence = None
+        self.recurrence_end = None
+        self.recurrence_count = None
+        self.materialized_until = None
+        self.series_id = None
+        self.deleted_time = None
 
     def __str__(self):
         return '{\n' + \
@@ -203,6 +397,8 @@ class Event(Base):
                '    time: {}\n'.format(self.time) + \
                '    attendance_ids: {}\n'.format(self.attendance_ids) + \
                '    survey_ids: {}\n'.format(self.survey_ids) + \
+               '    recurrence: {}\n'.format(self.recurrence) + \
+               '    series_id: {}\n'.format(self.series_id) + \
                '}'
 
     def get_id(self):
@@ -226,6 +422,76 @@ class Event(Base):
     def get_survey_ids(self):
         return self.survey_ids
 
+    def get_recurrence(self):
+        return self.recurrence
+
+    def get_recurrence_end(self):
+        return self.recurrence_end
+
+    def get_recurrence_count(self):
+        return self.recurrence_count
+
+    def get_materialized_until(self):
+        return self.materialized_until
+
+    def get_series_id(self):
+        return self.series_id
+
+    def is_recurring(self):
+        return self.recurrence is not None
+
+    def get_deleted_time(self):
+        return self.deleted_time
+
+    def is_deleted(self):
+        return self.deleted_time is not None
+
+    def iter_occurrences(self, after=None):
+        """Yields the start time of each occurrence of the event in order, starting with its own
+        time, or with the first occurrence later than after if given (found arithmetically, without
+        stepping through the earlier ones). An event that doesn't recur (or has no time) has at most
+        one occurrence. Times are computed lazily, so a series without an end can be iterated as
+        far as needed."""
+        if self.time is None:
+            return
+        if not self.recurrence:
+            if after is None or self.time > after:
+                yield self.time
+            return
+
+        # Index of the first occurrence that may be later than after
+        start = 0
+        if after is not None and after > self.time:
+            if self.recurrence == 'daily':
+                start = (after - self.time) // timedelta(days=1)
+            elif self.recurrence == 'weekly':
+                start = (after - self.time) // timedelta(weeks=1)
+            else:
+                start = (after.year - self.time.year) * 12 + after.month - self.time.month - 1
+
+        for n in itertools.count(max(start, 0)):
+            if self.recurrence_count is not None and n >= self.recurrence_count:
+                return
+            if self.recurrence == 'daily':
+                time = self.time + timedelta(days=n)
+            elif self.recurrence == 'weekly':
+                time = self.time + timedelta(weeks=n)
+            else:  # Counted from the first occurrence, so Jan 31 gives Feb 28 then Mar 31
+                time = _add_months(self.time, n)
+            if self.recurrence_end is not None and time > self.recurrence_end:
+                return
+            if after is None or time > after:
+                yield time
+
+    def get_owner(self):
+        return self._get_related('owner')
+
+    def get_attendances(self):
+        return self._get_related('attendances')
+
+    def get_surveys(self):
+        return self._get_related('surveys')
+
     def set_name(self, name):
         assert isinstance(name, str)
         self.name = name
@@ -242,6 +508,32 @@ class Event(Base):
         assert isinstance(time, datetime)
         self.time = time
 
+    def set_deleted_time(self, deleted_time):
+        assert isinstance(deleted_time, datetime)
+        self.deleted_time = deleted_time
+
+    def set_recurrence(self, recurrence, end=None, count=None):
+        """Makes the event repeat every day, week or month (see porg_config.RECURRENCE_TYPES),
+        until end and/or for count occurrences. recurrence None stops the event repeating."""
+        assert recurrence in porg_config.RECURRENCE_TYPES or recurrence is None
+        assert isinstance(end, datetime) or end is None
+        assert isinstance(count, int) or count is None
+        self.recurrence = recurrence
+        self.recurrence_end = end
+        self.recurrence_count = count
+
+    def set_materialized_until(self, time):
+        assert isinstance(time, datetime)
+        self.materialized_until = time
+
+    def set_series_id(self, event_obj):
+        if isinstance(event_obj, Event):
+            event_obj = event_obj.get_id()
+        elif not isinstance(event_obj, int):
+            raise TypeError("Invalid object type for set_series_id: expected int or Event")
+
+        self.series_id = event_obj
+
     def add_attendance_id(self, attendance_obj):
         """attendance_obj may be an int denoting an Attendance id or an Attendance object.
         Attendance id is not added if it already exists. Raises TypeError if attendance_obj is
@@ -286,7 +578,13 @@ class Event(Base):
 
 class Attendance(Base):
     __tablename__ = 'attendance'
+    __table_args__ = (
+        Index('ix_attendance_event_user', 'event_id', 'user_id', unique=True),
+        Index('ix_attendance_event_status', 'event_id', 'going_status', 'user_id'),
+    )
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     user_id = Column(Integer)
     event_id = Column(Integer)
     going_status = Column(Unicode(40))
@@ -344,9 +642,65 @@ class Attendance(Base):
             self.roles.remove(role)
 
 
+class AttendanceRole(Base):
+    """Queryable copy of a single entry of Attendance.roles. user_id and event_id are copied from
+    the parent Attendance so role lookups do not need to join or unpickle Attendance rows."""
+    __tablename__ = 'attendance_roles'
+    __table_args__ = (
+        Index('ix_attendance_roles_attendance_role', 'attendance_id', 'role', unique=True),
+        Index('ix_attendance_roles_event_role', 'event_id', 'role'),
+        Index('ix_attendance_roles_user', 'user_id'),
+    )
+    id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
+    attendance_id = Column(Integer)
+    user_id = Column(Integer)
+    event_id = Column(Integer)
+    role = Column(Unicode(40))
+
+    def __init__(self, attendance_id, user_id, event_id, role):
+        assert isinstance(attendance_id, int)
+        assert isinstance(user_id, int)
+        assert isinstance(event_id, int)
+        assert isinstance(role, str)
+
+        self.id = None
+        self.attendance_id = attendance_id
+        self.user_id = user_id
+        self.event_id = event_id
+        self.role = role
+
+    def __str__(self):
+        return '{\n' + \
+               '    id: {},\n'.format(self.id) + \
+               '    attendance_id: {},\n'.format(self.attendance_id) + \
+               '    user_id: {},\n'.format(self.user_id) + \
+               '    event_id: {},\n'.format(self.event_id) + \
+               '    role: {}\n'.format(self.role) + \
+               '}'
+
+    def get_id(self):
+        return self.id
+
+    def get_attendance_id(self):
+        return self.attendance_id
+
+    def get_user_id(self):
+        return self.user_id
+
+    def get_event_id(self):
+        return self.event_id
+
+    def get_role(self):
+        return self.role
+
+
 class Choice(Base):
     __tablename__ = 'choices'
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     question_id = Column(Integer)
     choice = Column(Unicode(40))
 
@@ -386,14 +740,22 @@ class Choice(Base):
         self.choice = choice
 
 
-class Response(Base):
+class Response(RelatedMixin, Base):
     __tablename__ = 'responses'
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     response_text = Column(Unicode(40))
     responder_id = Column(Integer)
     question_id = Column(Integer)
     choice_ids = Column(MutableList.as_mutable(PickleType))
 
+    _relations = {
+        'responder': ('responder_id', 'User'),
+        'question': ('question_id', 'Question'),
+        'choices': ('choice_ids', 'Choice'),
+    }
+
     def __init__(self, responder_id, question_id, response_text=None, choice_ids=[]):
         assert isinstance(responder_id, int)
         assert isinstance(question_id, int)
@@ -432,6 +794,15 @@ class Response(Base):
     def get_choice_ids(self):
         return self.choice_ids
 
+    def get_responder(self):
+        return self._get_related('responder')
+
+    def get_question(self):
+        return self._get_related('question')
+
+    def get_choices(self):
+        return self._get_related('choices')
+
     def set_response_text(self, response_text):
         assert isinstance(response_text, str)
         self.response_text = response_text
@@ -455,9 +826,11 @@ class Response(Base):
             self.choice_ids.remove(choice_obj)
 
 
-class Question(Base):
+class Question(RelatedMixin, Base):
     __tablename__ = 'questions'
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     owner_id = Column(Integer)
     question = Column(Unicode(40))
     question_type = Column(Unicode(40))
@@ -465,6 +838,13 @@ class Question(Base):
     allowed_choice_ids = Column(MutableList.as_mutable(PickleType))
     response_ids = Column(MutableList.as_mutable(PickleType))
 
+    _relations = {
+        'owner': ('owner_id', 'User'),
+        'survey': ('survey_id', 'Survey'),
+        'choices': ('allowed_choice_ids', 'Choice'),
+        'responses': ('response_ids', 'Response'),
+    }
+
     def __init__(self, owner_id, question, question_type, survey_id=None, allowed_choice_ids=[]):
         assert isinstance(owner_id, int)
         assert isinstance(question, str)
@@ -511,9 +891,25 @@ class Question(Base):
     def get_allowed_choice_ids(self):
         return self.allowed_choice_ids
 
+    def get_allowed_choice_set(self):
+        """Returns allowed_choice_ids as a frozenset, for checking many choice ids at once."""
+        return frozenset(self.allowed_choice_ids)
+
     def get_response_ids(self):
         return self.response_ids
 
+    def get_owner(self):
+        return self._get_related('owner')
+
+    def get_survey(self):
+        return self._get_related('survey')
+
+    def get_choices(self):
+        return self._get_related('choices')
+
+    def get_responses(self):
+        return self._get_related('responses')
+
     def set_owner_id(self, owner_id):
         assert isinstance(owner_id, int)
         self.owner_id = owner_id
@@ -571,13 +967,26 @@ class Question(Base):
             self.response_ids.remove(response_obj)
 
 
-class Survey(Base):
+class Survey(RelatedMixin, Base):
     __tablename__ = 'surveys'
+    __table_args__ = (
+        Index('ix_surveys_deleted', 'deleted_time', sqlite_where=text('deleted_time IS NOT NULL')),
+    )
     id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
     owner_id = Column(Integer)
     name = Column(Unicode(40))
     event_id = Column(Integer)
     question_ids = Column(MutableList.as_mutable(PickleType))
+    closed_time = Column(DateTime)  # None while the survey is open
+    deleted_time = Column(DateTime)  # Set when soft deleted, until collected - see PorgWrapper.collect_garbage
+
+    _relations = {
+        'owner': ('owner_id', 'User'),
+        'event': ('event_id', 'Event'),
+        'questions': ('question_ids', 'Question'),
+    }
 
     def __init__(self, name, owner_id, question_ids=[], event_id=None):
         assert isinstance(name, str)
@@ -592,6 +1001,8 @@ class Survey(Base):
         self.owner_id = owner_id
         self.event_id = event_id
         self.question_ids = question_ids
+        self.closed_time = None
+        self.deleted_time = None
 
     def __str__(self):
         return '{\n' + \
@@ -600,6 +1011,7 @@ class Survey(Base):
                '    owner_id: {},\n'.format(self.owner_id) + \
                '    event_id: {},\n'.format(self.event_id) + \
                '    question_ids: {},\n'.format(self.question_ids) + \
+               '    closed_time: {},\n'.format(self.closed_time) + \
                '}'
 
     def get_id(self):
@@ -617,6 +1029,35 @@ class Survey(Base):
     def get_event_id(self):
         return self.event_id
 
+    def get_closed_time(self):
+        return self.closed_time
+
+    def is_closed(self):
+        return self.closed_time is not None
+
+    def get_deleted_time(self):
+        return self.deleted_time
+
+    def is_deleted(self):
+        return self.deleted_time is not None
+
+    def get_owner(self):
+        return self._get_related('owner')
+
+    def get_event(self):
+        return self._get_related('event')
+
+    def get_questions(self):
+        return self._get_related('questions')
+
+    def set_closed_time(self, closed_time):
+        assert isinstance(closed_time, datetime)
+        self.closed_time = closed_time
+
+    def set_deleted_time(self, deleted_time):
+        assert isinstance(deleted_time, datetime)
+        self.deleted_time = deleted_time
+
     def set_name(self, name):
         assert isinstance(name, str)
         self.name = name
@@ -650,3 +1091,58 @@ class Survey(Base):
             raise TypeError("Invalid object type for set_event_id: expected int or Event")
 
         self.event_id = event_obj
+
+
+class SurveyResult(Base):
+    """Final tallies of a closed Survey, computed once by PorgWrapper.close_survey.
+    response_counts maps question id to the number of Responses to the question, and
+    choice_counts maps question id to a dict of choice id to the number of Responses that selected
+    the choice (including choices nobody selected)."""
+    __tablename__ = 'survey_results'
+    __table_args__ = (
+        Index('ix_survey_results_survey', 'survey_id', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)  # Bumped on every update - see PorgConcurrency.retry_on_conflict
+    __mapper_args__ = {'version_id_col': version_id}
+    survey_id = Column(Integer)
+    closed_time = Column(DateTime)
+    response_counts = Column(PickleType)
+    choice_counts = Column(PickleType)
+
+    def __init__(self, survey_id, closed_time, response_counts, choice_counts):
+        assert isinstance(survey_id, int)
+        assert isinstance(closed_time, datetime) or closed_time is None
+        assert isinstance(response_counts, dict)
+        assert isinstance(choice_counts, dict)
+
+        self.id = None
+        self.survey_id = survey_id
+        self.closed_time = closed_time
+        self.response_counts = response_counts
+        self.choice_counts = choice_counts
+
+    def __str__(self):
+        return '{\n' + \
+               '    id: {},\n'.format(self.id) + \
+               '    survey_id: {},\n'.format(self.survey_id) + \
+               '    closed_time: {},\n'.format(self.closed_time) + \
+               '    response_counts: {},\n'.format(self.response_counts) + \
+               '    choice_counts: {}\n'.format(self.choice_counts) + \
+               '}'
+
+    def get_id(self):
+        return self.id
+
+    def get_survey_id(self):
+        return self.survey_id
+
+    def get_closed_time(self):
+        return self.closed_time
+
+    def get_response_count(self, question_id):
+        return self.response_counts.get(question_id, 0)
+
+    def get_choice_counts(self, question_id):
+        """Returns a dict mapping choice id to the number of Responses that selected it."""
+        return self.choice_counts.get(question_id, {})
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3.5
+"""
+Cache of rendered text (e.g. the Discord views of events and surveys), validated by version stamps.
+"""
+import itertools
+from collections import OrderedDict
+from Poorganiser import Event, Survey
+from PorgEvents import *
+
+
+class RenderCache:
+    """Maps a key (e.g. ('full_event', event id)) to the text rendered for it (or any other value
+    computed from an object) and the version stamp of the object it was rendered from. A lookup with a different version re-renders, so entries
+    never need to be invalidated explicitly. At most max_size entries are kept, least recently used
+    entries are dropped first."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (version, text), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, render):
+        """Returns the text cached for key at version, calling render() to produce (and cache) it
+        if there is none."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        text = render()
+        self._entries[key] = (version, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return text
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class VersionTracker:
+    """Keeps a version stamp per Event and Survey, updated from the changes published on an
+    EventBus. An Event's stamp changes with the event and its attendances and roles, a Survey's
+    with the survey and its questions and choices. Stamps are kept for at most max_size objects,
+    least recently bumped first; objects without one share the newest stamp dropped."""
+
+    def __init__(self, bus, max_size):
+        self.max_size = max_size
+        self._versions = OrderedDict()  # (object type, object id) -> version stamp, oldest first
+        self._floor = 0  # Newest stamp dropped from _versions
+        self._counter = itertools.count(1)
+        bus.subscribe(self.handle, types=[EventCreated, EventUpdated, EventDeleted,
+                                          AttendanceAdded, AttendanceChanged, AttendanceRemoved,
+                                          SurveyCreated, SurveyClosed, SurveyDeleted,
+                                          QuestionAdded, QuestionDeleted, ChoiceAdded,
+                                          ChoiceDeleted])
+
+    def get(self, obj_type, obj_id):
+        return self._versions.get((obj_type, obj_id), self._floor)
+
+    def handle(self, change):
+        if hasattr(change, 'survey_id'):
+            self.bump(Survey, change.survey_id)
+        else:
+            self.bump(Event, change.event_id)
+
+    def bump(self, obj_type, obj_id):
+        # Stamps come from a single counter so an id that is deleted and reused never repeats one
+        # Dropping a stamp raises the floor past it, so an object that loses its stamp still gets
+        # a newer one than anything rendered before its last change
+        if obj_id:
+            self._versions[(obj_type, obj_id)] = next(self._counter)
+            self._versions.move_to_end((obj_type, obj_id))
+            while len(self._versions) > self.max_size:
+                self._floor = self._versions.popitem(last=False)[1]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3.5
+"""
+Optimistic concurrency control for several processes writing to the same database.
+
+Every model has a version_id column that SQLAlchemy checks and bumps on each UPDATE or DELETE
+(see Poorganiser), so a process that changes an object another process has changed since it was
+loaded gets a StaleDataError instead of silently overwriting the other change. PorgWrapper methods
+that write are wrapped in retry_on_conflict, which runs them in a single transaction and retries
+them on such conflicts.
+"""
+import functools
+import random
+import time
+from collections import Counter
+from sqlalchemy.orm.exc import StaleDataError
+from config import porg_config
+
+
+class ConflictStats:
+    """Counts calls, conflicts and failures (calls still conflicting after their last retry) of
+    each retried method, by method name."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.conflicts = Counter()
+        self.failures = Counter()
+
+    def get_conflict_rate(self, name=None):
+        """Returns the number of conflicts per call of method name (default all methods)."""
+        calls = self.calls[name] if name else sum(self.calls.values())
+        conflicts = self.conflicts[name] if name else sum(self.conflicts.values())
+        return conflicts / calls if calls else 0.0
+
+    def clear(self):
+        self.calls.clear()
+        self.conflicts.clear()
+        self.failures.clear()
+
+
+def retry_on_conflict(method):
+    """Decorates a PorgWrapper method so it runs in a single transaction which is retried, after
+    rolling back, if it conflicts with a change made by another process. Retries are made up to
+    porg_config.CONFLICT_RETRIES times, waiting porg_config.CONFLICT_BACKOFF seconds (doubled for
+    each retry, with jitter) before each. Conflicts are counted in the wrapper's conflict_stats.
+
+    Calls made while a transaction is already open (e.g. from another retried method) are part of
+    that transaction, so are retried with it rather than on their own. Changes published by an
+    attempt that is rolled back are not withdrawn.
+
+    The backoff sleeps the calling thread. Under an event loop, retried methods must be called off
+    the loop (e.g. with CommandRouter.ShardExecutors.run, as interface_discord does) so a retry
+    never stalls other work."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(porg, *args, **kwargs):
+        db_interface = porg.db_interface
+        if db_interface.in_transaction():
+            return method(porg, *args, **kwargs)
+
+        porg.conflict_stats.calls[name] += 1
+        for attempt in range(porg_config.CONFLICT_RETRIES + 1):
+            try:
+                with db_interface.transaction():
+                    return method(porg, *args, **kwargs)
+            except StaleDataError:
+                porg.conflict_stats.conflicts[name] += 1
+                if attempt == porg_config.CONFLICT_RETRIES:
+                    porg.conflict_stats.failures[name] += 1
+                    raise
+            # Objects are reloaded after the rollback, so the retry sees the other change
+            time.sleep(porg_config.CONFLICT_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    return wrapper
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3.5
+"""
+In-process publish/subscribe of changes made through PorgWrapper.
+
+Every PorgWrapper method that creates, updates or deletes an object publishes a ChangeEvent to its
+EventBus (PorgWrapper.events), e.g.:
+
+    porg.events.subscribe(lambda change: print(change), types=[AttendanceAdded, AttendanceRemoved])
+
+Subscribers that only need to know that something changed (e.g. to drop a cache) can ask for
+batches, and are then called with a list of the distinct changes since their last batch.
+"""
+import traceback
+
+
+class ChangeEvent:
+    """Base class of all change events. Subclasses list their attributes in fields; changes are
+    equal if they have the same type and field values."""
+    fields = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.fields):
+            raise TypeError("{} takes {} values ({}), {} given".format(
+                type(self).__name__, len(self.fields), ', '.join(self.fields), len(values)))
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash((type(self), self._values()))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(field, value) for field, value in zip(self.fields, self._values())))
+
+
+class UserRegistered(ChangeEvent):
+    fields = ('user_id',)
+
+
+class UserUnregistered(ChangeEvent):
+    fields = ('user_id',)
+
+
+class EventCreated(ChangeEvent):
+    fields = ('event_id', 'owner_id')
+
+
+class EventUpdated(ChangeEvent):
+    fields = ('event_id',)
+
+
+class EventDeleted(ChangeEvent):
+    fields = ('event_id',)
+
+
+class AttendanceAdded(ChangeEvent):
+    fields = ('attendance_id', 'event_id', 'user_id')
+
+
+class AttendanceChanged(ChangeEvent):
+    """The going status or roles of an Attendance changed."""
+    fields = ('attendance_id', 'event_id', 'user_id')
+
+
+class AttendanceRemoved(ChangeEvent):
+    fields = ('attendance_id', 'event_id', 'user_id')
+
+
+class SurveyCreated(ChangeEvent):
+    fields = ('survey_id', 'event_id')
+
+
+class SurveyClosed(ChangeEvent):
+    fields = ('survey_id', 'event_id')
+
+
+class SurveyDeleted(ChangeEvent):
+    fields = ('survey_id', 'event_id')
+
+
+class QuestionAdded(ChangeEvent):
+    fields = ('question_id', 'survey_id')
+
+
+class QuestionDeleted(ChangeEvent):
+    fields = ('question_id', 'survey_id')
+
+
+class ChoiceAdded(ChangeEvent):
+    fields = ('choice_id', 'question_id', 'survey_id')
+
+
+class ChoiceDeleted(ChangeEvent):
+    fields = ('choice_id', 'question_id', 'survey_id')
+
+
+class ResponseAdded(ChangeEvent):
+    fields = ('response_id', 'question_id', 'responder_id')
+
+
+class ResponseDeleted(ChangeEvent):
+    fields = ('response_id', 'question_id', 'responder_id')
+
+
+class Subscription:
+    def __init__(self, handler, types, batch_size):
+        self.handler = handler
+        self.types = tuple(types) if types else (ChangeEvent,)
+        self.batch_size = batch_size
+        self.pending = {}  # Distinct changes waiting to be delivered, in order (values unused)
+
+    def deliver(self, changes):
+        try:
+            self.handler(changes)
+        except Exception:  # A broken subscriber must not break the change that was made
+            traceback.print_exc()
+
+
+class EventBus:
+    def __init__(self):
+        self._subscriptions = []
+
+    def subscribe(self, handler, types=None, batch_size=None):
+        """Calls handler for every published change that is an instance of one of types (default
+        all changes). If batch_size is None, handler is called with each change as it is
+        published. Otherwise handler is called with a list of the distinct changes published
+        since its last call, once batch_size of them are pending or when flush() is called.
+        Returns a Subscription that can be passed to unsubscribe()."""
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        subscription = Subscription(handler, types, batch_size)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.remove(subscription)
+
+    def publish(self, change):
+        for subscription in list(self._subscriptions):
+            if not isinstance(change, subscription.types):
+                continue
+            if subscription.batch_size is None:
+                subscription.deliver(change)
+            else:
+                subscription.pending[change] = None
+                if len(subscription.pending) >= subscription.batch_size:
+                    self._flush_subscription(subscription)
+
+    def flush(self):
+        """Delivers pending changes to every batched subscriber."""
+        for subscription in list(self._subscriptions):
+            if subscription.pending:
+                self._flush_subscription(subscription)
+
+    def _flush_subscription(self, subscription):
+        changes = list(subscription.pending)
+        subscription.pending.clear()
+        subscription.deliver(changes)
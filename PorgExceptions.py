@@ -56,6 +56,12 @@ class ResponseNotFoundError(Error):
     pass
 
 
+class InvalidRecurrenceError(Error):
+    """Raised when an Event is given a recurrence that is not allowed by
+    config.RECURRENCE_TYPES, or a recurrence without a time."""
+    pass
+
+
 class InvalidResponseError(Error):
     """Raised when a Response object is created that does not match the question_type of its
     parent Question."""
@@ -65,3 +71,8 @@ class InvalidResponseError(Error):
 class SurveyNotFoundError(Error):
     """Raised when a Survey object is expected but cannot be found in the database."""
     pass
+
+
+class SurveyClosedError(Error):
+    """Raised when attempting to respond to or close a Survey that has already been closed."""
+    pass
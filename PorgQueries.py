@@ -0,0 +1,104 @@
+#!/usr/bin/env python3.5
+"""
+Baked queries for PorgWrapper's most frequent reads.
+
+Building a Query (filter expressions, joins) and compiling it to SQL costs more Python time than
+running it against SQLite for these small lookups. Each query here is built and compiled once per
+process, the first time it runs, then reused with new values for its bound parameters, e.g.:
+
+    USER_BY_USERNAME(session).params(username="bob").first()
+
+The SQL text is the same on every call, so SQLite's per-connection statement cache (see
+porg_config.STATEMENT_CACHE_SIZE) reuses the prepared statement as well. Baking can be turned off
+for a session with session.enable_baked_queries = False (see porg_benchmark.py).
+"""
+from sqlalchemy import and_, bindparam, func, or_
+from sqlalchemy.ext import baked
+from Poorganiser import User, Event, Attendance, AttendanceRole
+from PorgRows import EventRow
+
+bakery = baked.bakery()
+
+EVENT_ROW_COLUMNS = [getattr(Event, field) for field in EventRow._fields]
+
+USER_BY_USERNAME = bakery(lambda s: s.query(User))
+USER_BY_USERNAME += lambda q: q.filter(User.username == bindparam('username'),
+                                       User.deleted_time == None)
+
+# Column order matches the (event_id, user_id) unique index on Attendance
+ATTENDANCE = bakery(lambda s: s.query(Attendance))
+ATTENDANCE += lambda q: q.filter(Attendance.event_id == bindparam('event_id'),
+                                 Attendance.user_id == bindparam('user_id'))
+
+ALL_EVENTS = bakery(lambda s: s.query(Event))
+ALL_EVENTS += lambda q: q.filter(Event.deleted_time == None)
+
+CURR_EVENTS = bakery(lambda s: s.query(Event))
+CURR_EVENTS += lambda q: q.filter(or_(Event.time >= bindparam('today'), Event.time == None),
+                                  Event.deleted_time == None)
+
+ALL_EVENT_ROWS = bakery(lambda s: s.query(*EVENT_ROW_COLUMNS))
+ALL_EVENT_ROWS += lambda q: q.filter(Event.deleted_time == None).order_by(Event.id)
+
+CURR_EVENT_ROWS = bakery(lambda s: s.query(*EVENT_ROW_COLUMNS))
+CURR_EVENT_ROWS += lambda q: q.filter(or_(Event.time >= bindparam('today'), Event.time == None),
+                                      Event.deleted_time == None).order_by(Event.id)
+
+USER_EVENT_ROWS = bakery(lambda s: s.query(*EVENT_ROW_COLUMNS + [Attendance.going_status,
+                                                                 Attendance.roles]))
+USER_EVENT_ROWS += lambda q: q.join(Attendance, Attendance.event_id == Event.id) \
+    .filter(Attendance.user_id == bindparam('user_id'), Event.deleted_time == None) \
+    .order_by(Event.id)
+
+# Attendances of soft deleted users are left out, as in ROSTER
+EVENT_HEADCOUNT = bakery(lambda s: s.query(Attendance.going_status, func.count(Attendance.id)))
+EVENT_HEADCOUNT += lambda q: q.outerjoin(User, User.id == Attendance.user_id) \
+    .filter(Attendance.event_id == bindparam('event_id'), User.deleted_time == None) \
+    .group_by(Attendance.going_status)
+
+# Archived events are read from the archive, which has no users, so attendances of soft deleted
+# users are left out by id (read from the main database) instead
+ARCHIVED_EVENT_HEADCOUNT = bakery(lambda s: s.query(Attendance.going_status,
+                                                    func.count(Attendance.id)))
+ARCHIVED_EVENT_HEADCOUNT += lambda q: q.filter(
+    Attendance.event_id == bindparam('event_id'),
+    Attendance.user_id.notin_(bindparam('deleted_user_ids', expanding=True))) \
+    .group_by(Attendance.going_status)
+
+
+def _roster_after(q):
+    return q.filter(or_(Attendance.going_status > bindparam('going_status'),
+                        and_(Attendance.going_status == bindparam('going_status'),
+                             Attendance.user_id > bindparam('after_user_id'))))
+
+
+def _roster_page(q):
+    return q.order_by(Attendance.going_status, Attendance.user_id).limit(bindparam('limit'))
+
+
+# The first page of a roster, and the page after a (going_status, user_id) cursor. Archived
+# events' rosters are read from the archive, which has no users, so usernames are read from the
+# main database with USERNAMES, and attendances of soft deleted users are left out by id as in
+# ARCHIVED_EVENT_HEADCOUNT.
+ROSTER = bakery(lambda s: s.query(Attendance.id, Attendance.user_id, Attendance.going_status,
+                                  Attendance.roles))
+ARCHIVED_ROSTER = ROSTER + (lambda q: q.filter(
+    Attendance.event_id == bindparam('event_id'),
+    Attendance.user_id.notin_(bindparam('deleted_user_ids', expanding=True))))
+ROSTER += lambda q: q.outerjoin(User, User.id == Attendance.user_id) \
+    .filter(Attendance.event_id == bindparam('event_id'), User.deleted_time == None)
+ROSTER_AFTER = ROSTER + _roster_after
+ARCHIVED_ROSTER_AFTER = ARCHIVED_ROSTER + _roster_after
+ROSTER += _roster_page
+ROSTER_AFTER += _roster_page
+ARCHIVED_ROSTER += _roster_page
+ARCHIVED_ROSTER_AFTER += _roster_page
+
+USERNAMES = bakery(lambda s: s.query(User.id, User.username))
+USERNAMES += lambda q: q.filter(User.id.in_(bindparam('user_ids', expanding=True)),
+                                User.deleted_time == None)
+
+ROLES_FOR_USER = bakery(lambda s: s.query(AttendanceRole.event_id, AttendanceRole.role))
+ROLES_FOR_USER += lambda q: q.join(Event, Event.id == AttendanceRole.event_id) \
+    .filter(AttendanceRole.user_id == bindparam('user_id'), Event.deleted_time == None) \
+    .order_by(AttendanceRole.id)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3.5
+"""
+Reminders sent a set time before each event starts.
+
+Upcoming events are read from a database once, when the scheduler starts watching it. After that
+the schedule is kept up to date from the changes PorgWrapper publishes (see PorgEvents), so the
+events table is never polled.
+"""
+import asyncio
+import heapq
+import itertools
+import traceback
+from datetime import datetime
+from config import porg_config
+from Poorganiser import User, Event, Attendance
+from PorgEvents import EventCreated, EventUpdated, EventDeleted
+
+
+class ReminderScheduler:
+    """Calls callback(shard key, event, offset, attendees) at event time - offset for each offset,
+    where attendees is the list of Users going to the event. Reminders whose time has already
+    passed when an event is scheduled (e.g. an event created an hour before it starts with a one
+    day offset) are skipped.
+
+    One scheduler can cover several databases (see PorgShards), identified by shard key. With a
+    single database, use None as the shard key."""
+
+    def __init__(self, get_porg, callback, offsets=None, loop=None):
+        """get_porg(shard key) must return the PorgWrapper for a shard key, e.g. ShardManager.get.
+        offsets defaults to porg_config.REMINDER_OFFSETS. callback may be a coroutine function
+        when reminders are sent by run(). If loop is given, the schedule is only changed on it
+        (see watch()) even before run() has started, as run() must then run on it."""
+        self.get_porg = get_porg
+        self.callback = callback
+        self.offsets = sorted(offsets or porg_config.REMINDER_OFFSETS, reverse=True)
+        self._heap = []  # (reminder time, sequence number, (shard key, event id), event time, offset)
+        self._sequence = itertools.count()  # Breaks ties between reminders at the same time
+        self._event_times = {}  # (shard key, event id) -> scheduled event time
+        self._subscriptions = {}  # shard key -> (PorgWrapper, Subscription)
+        self._changed = None  # Set when the schedule changes, to wake run() up
+        self.loop = loop
+        self._loop = loop  # The event loop the schedule is changed on, once run() is running
+
+    def watch(self, porg, shard_key=None, now=None):
+        """Schedules reminders for the upcoming events in porg's database and follows changes made
+        through porg. Call again with the new PorgWrapper if the database is reopened. Reading the
+        upcoming events scans the events table, so this may be called on the shard's thread (see
+        CommandRouter.ShardExecutors) once run() has started or with the loop given to __init__;
+        the reminders are then scheduled on the loop, in order with later changes."""
+        self.unwatch(shard_key)
+        subscription = porg.events.subscribe(lambda change: self._handle(porg, shard_key, change),
+                                             types=[EventCreated, EventUpdated, EventDeleted])
+        self._subscriptions[shard_key] = (porg, subscription)
+
+        # Events without a time are never reminded about
+        now = now or datetime.now()
+        for event_id, time in porg.db_interface.s.query(Event.id, Event.time) \
+                .filter(Event.time > now, Event.deleted_time == None):
+            self._schedule_soon(shard_key, event_id, time, now)
+
+    def unwatch(self, shard_key=None):
+        """Stops following changes made through the PorgWrapper passed to watch(). Reminders
+        already scheduled are kept."""
+        if shard_key in self._subscriptions:
+            porg, subscription = self._subscriptions.pop(shard_key)
+            porg.events.unsubscribe(subscription)
+
+    def schedule(self, shard_key, event_id, time, now=None):
+        """Schedules reminders for an event starting at time, replacing any reminders already
+        scheduled for it. time may be None to remove the event's reminders."""
+        key = (shard_key, event_id)
+        if self._event_times.get(key) == time:
+            return
+
+        # Reminders for the old time are left in the heap, and discarded when they come up
+        if time is None:
+            self._event_times.pop(key, None)
+        else:
+            now = now or datetime.now()
+            reminder_times = [(time - offset, offset) for offset in self.offsets
+                              if time - offset > now]
+            if reminder_times:
+                self._event_times[key] = time
+            else:
+                self._event_times.pop(key, None)
+            for reminder_time, offset in reminder_times:
+                heapq.heappush(self._heap, (reminder_time, next(self._sequence), key, time, offset))
+
+        if self._changed:
+            self._changed.set()
+
+    def _handle(self, porg, shard_key, change):
+        time = None
+        if not isinstance(change, EventDeleted):
+            event = porg.db_interface.get_obj(change.event_id, Event)
+            time = event.get_time() if event else None
+
+        self._schedule_soon(shard_key, change.event_id, time)
+
+    def _schedule_soon(self, shard_key, event_id, time, now=None):
+        # Changes may be published on another thread (e.g. a shard's thread - see
+        # CommandRouter.ShardExecutors), so once run() has started the schedule is only changed on
+        # its event loop
+        if self._loop:
+            self._loop.call_soon_threadsafe(self.schedule, shard_key, event_id, time, now)
+        else:
+            self.schedule(shard_key, event_id, time, now)
+
+    def _discard_stale(self):
+        while self._heap and self._event_times.get(self._heap[0][2]) != self._heap[0][3]:
+            heapq.heappop(self._heap)
+
+    def get_next_time(self):
+        """Returns the time of the next reminder, or None if there are none."""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None):
+        """Removes and returns a list of (shard key, event id, offset) for every reminder due at
+        now, in the order they were due."""
+        now = now or datetime.now()
+        due = []
+        while self.get_next_time() is not None and self._heap[0][0] <= now:
+            reminder_time, sequence, key, time, offset = heapq.heappop(self._heap)
+            if offset == self.offsets[-1]:  # Last reminder for the event
+                del self._event_times[key]
+            due.append(key + (offset,))
+        return due
+
+    def get_attendees(self, porg, event_id):
+        """Returns the Users going to the event."""
+        return porg.db_interface.s.query(User) \
+            .join(Attendance, Attendance.user_id == User.id) \
+            .filter(Attendance.event_id == event_id, Attendance.going_status == "going") \
+            .order_by(Attendance.id) \
+            .all()
+
+    def get_due_event(self, porg, event_id):
+        """Returns (event, attendees) for a due reminder, or None if the event no longer exists."""
+        event = porg.db_interface.get_obj(event_id, Event)
+        return (event, self.get_attendees(porg, event_id)) if event else None
+
+    def send_due(self, now=None):
+        """Calls callback for every reminder due at now. Returns the list of callback results."""
+        res = []
+        for shard_key, event_id, offset in self.pop_due(now):
+            due = self.get_due_event(self.get_porg(shard_key), event_id)
+            if due:
+                res.append(self.callback(shard_key, due[0], offset, due[1]))
+        return res
+
+    async def run(self, run_in_shard=None):
+        """Sends reminders as they become due until cancelled. Sleeps until the next reminder, or
+        until the schedule changes.
+
+        run_in_shard(shard key, fn, *args) must return an awaitable of fn(*args) called where the
+        shard's PorgWrapper may be used, e.g. CommandRouter.ShardExecutors.run, so reminders are
+        read off the event loop. By default they are read on the event loop."""
+        self._changed = asyncio.Event()
+        self._loop = asyncio.get_event_loop()
+        try:
+            while True:
+                self._changed.clear()
+                for shard_key, event_id, offset in self.pop_due():
+                    try:  # One failed reminder must not stop the others
+                        porg = self.get_porg(shard_key)
+                        if run_in_shard:
+                            due = await run_in_shard(shard_key, self.get_due_event, porg, event_id)
+                        else:
+                            due = self.get_due_event(porg, event_id)
+                        if due:
+                            result = self.callback(shard_key, due[0], offset, due[1])
+                            if asyncio.iscoroutine(result):
+                                await result
+                    except Exception:
+                        traceback.print_exc()
+
+                next_time = self.get_next_time()
+                timeout = None if next_time is None else (next_time - datetime.now()).total_seconds()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = self.loop
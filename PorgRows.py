@@ -0,0 +1,15 @@
+#!/usr/bin/env python3.5
+"""
+Read-only rows returned by PorgWrapper's listing queries. They hold only the selected columns, so
+no ORM object (or pickled id list) is built per row.
+"""
+from collections import namedtuple
+
+# An attendee of an event (see PorgWrapper.get_roster). username is the User's username.
+RosterRow = namedtuple('RosterRow', ['attendance_id', 'user_id', 'username', 'going_status', 'roles'])
+
+# The columns of an Event shown in event listings
+EventRow = namedtuple('EventRow', ['id', 'name', 'location', 'time'])
+
+# An event listed for one user, with that user's attendance (see PorgWrapper.get_user_event_rows)
+UserEventRow = namedtuple('UserEventRow', EventRow._fields + ('going_status', 'roles'))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3.5
+"""
+Per-guild database sharding. Each shard key (e.g. a Discord server id) has its own SQLite
+database, so writes for different guilds do not contend on the same database lock.
+
+Admin usage: python PorgShards.py list
+             python PorgShards.py count
+             python PorgShards.py find-user <username>
+             python PorgShards.py import <shard key>
+
+import copies the unsharded database (porg_config.DB_NAME, used before sharding) and its archive to
+be the databases of the given shard, e.g. the id of the Discord server the bot was used in.
+"""
+import argparse
+import os
+import re
+import sqlite3
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from config import porg_config
+from gen_db import generate as generate_db
+from Poorganiser import User, Event
+from PorgWrapper import PorgWrapper
+
+SHARD_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+SHARD_FILE_PATTERN = re.compile(r'^porg_([A-Za-z0-9_-]+)\.db$')
+
+
+class ShardManager:
+    """Hands out a PorgWrapper per shard key. At most max_open shards are kept open; the least
+    recently used shard is closed when another one needs to be opened. Shards in use across awaits
+    or threads should be pinned (see pinned()) so they are not closed under their users. Shard
+    databases are created on first use. Not thread-safe: call from one thread (e.g. the event
+    loop)."""
+
+    def __init__(self, shard_dir=None, max_open=None, on_open=None, on_close=None):
+        """shard_dir and max_open default to porg_config.SHARD_DIR and
+        porg_config.MAX_OPEN_SHARDS. If given, on_open(shard key, porg) is called each time a shard
+        is opened, e.g. to subscribe to porg.events, and on_close(shard key, porg) each time one is
+        about to be closed, e.g. to release resources kept for the shard."""
+        self.shard_dir = shard_dir or porg_config.SHARD_DIR
+        self.max_open = max_open or porg_config.MAX_OPEN_SHARDS
+        self.on_open = on_open
+        self.on_close = on_close
+        self._open = OrderedDict()  # shard key -> PorgWrapper, least recently used first
+        self._pins = Counter()  # shard key -> number of pinned() blocks using the shard
+
+    def get_shard_path(self, shard_key):
+        shard_key = str(shard_key)
+        if not SHARD_KEY_PATTERN.match(shard_key):
+            raise ValueError("Invalid shard key: {}".format(shard_key))
+        return os.path.join(self.shard_dir, 'porg_{}.db'.format(shard_key))
+
+    def get_archive_path(self, shard_key):
+        """Returns the path of the shard's archive database (see porg_archive.py), which may not
+        exist yet."""
+        return os.path.join(self.shard_dir, 'archive', os.path.basename(self.get_shard_path(shard_key)))
+
+    def get(self, shard_key):
+        """Returns the PorgWrapper for shard_key, opening (and if necessary creating) its
+        database."""
+        shard_key = str(shard_key)
+        if shard_key in self._open:
+            self._open.move_to_end(shard_key)
+            return self._open[shard_key]
+
+        path = self.get_shard_path(shard_key)
+        if not os.path.exists(path):
+            os.makedirs(self.shard_dir, exist_ok=True)
+            conn = sqlite3.connect(path)
+            generate_db(conn.cursor())
+            conn.commit()
+            conn.close()
+
+        porg = PorgWrapper('sqlite:///' + path, 'sqlite:///' + self.get_archive_path(shard_key))
+        self._open[shard_key] = porg
+        if self.on_open:
+            self.on_open(shard_key, porg)
+        self._evict()
+        return porg
+
+    @contextmanager
+    def pinned(self, shard_key):
+        """Returns a context manager giving the PorgWrapper for shard_key, which is not closed
+        before the block ends even if it becomes the least recently used shard. Blocks may nest
+        and overlap. If too many shards are pinned to close any, more than max_open stay open until
+        they are unpinned."""
+        shard_key = str(shard_key)
+        porg = self.pin(shard_key)
+        try:
+            yield porg
+        finally:
+            self.unpin(shard_key)
+
+    def pin(self, shard_key):
+        """Like pinned(), for uses that don't fit in a block (e.g. ending in a callback). Returns
+        the PorgWrapper for shard_key, which is not closed before a matching unpin()."""
+        shard_key = str(shard_key)
+        porg = self.get(shard_key)
+        self._pins[shard_key] += 1
+        return porg
+
+    def unpin(self, shard_key):
+        shard_key = str(shard_key)
+        self._pins[shard_key] -= 1
+        if not self._pins[shard_key]:
+            del self._pins[shard_key]
+        self._evict()
+
+    def _evict(self):
+        """Closes the least recently used unpinned shards, other than the one just used, until at
+        most max_open are open."""
+        for shard_key in list(self._open)[:-1]:
+            if len(self._open) <= self.max_open:
+                break
+            if shard_key not in self._pins:
+                self._close(shard_key, self._open.pop(shard_key))
+
+    def _close(self, shard_key, porg):
+        if self.on_close:
+            self.on_close(shard_key, porg)
+        porg.close()
+
+    def import_db(self, shard_key, path, archive_path=None):
+        """Copies the database at path (e.g. the unsharded porg_config.DB_NAME) to be shard_key's
+        database, and the archive database at archive_path, if given and it exists, to be its
+        archive. The shard must not exist yet. The databases are copied with SQLite's backup API,
+        so they may be in use."""
+        shard_path = self.get_shard_path(shard_key)
+        if os.path.exists(shard_path):
+            raise ValueError("Shard already exists: {}".format(shard_key))
+        if not os.path.exists(path):
+            raise ValueError("Database not found: {}".format(path))
+
+        copies = [(path, shard_path)]
+        if archive_path and os.path.exists(archive_path):
+            copies.insert(0, (archive_path, self.get_archive_path(shard_key)))
+        # The shard database is copied last, so the shard only exists once it is complete
+        for src_path, dest_path in copies:
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            src = sqlite3.connect(src_path)
+            dest = sqlite3.connect(dest_path + '.tmp')
+            try:
+                src.backup(dest)
+            finally:
+                dest.close()
+                src.close()
+            os.replace(dest_path + '.tmp', dest_path)
+
+    def get_open_shard_keys(self):
+        """Returns the keys of currently open shards, least recently used first."""
+        return list(self._open)
+
+    def get_shard_keys(self):
+        """Returns the keys of every shard database in shard_dir, sorted."""
+        if not os.path.isdir(self.shard_dir):
+            return []
+
+        keys = []
+        for filename in os.listdir(self.shard_dir):
+            match = SHARD_FILE_PATTERN.match(filename)
+            if match:
+                keys.append(match.group(1))
+        return sorted(keys)
+
+    def query_all(self, fn):
+        """Yields (shard key, fn(porg)) for every shard, where porg is the shard's PorgWrapper."""
+        for shard_key in self.get_shard_keys():
+            yield shard_key, fn(self.get(shard_key))
+
+    def close(self):
+        """Closes every open shard, pinned or not."""
+        while self._open:
+            self._close(*self._open.popitem())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query every shard database.")
+    parser.add_argument('action', choices=['list', 'count', 'find-user', 'import'])
+    parser.add_argument('name', nargs='?', help="Username for find-user, shard key for import")
+    args = parser.parse_args()
+
+    shards = ShardManager()
+    if args.action == 'list':
+        for shard_key in shards.get_shard_keys():
+            print(shard_key)
+    elif args.action == 'count':
+        print('SHARD\tUSERS\tEVENTS')
+        for shard_key, (users, events) in shards.query_all(
+                lambda porg: (porg.db_interface.s.query(User).count(),
+                              porg.db_interface.s.query(Event).count())):
+            print('{}\t{}\t{}'.format(shard_key, users, events))
+    elif args.action == 'find-user':
+        if not args.name:
+            parser.error("find-user requires a username")
+        for shard_key, user in shards.query_all(lambda porg: porg.get_user_by_username(args.name)):
+            if user:
+                print('{}\tuser id {}'.format(shard_key, user.get_id()))
+    elif args.action == 'import':
+        if not args.name:
+            parser.error("import requires a shard key")
+        try:
+            shards.import_db(args.name, porg_config.DB_NAME, porg_config.ARCHIVE_DB_NAME)
+        except ValueError as e:
+            parser.error(str(e))
+        print('Imported {} into shard {}'.format(porg_config.DB_NAME, args.name))
+    shards.close()
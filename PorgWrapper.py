@@ -1,14 +1,51 @@
 import datetime
-from sqlalchemy import or_, and_
+import heapq
+import os
+from sqlalchemy import or_, and_, bindparam, text as sql_text
+from sqlalchemy.orm import object_session
 from config import porg_config
 from DbInterface import DbInterface
-from Poorganiser import User, Event, Attendance, Survey, Question, Choice, Response
+from PorgCache import RenderCache, VersionTracker
+from PorgConcurrency import ConflictStats, retry_on_conflict
+from PorgEvents import *
+from Poorganiser import User, Event, Attendance, AttendanceRole, Survey, SurveyResult, Question, \
+    Choice, Response, insert_events, preload
 from PorgExceptions import *
+from PorgRows import RosterRow, EventRow, UserEventRow
+import PorgQueries
 
 
 class PorgWrapper:
-    def __init__(self):
-        self.db_interface = DbInterface()
+    # Object types covered by the full-text search index. An object's search_index rowid is
+    # obj_id * len(SEARCH_TYPES) + its position in this list (see gen_db.create_search_index).
+    SEARCH_TYPES = [Event, Survey, Question, Choice]
+
+    def __init__(self, db_url=None, archive_url=None):
+        """db_url defaults to porg_config.DB_URL and archive_url (the database past events are
+        moved to by porg_archive.py) to porg_config.ARCHIVE_DB_URL."""
+        self.db_interface = DbInterface(db_url)
+        self.archive_url = archive_url or porg_config.ARCHIVE_DB_URL
+        self._archive = None
+        self.events = EventBus()  # Every change made through PorgWrapper is published here
+        self.render_cache = RenderCache(porg_config.RENDER_CACHE_SIZE)
+        self._versions = VersionTracker(self.events, porg_config.VERSION_TRACKER_SIZE)
+        self.conflict_stats = ConflictStats()  # Conflicts with other processes writing to the database
+        # (event id, page size) -> start cursor of each page, for the event's current version
+        self._roster_cursors = RenderCache(porg_config.ROSTER_CURSOR_CACHE_SIZE)
+
+    def get_version(self, obj):
+        """Returns the version stamp of an Event or Survey, which changes whenever the object or
+        anything shown with it (an Event's attendances and roles, a Survey's questions and choices)
+        is changed through PorgWrapper. The stamp includes the row's version_id, so changes to the
+        object's own row by other writers are seen once they are committed and the row reloaded."""
+        if not isinstance(obj, (Event, Survey)):
+            raise TypeError("Invalid object type for get_version: expected Event or Survey")
+        return obj.version_id, self._versions.get(type(obj), obj.get_id())
+
+    def get_rendered(self, obj, kind, render):
+        """Returns render(obj) for an Event or Survey, reusing the text from an earlier call with
+        the same kind (e.g. 'full_event') if the object has not changed since."""
+        return self.render_cache.get((kind, obj.get_id()), self.get_version(obj), lambda: render(obj))
 
     def check_obj_exists(self, obj, obj_type):
         o = self.db_interface.get_obj(obj, obj_type)
@@ -31,17 +68,24 @@ class PorgWrapper:
             raise ResponseNotFoundError("Response could not be found")
 
     def get_user_by_username(self, username):
-        return self.db_interface.s.query(User).filter(User.username == username).first()
+        return PorgQueries.USER_BY_USERNAME(self.db_interface.s).params(username=username).first()
 
+    @retry_on_conflict
     def register_user(self, username):
         if self.get_user_by_username(username):
             raise UserRegisteredError("User \"{}\" is already registered".format(username))
 
         u = User(username)
         self.db_interface.add(u)
+        self.events.publish(UserRegistered(u.get_id()))
         return u
 
-    def unregister_user(self, obj, delete_events=False):
+    @retry_on_conflict
+    def unregister_user(self, obj, delete_events=False, soft=None):
+        """Deletes the user with their attendance, surveys and questions. Their organised events
+        are kept without an owner unless delete_events. If soft (default porg_config.SOFT_DELETE),
+        the user (and their events if delete_events) is only hidden, and the rows are deleted
+        later by collect_garbage."""
         username = obj
         if isinstance(obj, User):
             u = self.db_interface.get_obj(obj, User)
@@ -52,38 +96,167 @@ class PorgWrapper:
         if not u:
             raise UserNotFoundError("User \"{}\" could not be found".format(username))
 
-        # Remove Attendance objects from database - use set() to remove duplicates
+        if porg_config.SOFT_DELETE if soft is None else soft:
+            if delete_events:
+                for e in self.get_events_by_user(u):
+                    self.delete_event(e, soft=True)
+            u.set_deleted_time(datetime.datetime.now())
+            self.db_interface.update(u)
+            # Their attendances are kept but no longer shown, so views of those events change
+            for event_id in u.get_events_attending_ids():
+                self._versions.bump(Event, event_id)
+            self.events.publish(UserUnregistered(u.get_id()))
+            return
+
+        # Remove Attendance objects from database - use set() to remove duplicates. Attendances of
+        # soft deleted events are removed too, as collect_garbage can't remove them without the user
         events_participating = set(u.get_events_organised_ids() + u.get_events_attending_ids())
-        for event_id in events_participating:
-            a = self.get_attendance(u.get_id(), event_id)
-            self.delete_attendance(a)
+        with self.db_interface.showing_deleted():
+            for event_id in events_participating:
+                a = self.get_attendance(u.get_id(), event_id)
+                if a:
+                    self.delete_attendance(a)
 
         # Remove organiser id from organised events
         for event in self.get_events_by_user(u):
             event.set_owner_id(None)
+            self.events.publish(EventUpdated(event.get_id()))
 
         if delete_events:
             for e in self.get_events_by_user(u):
                 self.delete_event(e)
 
-        # Remove surveys from database
-        for survey_id in u.get_survey_ids():
+        # Remove surveys from database - copy the ids, which delete_survey removes from the list
+        for survey_id in list(u.get_survey_ids()):
             self.delete_survey(survey_id)
 
         # Remove questions from database
-        for question_id in u.get_question_ids():
+        for question_id in list(u.get_question_ids()):
             self.delete_question(question_id)
 
         self.db_interface.delete(u)
+        self.events.publish(UserUnregistered(u.get_id()))
 
     def get_help(self):
         help_output = "TODO HELP SECTION"
         return help_output
 
+    def get_archive(self):
+        """Returns a DbInterface for the archive database, or None if nothing has been archived
+        yet."""
+        if self._archive is None and os.path.exists(self.archive_url[len('sqlite:///'):]):
+            self._archive = DbInterface(self.archive_url)
+        return self._archive
+
+    def close(self):
+        """Closes the database and archive database connections."""
+        self.db_interface.close()
+        if self._archive:
+            self._archive.close()
+            self._archive = None
+
+    def get_event(self, event_obj):
+        """Returns the Event with the given id (or the Event itself), reading through to the
+        archive if it has been archived, or None if it cannot be found. Related objects of an
+        archived Event (e.g. get_attendances()) are read from the archive."""
+        e = self.db_interface.get_obj(event_obj, Event)
+        if e is None and self.get_archive():
+            e = self.get_archive().get_obj(event_obj, Event)
+        return e
+
+    def get_past_events(self, limit=None):
+        """Returns events that have already started, most recent first, including archived
+        events."""
+        return self._get_past([Event], limit)
+
+    def get_past_event_rows(self, limit=None):
+        """Returns get_past_events as EventRows."""
+        return [EventRow(*row) for row in self._get_past(PorgQueries.EVENT_ROW_COLUMNS, limit)]
+
+    def _get_past(self, columns, limit):
+        now = datetime.datetime.now()
+        sources = [self.db_interface]
+        if self.get_archive():
+            sources.append(self.get_archive())
+
+        res = []
+        for source in sources:
+            query = source.s.query(*columns).filter(Event.time < now, Event.deleted_time == None) \
+                .order_by(Event.time.desc())
+            res.extend(query.limit(limit).all() if limit else query.all())
+        res.sort(key=lambda row: row.time, reverse=True)
+        return res[:limit] if limit else res
+
     def get_curr_events(self):
-        today = datetime.date.today()
-        curr_filter = or_(Event.time >= today, Event.time == None)
-        return self.db_interface.query(Event, curr_filter, num='all')
+        return PorgQueries.CURR_EVENTS(self.db_interface.s).params(today=datetime.date.today()).all()
+
+    def get_curr_event_rows(self):
+        """Returns get_curr_events as EventRows, which only read the listed columns."""
+        return [EventRow(*row) for row in PorgQueries.CURR_EVENT_ROWS(self.db_interface.s)
+                .params(today=datetime.date.today())]
+
+    def search(self, text, types=None, limit=10):
+        """Returns up to limit Events, Surveys, Questions and Choices whose text matches every word
+        in text (words are prefix matched), best matches first. types may be a list of object
+        types to restrict the results to, e.g. [Event, Survey]."""
+        if types is None:
+            types = self.SEARCH_TYPES
+        for obj_type in types:
+            if obj_type not in self.SEARCH_TYPES:
+                raise TypeError("Invalid object type for search: expected Event, Survey, Question "
+                                "or Choice")
+
+        # Quote each word so that user input cannot be interpreted as FTS5 query syntax
+        words = text.split()
+        if not words or not types:
+            return []
+        match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+        # Rows hidden by a soft delete (of the object itself, or of the survey or event it belongs
+        # to) are left out before the limit, so they don't take the place of live matches
+        num_types = len(self.SEARCH_TYPES)
+        type_codes = ', '.join(str(self.SEARCH_TYPES.index(obj_type)) for obj_type in types)
+        rowids = [row[0] for row in self.db_interface.s.execute(sql_text(
+            'SELECT search_index.rowid FROM search_index '
+            'LEFT JOIN choices ON search_index.rowid % {0} = {1} '
+            '    AND choices.id = search_index.rowid / {0} '
+            'LEFT JOIN questions ON questions.id = CASE search_index.rowid % {0} '
+            '    WHEN {2} THEN search_index.rowid / {0} WHEN {1} THEN choices.question_id END '
+            'LEFT JOIN surveys ON surveys.id = CASE search_index.rowid % {0} '
+            '    WHEN {3} THEN search_index.rowid / {0} ELSE questions.survey_id END '
+            'LEFT JOIN events ON events.id = CASE search_index.rowid % {0} '
+            '    WHEN {4} THEN search_index.rowid / {0} ELSE surveys.event_id END '
+            'WHERE search_index MATCH :match AND search_index.rowid % {0} IN ({5}) '
+            'AND surveys.deleted_time IS NULL AND events.deleted_time IS NULL '
+            'ORDER BY search_index.rank LIMIT :limit'.format(
+                num_types, self.SEARCH_TYPES.index(Choice), self.SEARCH_TYPES.index(Question),
+                self.SEARCH_TYPES.index(Survey), self.SEARCH_TYPES.index(Event), type_codes)),
+            {'match': match, 'limit': limit})]
+
+        # Load matching objects with one query per object type, then restore rank order
+        ids_by_type = {}
+        for rowid in rowids:
+            ids_by_type.setdefault(self.SEARCH_TYPES[rowid % num_types], []).append(rowid // num_types)
+
+        objs = {}
+        for obj_type, obj_ids in ids_by_type.items():
+            for o in self.db_interface.s.query(obj_type).filter(obj_type.id.in_(obj_ids)):
+                objs[(obj_type, o.get_id())] = o
+
+        res = []
+        for rowid in rowids:
+            o = objs.get((self.SEARCH_TYPES[rowid % num_types], rowid // num_types))
+            if o:
+                res.append(o)
+        return res
+
+    def _is_hidden(self, survey):
+        """Returns whether the survey is hidden by a soft delete of itself or of its event."""
+        if survey.is_deleted():
+            return True
+        with self.db_interface.showing_deleted():
+            e = self.db_interface.get_obj(survey.get_event_id(), Event)
+        return bool(e and e.is_deleted())
 
     def get_events_by_user(self, user_obj):
         u = self.check_obj_exists(user_obj, User)
@@ -91,17 +264,39 @@ class PorgWrapper:
         res = []
         for event_id in u.get_events_organised_ids():
             e = self.db_interface.get_obj(event_id, Event)
-            res.append(e)
+            if e:  # Soft deleted events are not returned
+                res.append(e)
         return res
 
     def get_all_events(self):
-        return self.db_interface.query(Event, True, num='all')
+        return PorgQueries.ALL_EVENTS(self.db_interface.s).all()
+
+    def get_all_event_rows(self):
+        """Returns get_all_events as EventRows, which only read the listed columns."""
+        return [EventRow(*row) for row in PorgQueries.ALL_EVENT_ROWS(self.db_interface.s)]
+
+    def get_user_event_rows(self, user_obj):
+        """Returns a UserEventRow for each event the user is attending (or invited to), with
+        their going_status and roles, in one query."""
+        u = self.check_obj_exists(user_obj, User)
+        return [UserEventRow(*row) for row in PorgQueries.USER_EVENT_ROWS(self.db_interface.s)
+                .params(user_id=u.get_id())]
+
+    @retry_on_conflict
+    def create_event(self, name, owner_obj, location=None, time=None, recurrence=None,
+                     recurrence_end=None, recurrence_count=None):
+        """recurrence may be one of porg_config.RECURRENCE_TYPES to repeat the event (see
+        Event.set_recurrence). Its occurrences within porg_config.RECURRENCE_HORIZON are created
+        straight away, later ones by materialize_occurrences."""
+        if recurrence is not None and (recurrence not in porg_config.RECURRENCE_TYPES or time is None):
+            raise InvalidRecurrenceError("Invalid recurrence: {} (time {})".format(recurrence, time))
 
-    def create_event(self, name, owner_obj, location=None, time=None):
         owner = self.check_obj_exists(owner_obj, User)
         owner_id = owner.get_id()
         # Create event and insert into database
         e = Event(name, owner_id, location, time)
+        if recurrence:
+            e.set_recurrence(recurrence, recurrence_end, recurrence_count)
         self.db_interface.add(e)
 
         # Add event id to User.events_organised_ids and User.events_attending_ids
@@ -112,27 +307,127 @@ class PorgWrapper:
         # Add Attendance
         a = Attendance(owner_id, e.get_id(), going_status="going", roles=["organiser"])
         self.db_interface.add(a)
+        self._add_attendance_roles(a, a.get_roles())
         e.add_attendance_id(a)
         self.db_interface.update(e)
+        self.events.publish(EventCreated(e.get_id(), owner_id))
+        self.events.publish(AttendanceAdded(a.get_id(), e.get_id(), owner_id))
 
+        if recurrence:
+            self.materialize_occurrences(event_obj=e)
         return e
 
-    def delete_event(self, event_obj):
+    @retry_on_conflict
+    def materialize_occurrences(self, until=None, now=None, event_obj=None):
+        """Creates an Event, attended by its owner, for each occurrence of a recurring event up to
+        until (default porg_config.RECURRENCE_HORIZON after now) that hasn't been created yet.
+        Occurrences that passed before they were created are skipped. All new Events are inserted
+        in bulk in a single transaction. Only event_obj's occurrences are created if it is given.
+        Returns the list of new Events' ids, in no particular order."""
+        now = now or datetime.datetime.now()
+        until = until or now + porg_config.RECURRENCE_HORIZON
+        if event_obj:
+            series = [self.check_obj_exists(event_obj, Event)]
+        else:
+            series = self.db_interface.s.query(Event) \
+                .filter(Event.recurrence != None, Event.deleted_time == None).all()
+
+        occurrences = []  # (recurring Event, occurrence time)
+        for e in series:
+            # Only occurrences after the last one created are visited
+            for time in e.iter_occurrences(after=e.get_materialized_until() or e.get_time()):
+                if time > until:
+                    break
+                if time > now:
+                    occurrences.append((e, time))
+                e.set_materialized_until(time)
+
+        # Also commits materialized_until for series whose occurrences were all skipped
+        with self.db_interface.transaction():
+            owners = {e.get_owner_id(): self.db_interface.get_obj(e.get_owner_id(), User)
+                      for e, time in occurrences if e.get_owner_id()}
+            event_mappings = [{'name': e.get_name(), 'owner_id': e.get_owner_id(),
+                               'location': e.get_location(), 'time': time, 'survey_ids': [],
+                               'series_id': e.get_id()} for e, time in occurrences]
+            attendance_mappings = insert_events(self.db_interface, event_mappings, owners)
+
+        for mapping in event_mappings:
+            self.events.publish(EventCreated(mapping['id'], mapping['owner_id']))
+        for a in attendance_mappings:
+            self.events.publish(AttendanceAdded(a['id'], a['event_id'], a['user_id']))
+        return [mapping['id'] for mapping in event_mappings]
+
+    def iter_occurrences(self, start=None, end=None):
+        """Lazily yields (Event, time) for each event occurrence from start (default now) up to end
+        (default no end), in time order. Occurrences created as Events yield their own Event.
+        Later occurrences of a recurring event, not created yet, yield the recurring Event with the
+        occurrence's time, so no rows are needed for them."""
+        start = start or datetime.datetime.now()
+        query = self.db_interface.s.query(Event).filter(Event.time >= start, Event.deleted_time == None)
+        if end is not None:
+            query = query.filter(Event.time <= end)
+        created = ((e, e.get_time()) for e in query.order_by(Event.time))
+
+        def future(e):
+            for time in e.iter_occurrences(after=e.get_materialized_until() or e.get_time()):
+                if end is not None and time > end:
+                    return
+                if time >= start:
+                    yield e, time
+
+        series = self.db_interface.s.query(Event) \
+            .filter(Event.recurrence != None, Event.deleted_time == None).all()
+        return heapq.merge(created, *[future(e) for e in series], key=lambda occurrence: occurrence[1])
+
+    @retry_on_conflict
+    def update_event(self, event_obj, name=None, location=None, time=None):
+        """Sets each of the event's name, location and time that is not None."""
         e = self.check_obj_exists(event_obj, Event)
 
-        # Remove attendances from database
-        for attendance_id in e.get_attendance_ids():
+        if name is not None:
+            e.set_name(name)
+        if location is not None:
+            e.set_location(location)
+        if time is not None:
+            e.set_time(time)
+        self.db_interface.update(e)
+        self.events.publish(EventUpdated(e.get_id()))
+
+        return e
+
+    @retry_on_conflict
+    def delete_event(self, event_obj, soft=None):
+        """Deletes the event with its attendance and surveys. If soft (default
+        porg_config.SOFT_DELETE), the event is only hidden, and the rows are deleted later by
+        collect_garbage."""
+        e = self.check_obj_exists(event_obj, Event)
+
+        if porg_config.SOFT_DELETE if soft is None else soft:
+            e.set_deleted_time(datetime.datetime.now())
+            self.db_interface.update(e)
+            self.events.publish(EventDeleted(e.get_id()))
+
+            # Attendees' lists keep the event until it is collected, but the owner stops listing it
+            owner = self.db_interface.get_obj(e.get_owner_id(), User)
+            if owner:
+                owner.remove_event_organised(e)
+                self.db_interface.update(owner)
+            return
+
+        # Remove attendances from database - copy the ids, which delete_attendance removes from the list
+        for attendance_id in list(e.get_attendance_ids()):
             a = self.db_interface.get_obj(attendance_id, Attendance)
             self.delete_attendance(a.get_id())
 
         # Remove surveys from database
-        for survey_id in e.get_survey_ids():
+        for survey_id in list(e.get_survey_ids()):
             s = self.check_obj_exists(survey_id, Survey)
             self.delete_survey(s)
 
         # Delete event
         event_owner_id = e.get_owner_id()
         self.db_interface.delete(e)
+        self.events.publish(EventDeleted(e.get_id()))
 
         # Remove event id from User.events_organised_ids and User.events_attending_ids
         # NB: owner may not exist if they unregistered instead of deleting user
@@ -149,26 +444,135 @@ class PorgWrapper:
         if not e or not u:
             return None
 
-        attendance_filter = and_(Attendance.user_id == u.get_id(), Attendance.event_id == e.get_id())
-        return self.db_interface.query(Attendance, attendance_filter, num='one')
+        return PorgQueries.ATTENDANCE(self.db_interface.s) \
+            .params(event_id=e.get_id(), user_id=u.get_id()).first()
+
+    def get_event_headcount(self, event_obj):
+        """Returns a dict mapping each going_status (e.g. "going", "invited") to the number of
+        Attendances for the event with that status. Counts are grouped in a single query."""
+        e = self.get_event(event_obj)
+        if e is None:
+            raise EventNotFoundError("Event could not be found")
+
+        # Archived events are counted in the archive
+        if self._is_archived(e):
+            rows = PorgQueries.ARCHIVED_EVENT_HEADCOUNT(object_session(e)).params(
+                event_id=e.get_id(), deleted_user_ids=self._get_deleted_user_ids())
+        else:
+            rows = PorgQueries.EVENT_HEADCOUNT(object_session(e)).params(event_id=e.get_id())
+        return {going_status: count for going_status, count in rows}
+
+    def _is_archived(self, e):
+        """Returns whether the Event (see get_event) was read from the archive."""
+        return object_session(e) is not self.db_interface.s
+
+    def _get_deleted_user_ids(self):
+        """Returns the ids of soft deleted users, whose attendances are hidden until collected.
+        Needed for archived events, as users are never archived."""
+        return [user_id for user_id, in self.db_interface.s.query(User.id)
+                .filter(User.deleted_time != None)]
+
+    def get_roster(self, event_obj, after=None, page_size=None):
+        """Returns (rows, cursor): a page of up to page_size (default porg_config.ROSTER_PAGE_SIZE)
+        RosterRows for the event's attendees, ordered by going_status then user id. after is the
+        cursor returned for the previous page, or None for the first page. cursor is None after
+        the last page.
+
+        Pages are found by (going_status, user_id) rather than by offset, so any page costs the
+        same to read however large the roster."""
+        e = self.get_event(event_obj)
+        if e is None:
+            raise EventNotFoundError("Event could not be found")
+        page_size = page_size or porg_config.ROSTER_PAGE_SIZE
+
+        # Archived events are read from the archive
+        archived = self._is_archived(e)
+        if after is None:
+            query = (PorgQueries.ARCHIVED_ROSTER if archived else PorgQueries.ROSTER)(object_session(e))
+        else:
+            query = (PorgQueries.ARCHIVED_ROSTER_AFTER if archived else PorgQueries.ROSTER_AFTER)(
+                object_session(e)).params(going_status=after[0], after_user_id=after[1])
+        if archived:
+            query = query.params(deleted_user_ids=self._get_deleted_user_ids())
+        rows = query.params(event_id=e.get_id(), limit=page_size + 1).all()
+        usernames = {}
+        if rows:
+            usernames = dict(PorgQueries.USERNAMES(self.db_interface.s).params(
+                user_ids=list({user_id for _, user_id, _, _ in rows})))
+        rows = [RosterRow(attendance_id, user_id, usernames.get(user_id), going_status, roles)
+                for attendance_id, user_id, going_status, roles in rows]
+
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        return rows, (rows[-1].going_status, rows[-1].user_id)
+
+    def _roster_after(self, query, cursor):
+        """Filters query to the attendances after cursor in roster order."""
+        if cursor is None:
+            return query
+        going_status, user_id = cursor
+        return query.filter(or_(Attendance.going_status > going_status,
+                                and_(Attendance.going_status == going_status,
+                                     Attendance.user_id > user_id)))
+
+    def get_roster_page(self, event_obj, page, page_size=None):
+        """Returns (rows, page count) for page (numbered from 1) of the event's roster (see
+        get_roster). Pages past the end are empty. The cursor each page starts from is remembered
+        until the event changes (for the porg_config.ROSTER_CURSOR_CACHE_SIZE most recently paged
+        events), so going from page to page only reads the pages shown."""
+        e = self.get_event(event_obj)
+        if e is None:
+            raise EventNotFoundError("Event could not be found")
+        page_size = page_size or porg_config.ROSTER_PAGE_SIZE
+        total = sum(self.get_event_headcount(e).values())
+        page_count = max(1, -(-total // page_size))
+        if page < 1 or page > page_count:
+            return [], page_count
+
+        cursors = self._roster_cursors.get((e.get_id(), page_size), self.get_version(e),
+                                           lambda: [None])
+
+        # Find the start of each page up to this one from the last key of the page before it,
+        # reading only the key columns
+        session = object_session(e)
+        deleted_user_ids = self._get_deleted_user_ids() if self._is_archived(e) else None
+        while len(cursors) < page:
+            query = session.query(Attendance.going_status, Attendance.user_id) \
+                .filter(Attendance.event_id == e.get_id())
+            if deleted_user_ids is None:
+                query = query.outerjoin(User, User.id == Attendance.user_id) \
+                    .filter(User.deleted_time == None)
+            else:  # Archived, see get_roster
+                query = query.filter(Attendance.user_id.notin_(deleted_user_ids))
+            query = self._roster_after(query, cursors[-1])
+            cursors.append(tuple(query.order_by(Attendance.going_status, Attendance.user_id)
+                                 .offset(page_size - 1).limit(1).one()))
+
+        return self.get_roster(e, cursors[page - 1], page_size)[0], page_count
 
     def get_attendances(self, obj):
         res = []
         if isinstance(obj, Event):
-            e = self.db_interface.get_obj(obj.get_id(), Event)
-            for attendance_id in e.get_attendance_ids():
-                a = self.db_interface.get_obj(attendance_id, Attendance)
-                res.append(a)
+            # Archived events' attendances are read from the archive
+            e = self.get_event(obj.get_id())
+            if e is None:
+                raise EventNotFoundError("Event could not be found")
+            # Attendances of soft deleted users are hidden until collected
+            deleted_user_ids = set(self._get_deleted_user_ids())
+            res = [a for a in e.get_attendances() if a.get_user_id() not in deleted_user_ids]
         elif isinstance(obj, User):
             u = self.db_interface.get_obj(obj.get_id(), User)
             for event_id in u.get_events_attending_ids():
                 a = self.get_attendance(u.get_id(), event_id)
-                res.append(a)
+                if a:  # None if the event was soft deleted
+                    res.append(a)
         else:
             raise TypeError("Invalid object type for get_attendances: expected Event or User")
 
         return res
 
+    @retry_on_conflict
     def create_attendance(self, user_obj, event_obj, going_status='invited', roles=list()):
         u = self.check_obj_exists(user_obj, User)
         e = self.check_obj_exists(event_obj, Event)
@@ -179,6 +583,7 @@ class PorgWrapper:
         # Create attendance
         a = Attendance(u.get_id(), e.get_id(), going_status, roles)
         self.db_interface.add(a)
+        self._add_attendance_roles(a, a.get_roles())
 
         # Add event id to User.events_attending_ids
         u.add_event_attending(e)
@@ -187,13 +592,31 @@ class PorgWrapper:
         # Add attendance id to Event
         e.add_attendance_id(a)
         self.db_interface.update(e)
+        self.events.publish(AttendanceAdded(a.get_id(), e.get_id(), u.get_id()))
 
         return a
 
+    @retry_on_conflict
+    def set_going_status(self, user_obj, event_obj, going_status):
+        """Sets the going_status of the user's Attendance for the event. Raises
+        AttendanceNotFoundError if the user is not attending the event."""
+        a = self.get_attendance(user_obj, event_obj)
+        if not a:
+            raise AttendanceNotFoundError("Attendance could not be found")
+
+        a.set_going_status(going_status)
+        self.db_interface.update(a)
+        self.events.publish(AttendanceChanged(a.get_id(), a.get_event_id(), a.get_user_id()))
+
+        return a
+
+    @retry_on_conflict
     def delete_attendance(self, attendance_obj):
         a = self.check_obj_exists(attendance_obj, Attendance)
-        e = self.check_obj_exists(a.get_event_id(), Event)
-        u = self.check_obj_exists(a.get_user_id(), User)
+        # The attendee or event may be soft deleted, but their id lists are kept until collected
+        with self.db_interface.showing_deleted():
+            e = self.check_obj_exists(a.get_event_id(), Event)
+            u = self.check_obj_exists(a.get_user_id(), User)
 
         # Remove event id from Users.events_attending_ids
         u.remove_event_attending(e)
@@ -203,9 +626,78 @@ class PorgWrapper:
         e.remove_attendance_id(a)
         self.db_interface.update(e)
 
-        # Delete attendance object
+        # Delete role rows and attendance object
+        self.db_interface.s.query(AttendanceRole) \
+            .filter(AttendanceRole.attendance_id == a.get_id()) \
+            .delete(synchronize_session=False)
         self.db_interface.delete(a)
+        self.events.publish(AttendanceRemoved(a.get_id(), e.get_id(), u.get_id()))
+
+    def _add_attendance_roles(self, attendance, roles):
+        """Adds an AttendanceRole row for each distinct role in roles. Does not modify
+        Attendance.roles."""
+        for role in sorted(set(roles), key=roles.index):
+            self.db_interface.s.add(AttendanceRole(attendance.get_id(), attendance.get_user_id(),
+                                                   attendance.get_event_id(), role))
+        self.db_interface.update(attendance)
+
+    @retry_on_conflict
+    def add_role(self, user_obj, event_obj, role):
+        """Adds role to the user's Attendance for the event. Raises AttendanceNotFoundError if the
+        user is not attending the event. Roles that already exist are not added again."""
+        a = self.get_attendance(user_obj, event_obj)
+        if not a:
+            raise AttendanceNotFoundError("Attendance could not be found")
+
+        if role not in a.get_roles():
+            a.add_role(role)
+            self._add_attendance_roles(a, [role])
+            self.events.publish(AttendanceChanged(a.get_id(), a.get_event_id(), a.get_user_id()))
 
+        return a
+
+    @retry_on_conflict
+    def remove_role(self, user_obj, event_obj, role):
+        """Removes role from the user's Attendance for the event. Raises AttendanceNotFoundError
+        if the user is not attending the event."""
+        a = self.get_attendance(user_obj, event_obj)
+        if not a:
+            raise AttendanceNotFoundError("Attendance could not be found")
+
+        a.remove_role(role)
+        self.db_interface.s.query(AttendanceRole) \
+            .filter(AttendanceRole.attendance_id == a.get_id(), AttendanceRole.role == role) \
+            .delete(synchronize_session=False)
+        self.db_interface.update(a)
+        self.events.publish(AttendanceChanged(a.get_id(), a.get_event_id(), a.get_user_id()))
+
+        return a
+
+    def get_attendees_by_role(self, event_obj, role):
+        """Returns a list of Users attending the event with the given role, in the order the role
+        was assigned."""
+        e = self.check_obj_exists(event_obj, Event)
+
+        return self.db_interface.s.query(User) \
+            .join(AttendanceRole, AttendanceRole.user_id == User.id) \
+            .filter(AttendanceRole.event_id == e.get_id(), AttendanceRole.role == role,
+                    User.deleted_time == None) \
+            .order_by(AttendanceRole.id) \
+            .all()
+
+    def get_roles_for_user(self, user_obj):
+        """Returns a dict mapping event id to the list of roles the user has for that event.
+        Events the user attends without any roles are not included."""
+        u = self.check_obj_exists(user_obj, User)
+
+        rows = PorgQueries.ROLES_FOR_USER(self.db_interface.s).params(user_id=u.get_id())
+
+        res = {}
+        for event_id, role in rows:
+            res.setdefault(event_id, []).append(role)
+        return res
+
+    @retry_on_conflict
     def create_choice(self, question_obj, choice):
         q = self.check_obj_exists(question_obj, Question)
         c = Choice(q.get_id(), choice)
@@ -214,9 +706,11 @@ class PorgWrapper:
         # Add choice id to Question.allowed_choice_ids
         q.add_allowed_choice_id(c.get_id())
         self.db_interface.update(q)
+        self.events.publish(ChoiceAdded(c.get_id(), q.get_id(), q.get_survey_id()))
 
         return c
 
+    @retry_on_conflict
     def create_question(self, owner_obj, question, question_type, survey_obj=None):
         """Specifying allowed_choice_ids is forbidden here - since create_choice requires an
         existing question, we cannot have choices existing before questions."""
@@ -242,18 +736,24 @@ class PorgWrapper:
         if survey_id:
             survey_obj.add_question_id(q.get_id())
             self.db_interface.update(survey_obj)
+        self.events.publish(QuestionAdded(q.get_id(), survey_id))
 
         return q
 
+    @retry_on_conflict
     def create_response(self, responder_obj, question_obj, response_text=None, choice_ids=[]):
         responder = self.check_obj_exists(responder_obj, User)
         q = self.check_obj_exists(question_obj, Question)
 
-        # Check choice_ids are have equal question_id to question_obj
-        for choice_id in choice_ids:
-            ch = self.check_obj_exists(choice_id, Choice)
-            if not ch.get_question_id() == q.get_id():
-                raise InvalidQuestionIdError("Mismatching choice and response question_id")
+        # Questions of soft deleted surveys are hidden, and closed surveys don't accept responses
+        with self.db_interface.showing_deleted():
+            s = self.db_interface.get_obj(q.get_survey_id(), Survey)
+        if s and self._is_hidden(s):
+            raise QuestionNotFoundError("Question could not be found")
+        if s and s.is_closed():
+            raise SurveyClosedError("Survey {} is closed".format(s.get_id()))
+
+        self.validate_response(q, response_text, choice_ids)
 
         # Create Response
         r = Response(responder.get_id(), q.get_id(), response_text, choice_ids)
@@ -266,9 +766,110 @@ class PorgWrapper:
         # Add response id to Question.response_ids
         q.add_response_id(r.get_id())
         self.db_interface.update(q)
+        self.events.publish(ResponseAdded(r.get_id(), q.get_id(), responder.get_id()))
 
         return r
 
+    @retry_on_conflict
+    def submit_survey(self, responder_obj, survey_obj, answers):
+        """Responds to several questions of a survey at once. answers maps each question (id or
+        Question) to its answer: a response_text, a list of choice ids, or a (response_text,
+        choice ids) tuple.
+
+        Every answer is validated first (see validate_response). If any is invalid nothing is
+        added, otherwise all Responses are added in a single transaction. Returns (responses,
+        errors), where responses lists the new Responses in answers order and errors maps the id
+        of each question with an invalid answer (or answered more than once) to its exception."""
+        responder = self.check_obj_exists(responder_obj, User)
+        s = self.check_obj_exists(survey_obj, Survey)
+        if self._is_hidden(s):
+            raise SurveyNotFoundError("Survey could not be found")
+        if s.is_closed():
+            raise SurveyClosedError("Survey {} is closed".format(s.get_id()))
+
+        # Questions are loaded in one query, and validated against their allowed choice sets
+        questions = {q.get_id(): q for q in s.get_questions()}
+        answered = []
+        answered_ids = set()
+        errors = {}
+        for question_obj, answer in answers.items():
+            # A question may be given both as a Question and as its id, so keys are compared by id
+            question_id = question_obj.get_id() if isinstance(question_obj, Question) else question_obj
+            if question_id in answered_ids:
+                errors[question_id] = InvalidResponseError("Question {} is answered more than once"
+                                                           .format(question_id))
+                continue
+            answered_ids.add(question_id)
+
+            if isinstance(answer, str):
+                response_text, choice_ids = answer, []
+            elif isinstance(answer, tuple):
+                response_text, choice_ids = answer
+            else:
+                response_text, choice_ids = None, list(answer)
+
+            try:
+                if question_id not in questions:
+                    raise InvalidQuestionIdError("Question {} is not in survey {}".format(
+                        question_id, s.get_id()))
+                self.validate_response(questions[question_id], response_text, choice_ids)
+                answered.append((questions[question_id], response_text, choice_ids))
+            except Error as e:
+                errors[question_id] = e
+
+        if errors:
+            return [], errors
+
+        with self.db_interface.transaction() as session:
+            responses = [Response(responder.get_id(), q.get_id(), response_text, choice_ids)
+                         for q, response_text, choice_ids in answered]
+            session.add_all(responses)
+            session.flush()
+
+            # Add response ids to User.response_ids and each Question.response_ids
+            responder.response_ids.extend(r.get_id() for r in responses)
+            for (q, response_text, choice_ids), r in zip(answered, responses):
+                q.add_response_id(r.get_id())
+
+        for r in responses:
+            self.events.publish(ResponseAdded(r.get_id(), r.get_question_id(), responder.get_id()))
+        return responses, {}
+
+    def validate_response(self, question_obj, response_text=None, choice_ids=[]):
+        """Checks a response matches the question_type of its Question: free questions take a
+        response_text and no choices, choose_one questions exactly one choice and choose_many
+        questions one or more distinct choices (optionally with a response_text as a comment).
+        Choices are checked against the Question's allowed choice ids, so the database is only
+        queried to explain a choice that is not allowed.
+
+        Raises InvalidResponseError, or ChoiceNotFoundError / InvalidQuestionIdError for choices
+        that don't exist / belong to another question."""
+        q = self.check_obj_exists(question_obj, Question)
+        question_type = q.get_question_type()
+
+        if any(not isinstance(choice_id, int) for choice_id in choice_ids):
+            raise InvalidResponseError("Choice ids must be ints")
+        if question_type == 'free':
+            if choice_ids:
+                raise InvalidResponseError("Free text question {} takes no choices".format(q.get_id()))
+            if not response_text:
+                raise InvalidResponseError("Free text question {} needs response_text".format(q.get_id()))
+        elif question_type == 'choose_one' and len(choice_ids) != 1:
+            raise InvalidResponseError("Question {} takes exactly one choice".format(q.get_id()))
+        elif question_type == 'choose_many':
+            if not choice_ids:
+                raise InvalidResponseError("Question {} takes at least one choice".format(q.get_id()))
+            if len(set(choice_ids)) != len(choice_ids):
+                raise InvalidResponseError("Duplicate choice for question {}".format(q.get_id()))
+
+        invalid = set(choice_ids) - q.get_allowed_choice_set()
+        if invalid:
+            found = {row[0] for row in self.db_interface.s.query(Choice.id).filter(Choice.id.in_(invalid))}
+            if invalid - found:
+                raise ChoiceNotFoundError("Choice could not be found")
+            raise InvalidQuestionIdError("Mismatching choice and response question_id")
+
+    @retry_on_conflict
     def create_survey(self, name, owner_obj, question_ids=[], event_obj=None):
         owner = self.check_obj_exists(owner_obj, User)
 
@@ -301,9 +902,99 @@ class PorgWrapper:
         for q in questions:
             q.set_survey_id(s.get_id())
             self.db_interface.update(q)
+        self.events.publish(SurveyCreated(s.get_id(), event_id))
 
         return s
 
+    @retry_on_conflict
+    def clone_survey(self, survey_obj, owner_obj=None, event_obj=None, name=None):
+        """Copies a survey with its questions and choices (but not its responses) in a single
+        transaction. Questions and choices are each copied by one INSERT ... SELECT, so their text
+        is never loaded. The copy is owned by owner_obj (default the survey's owner), attached to
+        event_obj if given and named name (default the survey's name). Returns the new Survey."""
+        s = self.check_obj_exists(survey_obj, Survey)
+        owner = self.check_obj_exists(owner_obj or s.get_owner_id(), User)
+        e = self.check_obj_exists(event_obj, Event) if event_obj else None
+
+        # Ids of choices that still exist, in one query
+        questions = s.get_questions()
+        choice_ids = set()
+        if questions:
+            choice_ids = {choice_id for choice_id, in self.db_interface.s.query(Choice.id).filter(
+                Choice.question_id.in_([q.get_id() for q in questions]))}
+
+        with self.db_interface.transaction() as session:
+            clone = Survey(name or s.get_name(), owner.get_id(), event_id=e.get_id() if e else None)
+            session.add(clone)
+            session.flush()
+
+            # The copies' ids are assigned up front (see DbInterface.next_id), which builds the
+            # old id -> new id maps and every id list in one pass. Choices keep the order of their
+            # question's allowed_choice_ids.
+            next_question_id = self.db_interface.next_id(Question)
+            next_choice_id = self.db_interface.next_id(Choice)
+            question_map = []
+            choice_map = []
+            for new_question_id, q in enumerate(questions, start=next_question_id):
+                allowed_choice_ids = []
+                for choice_id in q.get_allowed_choice_ids():
+                    if choice_id in choice_ids:
+                        allowed_choice_ids.append(next_choice_id + len(choice_map))
+                        choice_map.append({'old_id': choice_id, 'new_id': allowed_choice_ids[-1],
+                                           'question_id': new_question_id})
+                question_map.append({'old_id': q.get_id(), 'new_id': new_question_id,
+                                     'allowed_choice_ids': allowed_choice_ids})
+
+            id_list_type = Question.__table__.c.allowed_choice_ids.type
+            session.execute(sql_text('CREATE TEMP TABLE clone_questions '
+                                     '(old_id INTEGER, new_id INTEGER, allowed_choice_ids BLOB)'))
+            session.execute(sql_text('CREATE TEMP TABLE clone_choices '
+                                     '(old_id INTEGER, new_id INTEGER, question_id INTEGER)'))
+            if question_map:
+                session.execute(sql_text('INSERT INTO clone_questions '
+                                         'VALUES (:old_id, :new_id, :allowed_choice_ids)')
+                                .bindparams(bindparam('allowed_choice_ids', type_=id_list_type)),
+                                question_map)
+            if choice_map:
+                session.execute(sql_text('INSERT INTO clone_choices VALUES (:old_id, :new_id, :question_id)'),
+                                choice_map)
+            session.execute(sql_text(
+                'INSERT INTO questions (id, version_id, owner_id, question, question_type, survey_id, '
+                'allowed_choice_ids, response_ids) '
+                'SELECT m.new_id, 1, :owner_id, q.question, q.question_type, :survey_id, '
+                'm.allowed_choice_ids, :response_ids '
+                'FROM clone_questions m JOIN questions q ON q.id = m.old_id ORDER BY m.new_id')
+                .bindparams(bindparam('response_ids', type_=id_list_type)),
+                {'owner_id': owner.get_id(), 'survey_id': clone.get_id(), 'response_ids': []})
+            session.execute(sql_text(
+                'INSERT INTO choices (id, version_id, question_id, choice) '
+                'SELECT m.new_id, 1, m.question_id, c.choice '
+                'FROM clone_choices m JOIN choices c ON c.id = m.old_id ORDER BY m.new_id'))
+            session.execute(sql_text('DROP TABLE clone_questions'))
+            session.execute(sql_text('DROP TABLE clone_choices'))
+
+            new_question_ids = [row['new_id'] for row in question_map]
+            clone.question_ids = new_question_ids
+            owner.add_survey_id(clone)
+            owner.question_ids.extend(new_question_ids)
+            if e:
+                e.add_survey_id(clone)
+
+        self.events.publish(SurveyCreated(clone.get_id(), clone.get_event_id()))
+        for new_question_id in new_question_ids:
+            self.events.publish(QuestionAdded(new_question_id, clone.get_id()))
+        for row in choice_map:
+            self.events.publish(ChoiceAdded(row['new_id'], row['question_id'], clone.get_id()))
+        return clone
+
+    @retry_on_conflict
+    def instantiate_template(self, template_obj, event_obj):
+        """Sets up a recurring survey for an event: clones the template survey, owned by the
+        event's owner and attached to the event. Returns the new Survey."""
+        e = self.check_obj_exists(event_obj, Event)
+        return self.clone_survey(template_obj, owner_obj=e.get_owner_id(), event_obj=e)
+
+    @retry_on_conflict
     def delete_choice(self, choice_obj, remove_from_question=True):
         c = self.check_obj_exists(choice_obj, Choice)
         q = self.check_obj_exists(c.get_question_id(), Question)
@@ -314,14 +1005,17 @@ class PorgWrapper:
 
         # Delete choice
         self.db_interface.delete(c)
+        self.events.publish(ChoiceDeleted(c.get_id(), q.get_id(), q.get_survey_id()))
 
+    @retry_on_conflict
     def delete_question(self, question_obj, remove_from_survey=True):
         q = self.check_obj_exists(question_obj, Question)
         owner = self.get_owner(q)
 
         # Remove question_id from User.question_ids
-        owner.remove_question_id(q)
-        self.db_interface.update(owner)
+        if owner:
+            owner.remove_question_id(q)
+            self.db_interface.update(owner)
 
         if remove_from_survey:  # Remove question id from Survey.question_ids
             if q.get_survey_id():
@@ -339,15 +1033,18 @@ class PorgWrapper:
 
         # Delete question
         self.db_interface.delete(q)
+        self.events.publish(QuestionDeleted(q.get_id(), q.get_survey_id()))
 
+    @retry_on_conflict
     def delete_response(self, response_obj, remove_from_question=True):
         r = self.check_obj_exists(response_obj, Response)
         q = self.check_obj_exists(r.get_question_id(), Question)
 
-        # Remove response_id from User.response_ids
+        # Remove response_id from User.response_ids - the responder may have unregistered
         responder = self.db_interface.get_obj(r.get_responder_id(), User)
-        responder.remove_response_id(r)
-        self.db_interface.update(responder)
+        if responder:
+            responder.remove_response_id(r)
+            self.db_interface.update(responder)
 
         if remove_from_question:  # Remove response id from Question.response_ids
             q.remove_response_id(r)
@@ -355,21 +1052,218 @@ class PorgWrapper:
 
         # Delete response
         self.db_interface.delete(r)
+        self.events.publish(ResponseDeleted(r.get_id(), q.get_id(), r.get_responder_id()))
 
-    def delete_survey(self, survey_obj):
+    @retry_on_conflict
+    def delete_survey(self, survey_obj, soft=None):
+        """Deletes the survey with its questions, choices, responses and results. If soft (default
+        porg_config.SOFT_DELETE), the survey is only hidden, and the rows are deleted later by
+        collect_garbage."""
         s = self.check_obj_exists(survey_obj, Survey)
         owner = self.get_owner(s)
 
-        # Remove survey_id from User.survey_id
-        owner.remove_survey_id(s)
-        self.db_interface.update(owner)
+        # Remove survey_id from User.survey_id and Event.survey_ids
+        if owner:
+            owner.remove_survey_id(s)
+            self.db_interface.update(owner)
+        e = self.db_interface.get_obj(s.get_event_id(), Event)
+        if e:
+            e.remove_survey_id(s)
+            self.db_interface.update(e)
+
+        if porg_config.SOFT_DELETE if soft is None else soft:
+            s.set_deleted_time(datetime.datetime.now())
+            self.db_interface.update(s)
+            self.events.publish(SurveyDeleted(s.get_id(), s.get_event_id()))
+            return
 
         # Delete questions from database (and choices+responses via delete_question)
         for question_id in s.get_question_ids():
             self.delete_question(question_id, remove_from_survey=False)
 
+        # Delete results of closed survey
+        self.db_interface.s.query(SurveyResult) \
+            .filter(SurveyResult.survey_id == s.get_id()) \
+            .delete(synchronize_session='evaluate')
+
         # Delete survey
         self.db_interface.delete(s)
+        self.events.publish(SurveyDeleted(s.get_id(), s.get_event_id()))
+
+    @retry_on_conflict
+    def collect_garbage(self, limit=None):
+        """Deletes the rows of soft deleted users, events and surveys, then the soft deleted objects
+        themselves, oldest first. At most limit (default porg_config.GC_BATCH_SIZE) objects are
+        deleted, in a single transaction, so each call takes a bounded time. Returns the number of
+        objects deleted, which is 0 once there is nothing left to collect."""
+        limit = limit or porg_config.GC_BATCH_SIZE
+        collectors = [(User, self._collect_user), (Event, self._collect_event),
+                      (Survey, self._collect_survey)]
+
+        deleted = 0
+        with self.db_interface.showing_deleted():
+            for obj_type, collect in collectors:
+                # Users and events soft delete their surveys, which are then collected in turn
+                for o in self.db_interface.s.query(obj_type).filter(obj_type.deleted_time != None) \
+                        .order_by(obj_type.deleted_time).limit(limit - deleted).all():
+                    deleted += collect(o, limit - deleted)
+                    if deleted >= limit:
+                        return deleted
+        return deleted
+
+    def _collect_user(self, u, limit):
+        """Deletes up to limit of the soft deleted user's dependent objects, then the user if none
+        are left. Returns the number of objects deleted."""
+        deleted = 0
+
+        # Organised events are kept without an owner
+        for event_id in list(u.get_events_organised_ids()):
+            if deleted >= limit:
+                return deleted
+            e = self.db_interface.get_obj(event_id, Event)
+            if e:
+                e.set_owner_id(None)
+                self.db_interface.update(e)
+                self.events.publish(EventUpdated(e.get_id()))
+            u.remove_event_organised(event_id)
+            self.db_interface.update(u)
+            deleted += 1
+
+        for event_id in list(u.get_events_attending_ids()):
+            if deleted >= limit:
+                return deleted
+            a = self.get_attendance(u, event_id)
+            if a:
+                self.delete_attendance(a)
+            else:  # Not listed consistently (see porg_fsck.py), so just drop the event id
+                u.remove_event_attending(event_id)
+                self.db_interface.update(u)
+            deleted += 1
+
+        for survey_id in list(u.get_survey_ids()):
+            self.delete_survey(survey_id, soft=True)
+
+        for question_id in list(u.get_question_ids()):
+            if deleted >= limit:
+                return deleted
+            q = self.db_interface.get_obj(question_id, Question)
+            if q:
+                deleted += self._collect_question(q, limit - deleted)
+            else:  # Not listed consistently (see porg_fsck.py), so just drop the question id
+                u.remove_question_id(question_id)
+                self.db_interface.update(u)
+                deleted += 1
+
+        if deleted >= limit:
+            return deleted
+        self.db_interface.delete(u)
+        return deleted + 1
+
+    def _collect_event(self, e, limit):
+        """Deletes up to limit of the soft deleted event's attendances, then the event if none are
+        left. Its surveys are soft deleted, to be collected separately. Returns the number of
+        objects deleted."""
+        for survey_id in list(e.get_survey_ids()):
+            self.delete_survey(survey_id, soft=True)
+
+        attendance_ids = e.get_attendance_ids()[:limit]
+        for attendance_id in attendance_ids:
+            if self.db_interface.get_obj(attendance_id, Attendance):
+                self.delete_attendance(attendance_id)
+            else:  # Not listed consistently (see porg_fsck.py), so just drop the attendance id
+                e.remove_attendance_id(attendance_id)
+                self.db_interface.update(e)
+        if len(attendance_ids) == limit:
+            return limit
+
+        self.db_interface.delete(e)
+        return len(attendance_ids) + 1
+
+    def _collect_survey(self, s, limit):
+        """Deletes up to limit of the soft deleted survey's questions and responses, then the survey
+        and its results if none are left. Returns the number of objects deleted."""
+        deleted = 0
+        for question_id in list(s.get_question_ids()):
+            if deleted >= limit:
+                return deleted
+            q = self.db_interface.get_obj(question_id, Question)
+            if q:
+                deleted += self._collect_question(q, limit - deleted)
+            else:  # Not listed consistently (see porg_fsck.py), so just drop the question id
+                s.remove_question_id(question_id)
+                self.db_interface.update(s)
+                deleted += 1
+
+        if deleted >= limit:
+            return deleted
+        self.db_interface.s.query(SurveyResult) \
+            .filter(SurveyResult.survey_id == s.get_id()) \
+            .delete(synchronize_session='evaluate')
+        self.db_interface.delete(s)
+        return deleted + 1
+
+    def _collect_question(self, q, limit):
+        """Deletes up to limit of the question's responses, then the question (with its choices) if
+        none are left. Returns the number of objects deleted."""
+        response_ids = q.get_response_ids()[:limit]
+        for response_id in response_ids:
+            if self.db_interface.get_obj(response_id, Response):
+                self.delete_response(response_id)
+            else:  # Not listed consistently (see porg_fsck.py), so just drop the response id
+                q.remove_response_id(response_id)
+                self.db_interface.update(q)
+        if len(response_ids) == limit:
+            return limit
+
+        for choice_id in list(q.get_allowed_choice_ids()):
+            if not self.db_interface.get_obj(choice_id, Choice):
+                q.remove_allowed_choice_id(choice_id)
+        self.delete_question(q)
+        return len(response_ids) + 1
+
+    def _tally_survey(self, s):
+        """Returns (response counts, choice counts) for the survey as stored in SurveyResult,
+        counting every Response to the survey's questions in a single query."""
+        questions = s.get_questions()
+        response_counts = {q.get_id(): 0 for q in questions}
+        choice_counts = {q.get_id(): {choice_id: 0 for choice_id in q.get_allowed_choice_ids()}
+                         for q in questions}
+
+        if questions:
+            rows = self.db_interface.s.query(Response.question_id, Response.choice_ids) \
+                .filter(Response.question_id.in_(list(response_counts)))
+            for question_id, choice_ids in rows:
+                response_counts[question_id] += 1
+                counts = choice_counts[question_id]
+                for choice_id in choice_ids or []:
+                    counts[choice_id] = counts.get(choice_id, 0) + 1
+
+        return response_counts, choice_counts
+
+    @retry_on_conflict
+    def close_survey(self, survey_obj, closed_time=None):
+        """Closes the survey so it no longer accepts responses, and stores its final tallies.
+        closed_time defaults to now. Returns the SurveyResult. Raises SurveyClosedError if the
+        survey is already closed."""
+        s = self.check_obj_exists(survey_obj, Survey)
+        if s.is_closed():
+            raise SurveyClosedError("Survey {} is already closed".format(s.get_id()))
+
+        s.set_closed_time(closed_time or datetime.datetime.now())
+        result = SurveyResult(s.get_id(), s.get_closed_time(), *self._tally_survey(s))
+        self.db_interface.add(result)  # Commits closed_time with the result
+        self.events.publish(SurveyClosed(s.get_id(), s.get_event_id()))
+
+        return result
+
+    def get_survey_results(self, survey_obj):
+        """Returns a SurveyResult with the survey's tallies. For a closed survey this is the result
+        stored when it was closed. For an open survey the tallies are counted now, and the result
+        is not stored (its closed_time is None)."""
+        s = self.check_obj_exists(survey_obj, Survey)
+        if s.is_closed():
+            return self.db_interface.query(SurveyResult, SurveyResult.survey_id == s.get_id())
+        return SurveyResult(s.get_id(), None, *self._tally_survey(s))
 
     def get_responder(self, response_obj):
         r = self.check_obj_exists(response_obj, Response)
@@ -415,12 +1309,11 @@ class PorgWrapper:
         if not is_user and not is_survey:
             raise TypeError("Invalid object type for get_questions: expected User or Survey")
 
-        res = []
-        for question_id in obj.get_question_ids():
-            q = self.check_obj_exists(question_id, Question)
-            res.append(q)
-
-        return res
+        # Loaded in one query, with their choices in another as they are usually shown together
+        res = obj.get_questions()
+        if len(res) != len(obj.get_question_ids()):
+            raise QuestionNotFoundError("Question could not be found")
+        return preload(res, 'choices')
 
     def get_owner(self, obj):
         is_event = isinstance(obj, Event)
@@ -438,9 +1331,9 @@ class PorgWrapper:
         if not is_user and not is_event:
             raise TypeError("Invalid object type for get_surveys: expected User or Event")
 
-        res = []
-        for survey_id in obj.get_survey_ids():
-            s = self.check_obj_exists(survey_id, Survey)
-            res.append(s)
-
+        res = obj.get_surveys()
+        if len(res) != len(obj.get_survey_ids()) or any(s.is_deleted() for s in res):
+            raise SurveyNotFoundError("Survey could not be found")
+        if is_event:  # An event's surveys are shown with their questions and choices
+            preload([q for s in preload(res, 'questions') for q in s.get_questions()], 'choices')
         return res
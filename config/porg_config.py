@@ -1,12 +1,74 @@
+from datetime import timedelta
+
 env = 'test'
 if env == 'test':
     DB_NAME = 'porg_test.db'
+    ARCHIVE_DB_NAME = 'porg_test_archive.db'
+    SHARD_DIR = 'shards_test'
 elif env == 'prod':
     DB_NAME = 'porg.db'
+    ARCHIVE_DB_NAME = 'porg_archive.db'
+    SHARD_DIR = 'shards'
 else:
     DB_NAME = None
+    ARCHIVE_DB_NAME = None
+    SHARD_DIR = None
 
 DB_URL = 'sqlite:///' + DB_NAME
+ARCHIVE_DB_URL = 'sqlite:///' + ARCHIVE_DB_NAME
+
+# Events that started more than this long ago are moved to the archive database - see porg_archive.py
+ARCHIVE_AFTER = timedelta(days=90)
+PAST_EVENTS_SHOWN = 10  # Default number of events listed by !past
+
+# Sharding config - see PorgShards.ShardManager
+MAX_OPEN_SHARDS = 32
 
 # Survey config
 ALLOWED_QUESTION_TYPES = ['free', 'choose_one', 'choose_many']
+
+# Recurring events - occurrences are created as Events up to RECURRENCE_HORIZON ahead, checked
+# every RECURRENCE_INTERVAL by the Discord interface
+RECURRENCE_TYPES = ['daily', 'weekly', 'monthly']
+RECURRENCE_HORIZON = timedelta(days=28)
+RECURRENCE_INTERVAL = timedelta(hours=6)
+
+# Discord interface command pools - see CommandRouter.WorkerPool
+COMMAND_WORKERS = 4
+HEAVY_COMMAND_WORKERS = 2
+COMMAND_QUEUE_SIZE = 100
+MAX_COMMANDS_PER_USER = 2
+MAX_COMMANDS_PER_GUILD = 20
+
+# Discord interface rate limiting and read caching - see CommandRouter.RateLimiter and
+# CommandRouter.RequestCoalescer
+COMMAND_RATE = 0.5  # Commands per second allowed per user, after a burst of COMMAND_BURST
+COMMAND_BURST = 5
+READ_CACHE_TTL = 5  # Seconds
+
+# Maximum number of rendered event/survey views kept per database - see PorgCache.RenderCache -
+# and of events/surveys whose version stamps are kept - see PorgCache.VersionTracker
+RENDER_CACHE_SIZE = 500
+VERSION_TRACKER_SIZE = 5000
+
+# Soft deletes - with SOFT_DELETE, deleted events, surveys and users are hidden straight away and
+# their rows deleted by PorgWrapper.collect_garbage, which the Discord interface runs every
+# GC_INTERVAL, GC_BATCH_SIZE objects per transaction
+SOFT_DELETE = False
+GC_BATCH_SIZE = 200
+GC_INTERVAL = timedelta(minutes=1)
+
+# Optimistic concurrency - see PorgConcurrency.retry_on_conflict
+CONFLICT_RETRIES = 3
+CONFLICT_BACKOFF = 0.05  # Seconds before the first retry, doubled for each later retry
+
+# Prepared statements kept per SQLite connection - see PorgQueries
+STATEMENT_CACHE_SIZE = 256
+
+# Attendees shown per page of !event - see PorgWrapper.get_roster - and number of events whose
+# page cursors are remembered - see PorgWrapper.get_roster_page
+ROSTER_PAGE_SIZE = 20
+ROSTER_CURSOR_CACHE_SIZE = 500
+
+# How long before an event starts reminders are sent - see PorgReminders.ReminderScheduler
+REMINDER_OFFSETS = [timedelta(days=1), timedelta(hours=1)]
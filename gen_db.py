@@ -1,90 +1,264 @@
 #!/usr/bin/env python3.5
+import argparse
+import pickle
 import sqlite3
 from config import porg_config
 
+# Attendance rows read at a time by backfill_attendance_roles
+BACKFILL_BATCH_SIZE = 10000
 
-def drop_tables(c):
-    try:
-        c.execute('DROP TABLE events')
-        c.execute('DROP TABLE users')
-        c.execute('DROP TABLE attendance')
-        c.execute('DROP TABLE questions')
-        c.execute('DROP TABLE choices')
-        c.execute('DROP TABLE responses')
-        c.execute('DROP TABLE surveys')
-    except sqlite3.OperationalError:
-        pass
-
-
-def create_tables(c):
-    c.execute('''CREATE TABLE events(
-        id INTEGER PRIMARY KEY,
+# Every table, in creation order: (name, definition)
+TABLES = [
+    ('events', '''CREATE TABLE IF NOT EXISTS events(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         name TEXT NOT NULL,
         owner_id INTEGER,
         location TEXT,
         time DATETIME,
         attendance_ids BLOB,
-        survey_ids BLOB);
-    ''')
-
-    c.execute('''CREATE TABLE users(
-        id INTEGER PRIMARY KEY,
+        survey_ids BLOB,
+        recurrence TEXT,
+        recurrence_end DATETIME,
+        recurrence_count INTEGER,
+        materialized_until DATETIME,
+        series_id INTEGER,
+        deleted_time DATETIME);
+    '''),
+    ('users', '''CREATE TABLE IF NOT EXISTS users(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         username TEXT NOT NULL,
         events_organised_ids BLOB,
         events_attending_ids BLOB,
         survey_ids BLOB,
         question_ids BLOB,
-        response_ids BLOB);
-    ''')
-
-    c.execute('''CREATE TABLE attendance(
-        id INTEGER PRIMARY KEY,
+        response_ids BLOB,
+        deleted_time DATETIME);
+    '''),
+    ('attendance', '''CREATE TABLE IF NOT EXISTS attendance(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         user_id INTEGER NOT NULL,
         event_id INTEGER NOT NULL,
         going_status TEXT NOT NULL,
         roles BLOB);
-    ''')
-
-    c.execute('''CREATE TABLE surveys(
-        id INTEGER PRIMARY KEY,
+    '''),
+    ('attendance_roles', '''CREATE TABLE IF NOT EXISTS attendance_roles(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
+        attendance_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        event_id INTEGER NOT NULL,
+        role TEXT NOT NULL);
+    '''),
+    ('surveys', '''CREATE TABLE IF NOT EXISTS surveys(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         name TEXT NOT NULL,
         owner_id INTEGER,
         event_id INTEGER,
-        question_ids BLOB);
-    ''')
-
-    c.execute('''CREATE TABLE questions(
-        id INTEGER PRIMARY KEY,
+        question_ids BLOB,
+        closed_time DATETIME,
+        deleted_time DATETIME);
+    '''),
+    ('survey_results', '''CREATE TABLE IF NOT EXISTS survey_results(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
+        survey_id INTEGER NOT NULL,
+        closed_time DATETIME,
+        response_counts BLOB,
+        choice_counts BLOB);
+    '''),
+    ('questions', '''CREATE TABLE IF NOT EXISTS questions(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         owner_id INTEGER NOT NULL,
         question TEXT NOT NULL,
         question_type TEXT NOT NULL,
         survey_id INTEGER,
         allowed_choice_ids BLOB,
         response_ids BLOB);
-    ''')
-
-    c.execute('''CREATE TABLE choices(
-        id INTEGER PRIMARY KEY,
+    '''),
+    ('choices', '''CREATE TABLE IF NOT EXISTS choices(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         question_id INTEGER NOT NULL,
         choice text NOT NULL);
-    ''')
-
-    c.execute('''CREATE TABLE responses(
-        id INTEGER PRIMARY KEY,
+    '''),
+    ('responses', '''CREATE TABLE IF NOT EXISTS responses(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version_id INTEGER NOT NULL DEFAULT 1,
         response_text TEXT,
         responder_id INTEGER NOT NULL,
         question_id INTEGER NOT NULL,
         choice_ids BLOB);
-    ''')
+    '''),
+]
+
+INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_events_series_time ON events(series_id, time);',
+    'CREATE INDEX IF NOT EXISTS ix_events_deleted ON events(deleted_time) WHERE deleted_time IS NOT NULL;',
+    'CREATE INDEX IF NOT EXISTS ix_users_deleted ON users(deleted_time) WHERE deleted_time IS NOT NULL;',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_attendance_event_user ON attendance(event_id, user_id);',
+    'CREATE INDEX IF NOT EXISTS ix_attendance_event_status ON attendance(event_id, going_status, user_id);',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_attendance_roles_attendance_role '
+    'ON attendance_roles(attendance_id, role);',
+    'CREATE INDEX IF NOT EXISTS ix_attendance_roles_event_role ON attendance_roles(event_id, role);',
+    'CREATE INDEX IF NOT EXISTS ix_attendance_roles_user ON attendance_roles(user_id);',
+    'CREATE INDEX IF NOT EXISTS ix_surveys_deleted ON surveys(deleted_time) WHERE deleted_time IS NOT NULL;',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_survey_results_survey ON survey_results(survey_id);',
+]
+
+
+def drop_tables(c):
+    for name, definition in TABLES:
+        c.execute('DROP TABLE IF EXISTS {}'.format(name))
+    c.execute('DROP TABLE IF EXISTS search_index')
+
+
+def create_tables(c):
+    """Creates the tables and indexes that don't already exist."""
+    for name, definition in TABLES:
+        c.execute(definition)
+    for index in INDEXES:
+        c.execute(index)
+
+
+def backfill_attendance_roles(c):
+    """Inserts a row into attendance_roles for each role in the pickled Attendance.roles that lacks
+    one, as needed by databases created before the attendance_roles table (see migrate). Rows
+    already present are kept, so it can be run again (porg_fsck.py --repair also removes rows
+    for roles an attendance no longer has). Returns the number of rows inserted."""
+    inserted = 0
+    after = 0
+    while True:
+        rows = c.execute('SELECT id, user_id, event_id, roles FROM attendance WHERE id > ? '
+                         'ORDER BY id LIMIT ?', (after, BACKFILL_BATCH_SIZE)).fetchall()
+        if not rows:
+            return inserted
+        role_rows = [(attendance_id, user_id, event_id, role)
+                     for attendance_id, user_id, event_id, roles in rows
+                     for role in sorted(set(pickle.loads(roles) if roles else []))]
+        before = c.connection.total_changes
+        c.executemany('INSERT OR IGNORE INTO attendance_roles (attendance_id, user_id, event_id, role) '
+                      'VALUES (?, ?, ?, ?)', role_rows)
+        inserted += c.connection.total_changes - before
+        after = rows[-1][0]
+
+
+# Tables covered by the search index: (table, type code, indexed text, columns it is built from).
+# {0} in the indexed text is replaced by the row's prefix (e.g. new.).
+SEARCHED_TABLES = [
+    ('events', 0, "{0}name || ' ' || coalesce({0}location, '')", 'name, location'),
+    ('surveys', 1, '{0}name', 'name'),
+    ('questions', 2, '{0}question', 'question'),
+    ('choices', 3, '{0}choice', 'choice'),
+]
+
+
+def create_search_index(c):
+    """Full-text index over event, survey, question and choice text, kept in sync by triggers.
+    Each row's rowid is obj_id * 4 + type code (events 0, surveys 1, questions 2, choices 3, see
+    PorgWrapper.SEARCH_TYPES) so rows can be updated and deleted without scanning the index."""
+    c.execute('CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(body);')
+
+    for table, type_code, body, columns in SEARCHED_TABLES:
+        body = body.format('new.')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS {0}_search_insert AFTER INSERT ON {0} BEGIN
+            INSERT INTO search_index(rowid, body) VALUES (new.id * 4 + {1}, {2});
+        END;'''.format(table, type_code, body))
+
+        c.execute('''CREATE TRIGGER IF NOT EXISTS {0}_search_update AFTER UPDATE OF {3} ON {0} BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 4 + {1};
+            INSERT INTO search_index(rowid, body) VALUES (new.id * 4 + {1}, {2});
+        END;'''.format(table, type_code, body, columns))
+
+        c.execute('''CREATE TRIGGER IF NOT EXISTS {0}_search_delete AFTER DELETE ON {0} BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 4 + {1};
+        END;'''.format(table, type_code))
+
+
+def rebuild_search_index(c):
+    """Refills the search index from the indexed tables. The triggers only index rows written
+    after the index was created, so this indexes rows that existed before (see migrate), and
+    porg_fsck.py --repair runs it to fix an index that has drifted from its tables."""
+    c.execute('DELETE FROM search_index')
+    for table, type_code, body, columns in SEARCHED_TABLES:
+        c.execute('INSERT INTO search_index(rowid, body) SELECT id * 4 + {1}, {2} FROM {0}'.format(
+            table, type_code, body.format('')))
+
+
+def _columns(c, table):
+    """Returns (name, type, not null, default) of each column of table, in order."""
+    return [(name, col_type, not_null, default)
+            for cid, name, col_type, not_null, default, pk
+            in c.execute('PRAGMA table_info({})'.format(table)).fetchall()]
+
+
+def migrate_tables(c):
+    """Brings the tables of an existing database, e.g. one created by an older gen_db.py, up to
+    date. Missing columns are added (existing rows get the column's default, so version_id starts
+    at 1), tables created without AUTOINCREMENT are rebuilt with it so archived ids are never
+    reused (see DbInterface.next_id), missing tables and indexes are created, and sqlite_sequence
+    gets a row for every table. Tables already up to date are left alone, so it can be run again."""
+    # Expected columns are read from a scratch copy of the schema
+    scratch = sqlite3.connect(':memory:').cursor()
+    create_tables(scratch)
+
+    for table, definition in TABLES:
+        existing = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (table,)).fetchone()
+        if existing is None:
+            continue
+
+        names = {column[0] for column in _columns(c, table)}
+        for name, col_type, not_null, default in _columns(scratch, table):
+            if name not in names:
+                c.execute('ALTER TABLE {} ADD COLUMN {} {}{}{}'.format(
+                    table, name, col_type, ' NOT NULL' if not_null else '',
+                    ' DEFAULT ' + default if default is not None else ''))
+
+        if 'AUTOINCREMENT' not in existing[0].upper():
+            columns = ', '.join(column[0] for column in _columns(scratch, table))
+            c.execute('ALTER TABLE {0} RENAME TO {0}_migrating'.format(table))
+            c.execute(definition)
+            c.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {0}_migrating'.format(table, columns))
+            c.execute('DROP TABLE {}_migrating'.format(table))
+
+    create_tables(c)
+    for table, definition in TABLES:
+        c.execute('INSERT INTO sqlite_sequence (name, seq) SELECT ?, (SELECT coalesce(max(id), 0) '
+                  'FROM {}) WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)'.format(table),
+                  (table, table))
+
+
+def migrate(c):
+    """Upgrades an existing database to the current schema (see migrate_tables), creating the
+    search index if it is missing and (re)building it, and filling in attendance_roles from the
+    pickled roles. Returns the number of attendance roles inserted."""
+    migrate_tables(c)
+    create_search_index(c)
+    rebuild_search_index(c)
+    return backfill_attendance_roles(c)
 
 
 def generate(c):
     drop_tables(c)
     create_tables(c)
+    create_search_index(c)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create a blank database.")
+    parser.add_argument('--migrate', action='store_true',
+                        help="Instead, upgrade an existing database to the current schema")
+    args = parser.parse_args()
+
     conn = sqlite3.connect(porg_config.DB_NAME)
     c = conn.cursor()
-    generate(c)
+    if args.migrate:
+        print('{} attendance roles inserted'.format(migrate(c)))
+    else:
+        generate(c)
     conn.commit()
     conn.close()
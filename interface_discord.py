@@ -2,17 +2,126 @@
 """
 NB: Interface is currently broken - redesigning application structure
 """
+import asyncio
 import datetime
+import traceback
 import discord
-import shlex
-from config import discord_config
-from Poorganiser import User, Event, Attendance
-from PorgWrapper import PorgWrapper
+from config import discord_config, porg_config
+from CommandRouter import CommandRouter, WorkerPool, ShardExecutors, RateLimiter, RequestCoalescer
+from Poorganiser import User, Event, Attendance, Survey, Question, Choice
+from PorgReminders import ReminderScheduler
+from PorgShards import ShardManager
 from PorgExceptions import *
 
 
 client = discord.Client()
-porg = PorgWrapper()
+router = CommandRouter()
+
+# Heavy commands (e.g. rendering a whole event) get their own workers so a burst of them cannot
+# starve lightweight commands. Handlers are run on their server's thread (see ShardExecutors), so
+# the event loop keeps serving other commands while one runs.
+light_pool = WorkerPool(porg_config.COMMAND_WORKERS, porg_config.COMMAND_QUEUE_SIZE,
+                        porg_config.MAX_COMMANDS_PER_USER, porg_config.MAX_COMMANDS_PER_GUILD)
+heavy_pool = WorkerPool(porg_config.HEAVY_COMMAND_WORKERS, porg_config.COMMAND_QUEUE_SIZE,
+                        porg_config.MAX_COMMANDS_PER_USER, porg_config.MAX_COMMANDS_PER_GUILD)
+
+executors = ShardExecutors()  # One thread per open Discord server, which alone uses its PorgWrapper
+
+rate_limiter = RateLimiter(porg_config.COMMAND_RATE, porg_config.COMMAND_BURST)
+
+# Identical read commands in the same server (e.g. everyone typing !event 42 after it is announced)
+# are run once and share their reply
+read_cache = RequestCoalescer(porg_config.READ_CACHE_TTL)
+
+
+def watchShard(guild_key, porg):
+    # Cached replies for a server are dropped once per batch of changes to its data. Commands and
+    # background tasks flush porg.events when they finish so the last batch is never held back.
+    # Changes are published on the server's thread, so the cache is invalidated on the event loop.
+    porg.events.subscribe(lambda changes: client.loop.call_soon_threadsafe(read_cache.invalidate, guild_key),
+                          batch_size=100)
+
+    # Loading reminders scans the server's upcoming events, so it is done on the server's thread,
+    # ahead of any command for it, with the database pinned open until it finishes
+    shards.pin(guild_key)
+    executors.submit(guild_key, reminders.watch, porg, guild_key) \
+        .add_done_callback(lambda future: watchedShard(guild_key, future))
+
+
+def watchedShard(guild_key, future):
+    shards.unpin(guild_key)
+    error = None if future.cancelled() else future.exception()
+    if error:
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+
+def closeShard(guild_key, porg):
+    # Shards are only evicted once unpinned, when no calls are running or queued on the server's
+    # thread. A new thread is started if the shard is reopened.
+    executors.shutdown(guild_key, wait=False)
+
+
+async def materializeOccurrences():
+    """Creates the occurrences of recurring events that come within porg_config.RECURRENCE_HORIZON,
+    every porg_config.RECURRENCE_INTERVAL."""
+    while True:
+        for guild_key in shards.get_shard_keys():
+            with shards.pinned(guild_key) as porg:
+                try:
+                    await executors.run(guild_key, porg.materialize_occurrences)
+                finally:
+                    await executors.run(guild_key, porg.events.flush)  # Invalidates read_cache
+        await asyncio.sleep(porg_config.RECURRENCE_INTERVAL.total_seconds())
+
+
+async def collectGarbage():
+    """Deletes the rows of soft deleted events, surveys and users every porg_config.GC_INTERVAL,
+    porg_config.GC_BATCH_SIZE objects at a time so commands can run in between."""
+    while True:
+        for guild_key in shards.get_shard_keys():
+            with shards.pinned(guild_key) as porg:
+                try:
+                    while await executors.run(guild_key, porg.collect_garbage):
+                        pass
+                finally:
+                    await executors.run(guild_key, porg.events.flush)  # Invalidates read_cache
+        await asyncio.sleep(porg_config.GC_INTERVAL.total_seconds())
+
+
+def renderReminder(event, offset, attendees):
+    """Returns (reminder text, usernames of the attendees)."""
+    minutes = int(offset.total_seconds() // 60)
+    if minutes and minutes % (24 * 60) == 0:
+        starts_in = '{} day(s)'.format(minutes // (24 * 60))
+    elif minutes and minutes % 60 == 0:
+        starts_in = '{} hour(s)'.format(minutes // 60)
+    else:
+        starts_in = '{} minute(s)'.format(minutes)
+    text = 'Reminder: {} starts in {}\n{}'.format(event.get_name(), starts_in, shortEventInfo(event))
+    return text, [attendee.get_username() for attendee in attendees]
+
+
+async def sendReminder(guild_key, event, offset, attendees):
+    """DMs a reminder about event to each attendee going to it."""
+    with shards.pinned(guild_key):
+        text, usernames = await executors.run(guild_key, renderReminder, event, offset, attendees)
+    for username in usernames:
+        member = discord.utils.get(client.get_all_members(), id=username)
+        if member:
+            await client.send_message(member, text)
+
+
+async def runInShard(guild_key, fn, *args):
+    """Runs fn(*args) on the server's thread, keeping its database open meanwhile."""
+    with shards.pinned(guild_key):
+        return await executors.run(guild_key, fn, *args)
+
+
+shards = ShardManager(on_open=watchShard, on_close=closeShard)  # One database per Discord server
+reminders = ReminderScheduler(shards.get, sendReminder, loop=client.loop)
+reminders_task = None
+recurrence_task = None
+gc_task = None
 
 
 def idToUsername(members, userID):
@@ -29,12 +138,17 @@ def userToID(username):
             return int(member.id)
 
 
-def shortEventInfo(event):
-    return "[{}]\t{}\t{}\t{}".format(event.get_id(), event.get_name(), event.get_location(),
-                                     event.get_time())
+def shortEventInfo(row):
+    """Renders an Event or EventRow - cheap enough not to need the render cache."""
+    return "[{}]\t{}\t{}\t{}".format(row.id, row.name, row.location, row.time)
+
+
+def fullEventInfo(porg, event, page=1):
+    return porg.get_rendered(event, ('full_event', page),
+                             lambda event: renderFullEventInfo(porg, event, page))
 
 
-def fullEventInfo(event):
+def renderFullEventInfo(porg, event, page=1):
     fullInfo = ""
     eventID = event.get_id()
     event_name = event.get_name()
@@ -43,274 +157,480 @@ def fullEventInfo(event):
     fullInfo += "**Location:** {}\n".format(event_location)
     event_time = event.get_time()
     fullInfo += "**Date:** {}\n".format(event_time)
-    fullInfo += "**People:**\n"
+    headcount = porg.get_event_headcount(event)
+    fullInfo += "**People:** {}\n".format(', '.join("{} {}".format(count, going_status)
+                                                    for going_status, count in sorted(headcount.items())))
     fullInfo += "*Name\t\tGoing\tResponsibilities*\n"
-    attendances = porg.get_attendances(event)
-    for at in attendances:
-        username = idToUsername(client.get_all_members(), at.get_user_id())
-        going_status = at.get_going_status()
-        roles = at.get_roles()
-
-        fullInfo += "{}\t\t{}\t{}\n".format(username, going_status, ' '.join(roles))
+    rows, page_count = porg.get_roster_page(event, page)
+    for row in rows:
+        username = idToUsername(client.get_all_members(), row.username) if row.username else None
+        fullInfo += "{}\t\t{}\t{}\n".format(username, row.going_status, ' '.join(row.roles))
+    if page_count > 1:
+        fullInfo += "Page {} of {} (!event {} page <number>)\n".format(page, page_count, eventID)
     return fullInfo
 
+
+def surveyInfo(porg, survey):
+    return porg.get_rendered(survey, 'survey', lambda survey: renderSurveyInfo(porg, survey))
+
+
+def renderSurveyInfo(porg, survey):
+    out = "**Survey [{}]:** {}{}\n".format(survey.get_id(), survey.get_name(),
+                                          " (closed)" if survey.is_closed() else "")
+    for question in porg.get_questions(survey):
+        out += '{} {}\n'.format(question.get_id(), question.get_question())
+        for choice in question.get_choices():
+            out += '\t{} {}\n'.format(choice.get_id(), choice.get_choice())
+    return out
+
 @client.event
 async def on_ready():
     print('Logged in as')
     print(client.user.name)
     print(client.user.id)
     print('------')
+    light_pool.start()
+    heavy_pool.start()
+
+    global reminders_task
+    if not reminders_task:
+        reminders_task = asyncio.ensure_future(reminders.run(runInShard))
+        # Opening each shard loads its upcoming reminders (see watchShard). Waiting for each shard's
+        # thread to finish loading keeps at most porg_config.MAX_OPEN_SHARDS open.
+        for guild_key in shards.get_shard_keys():
+            await runInShard(guild_key, lambda: None)
+
+    global recurrence_task
+    if not recurrence_task:
+        recurrence_task = asyncio.ensure_future(materializeOccurrences())
+
+    global gc_task
+    if not gc_task:
+        gc_task = asyncio.ensure_future(collectGarbage())
 
 @client.event
 async def on_message(message):
-    content = message.content
-    if content.startswith('!hello'):
-        await client.send_message(message.channel, 'Hello {}!'.format(message.author.mention))
-    elif content.strip() == '!register':
+    try:
+        match = router.dispatch(message.content)
+    except ValueError:  # Unbalanced quotes
+        await client.send_message(message.channel, 'Could not read command, check your quotes')
+        return
+    if not match:  # Not a command
+        return
+
+    command, splits = match
+    if not rate_limiter.allow(message.author.id):
+        await client.send_message(message.channel, 'You are sending commands too quickly, please slow down')
+        return
+
+    guild_key = message.server.id if message.server else 'direct'
+    pool = heavy_pool if command.heavy else light_pool
+    if not pool.submit(lambda: run_command(command, message, splits, guild_key), message.author.id, guild_key):
+        await client.send_message(message.channel, 'Too many commands at once, please try again shortly')
+
+
+async def run_command(command, message, splits, guild_key):
+    """Runs the command's handler on the server's thread and sends its reply: a message, a list
+    of messages or None. Replies of cached commands are shared with identical commands in the
+    same server. Changes made by any other command are delivered to batched subscribers (e.g. the
+    watchShard cache invalidation) once it finishes. The server's database is pinned open until
+    the handler has finished."""
+    with shards.pinned(guild_key) as porg:
+        if command.cached:
+            reply = await read_cache.run(guild_key, tuple(splits),
+                                         lambda: executors.run(guild_key, command.handler, message, porg, splits))
+        else:
+            try:
+                reply = await executors.run(guild_key, command.handler, message, porg, splits)
+            finally:
+                await executors.run(guild_key, porg.events.flush)
+
+    for text in [reply] if isinstance(reply, str) else reply or []:
+        await client.send_message(message.channel, text)
+
+
+def is_admin(message):
+    return True  # TODO IF IS ADMIN
+
+
+def admin_command(name, heavy=False):
+    """Registers the decorated handler as a command that only admins may use."""
+    def decorator(handler):
+        def admin_handler(message, porg, splits):
+            if is_admin(message):
+                return handler(message, porg, splits)
+            return 'You do not have permission to do that'
+        router.add_command(name, admin_handler, heavy)
+        return handler
+    return decorator
+
+
+@router.command('!hello')
+def cmd_hello(message, porg, splits):
+    return 'Hello {}!'.format(message.author.mention)
+
+
+@router.command('!register')
+def cmd_register(message, porg, splits):
+    try:
+        porg.register_user(message.author.id)
+        return 'Registered user {} with id {}.'.format(message.author.display_name, message.author.id)
+    except UserRegisteredError:
+        return 'You have already registered!'
+
+
+@router.command('!unregister')
+def cmd_unregister(message, porg, splits):
+    try:
+        porg.unregister_user(message.author.id)
+        return 'You have unregistered. Goodbye!'
+    except UserNotFoundError:
+        return 'You have not registerd yet!'
+
+
+@router.command('!help', cached=True)
+def cmd_help(message, porg, splits):
+    return porg.get_help()
+
+
+@router.command('!curr', cached=True)
+def cmd_curr(message, porg, splits):
+    out = "ID\tNAME\tLOCATION\tDATE\n"
+    for row in porg.get_curr_event_rows():
+        out += shortEventInfo(row) + '\n'
+    return out
+
+
+@router.command('!past', heavy=True, cached=True)
+def cmd_past(message, porg, splits):
+    if len(splits) > 2 or (len(splits) == 2 and not splits[1].isdigit()):
+        return 'Incorrect arguments. Correct usage: !past [number of events]'
+    rows = porg.get_past_event_rows(int(splits[1]) if len(splits) == 2 else porg_config.PAST_EVENTS_SHOWN)
+    out = "ID\tNAME\tLOCATION\tDATE\n"
+    for row in rows:
+        out += shortEventInfo(row) + '\n'
+    return 'Past Events:\n{}'.format(out)
+
+
+@router.command('!allevents', heavy=True, cached=True)
+def cmd_allevents(message, porg, splits):
+    out = "ID\tNAME\tLOCATION\tDATE\n"
+    for row in porg.get_all_event_rows():
+        out += shortEventInfo(row) + '\n'
+    return 'All Events:\n{}'.format(out)
+
+
+@router.command('!mystatus', heavy=True)
+def cmd_mystatus(message, porg, splits):
+    user = porg.get_user_by_username(message.author.id)
+    if not user:
+        status_message = 'Not registered! Use !register'
+    else:
+        status_message = 'Registered user {} with id {}.\n'.format(message.author.display_name, message.author.id)
+        status_message += "Your events:\n"
+        status_message += "ID\tNAME\tLOCATION\tDATE\tGOING\tRESPONSIBILITIES\n"
+        for row in porg.get_user_event_rows(user):
+            status_message += "{}\t{}\t{}\n".format(shortEventInfo(row), row.going_status, row.roles)
+
+    return status_message
+
+
+@router.command('!going')
+@router.command('!notgoing')
+def cmd_going(message, porg, splits):
+    cmd = splits[0]
+    if len(splits) != 2:
+        return 'Incorrect number of arguments. Correct usage: !going <eventid>'
+    elif not splits[1].isdigit():  # Not a number!
+        return 'Incorrect event id type. Please specify a number.'
+    else:
         try:
-            porg.register_user(message.author.id)
-            await client.send_message(message.channel, 'Registered user {} with id {}.'.format(
-                message.author.display_name, message.author.id))
-        except UserRegisteredError:
-            await client.send_message(message.channel, 'You have already registered!')
-    elif content.strip() == '!unregister':
+            porg.set_going_status(porg.get_user_by_username(message.author.id), int(splits[1]), cmd[1:])
+            return "You are now marked as {} to event {}".format(cmd[1:], splits[1])
+        except AttendanceNotFoundError:
+            return 'You are not invited to event {}'.format(splits[1])
+
+
+@router.command('!vote')
+def cmd_vote(message, porg, splits):
+    if len(splits) < 2:
+        return 'Usage: !vote <choieid>'
+    else:
+        userid = message.author.id
+        choiceid = splits[1]
+        res = porg.vote(userid, choiceid)
+        if res == None:
+            return 'You\'ve already voted for this choice!'
+        else:
+            return 'Successfully voted for choice (id: {})!'.format(choiceid)
+
+
+@router.command('!ans', cached=True)
+def cmd_ans(message, porg, splits):
+    if len(splits) != 2:
+        return 'Incorrect number of arguments. Correct usage: !ans <questionID>'
+    else:
+        questionid = splits[1]
+        result = porg.get_result(questionid)
+        if result:
+            return 'Result: {}: {}'.format(result.get_id(), result.get_choicetext())
+        else:
+            return 'No result found'
+
+
+@router.command('!event', heavy=True, cached=True)
+def cmd_event(message, porg, splits):
+    if len(splits) not in (2, 4) or (len(splits) == 4 and splits[2] != 'page'):
+        return 'Incorrect number of arguments. Correct usage: !event <eventid> [page <number>]'
+    elif not splits[1].isdigit() or (len(splits) == 4 and not splits[3].isdigit()):  # Not a number!
+        return 'Incorrect event id or page type. Please specify a number.'
+    else:
+        event = porg.get_event(int(splits[1]))
+        if not event:
+            return 'Event not found'
+        else:
+            return fullEventInfo(porg, event, int(splits[3]) if len(splits) == 4 else 1)
+
+
+@router.command('!question', cached=True)
+def cmd_question(message, porg, splits):
+    if len(splits) <= 1:
+        return 'Incorrect number of arguments. Correct usage: !question <question id>'
+    elif not splits[1].isdigit(): # Not a number!
+        return 'Incorrect question id type. Please specify a number.'
+    else:
+        out = ''
+        eventid = int(splits[1])
+        question = porg.get_question(eventid)
+        choices = porg.get_questionchoices(question.get_questionid())
+        for choice in choices:
+            out += '\t[{}]\t{}\n'.format(choice.get_id(), choice.get_choicetext())
+        return 'Question: {}\nChoices:\n{}'.format(question.get_text(), out)
+
+
+@router.command('!survey', heavy=True, cached=True)
+def cmd_survey(message, porg, splits):
+    """Get all questions associated with event"""
+    if len(splits) <= 1:
+        return 'Incorrect number of arguments. Correct usage: !survey <eventid>'
+    elif not splits[1].isdigit(): # Not a number!
+        return 'Incorrect event id type. Please specify a number.'
+    else:
+        event = porg.db_interface.get_obj(int(splits[1]), Event)
+        if not event:
+            return 'Event not found'
+        out = ''
+        for survey in porg.get_surveys(event):
+            out += surveyInfo(porg, survey)
+        return out or 'No surveys for event {}'.format(splits[1])
+
+
+@router.command('!results', cached=True)
+def cmd_results(message, porg, splits):
+    if len(splits) != 2:
+        return 'Incorrect number of arguments. Correct usage: !results <survey id>'
+    elif not splits[1].isdigit():  # Not a number!
+        return 'Incorrect survey id type. Please specify a number.'
+
+    survey = porg.db_interface.get_obj(int(splits[1]), Survey)
+    if not survey:
+        return 'Survey not found'
+    result = porg.get_survey_results(survey)
+    out = "**Results for survey [{}]:** {}{}\n".format(survey.get_id(), survey.get_name(),
+                                                      "" if survey.is_closed() else " (still open)")
+    for question in porg.get_questions(survey):
+        out += '{} ({} responses)\n'.format(question.get_question(), result.get_response_count(question.get_id()))
+        choice_counts = result.get_choice_counts(question.get_id())
+        for choice in question.get_choices():
+            out += '\t{}: {}\n'.format(choice.get_choice(), choice_counts.get(choice.get_id(), 0))
+    return out
+
+
+@router.command('!find', cached=True)
+def cmd_find(message, porg, splits):
+    if len(splits) < 2:
+        return 'Incorrect number of arguments. Correct usage: !find <search text>'
+    else:
+        out = ''
+        for result in porg.search(' '.join(splits[1:])):
+            if isinstance(result, Event):
+                out += 'Event\t' + shortEventInfo(result) + '\n'
+            elif isinstance(result, Survey):
+                out += 'Survey\t[{}]\t{}\n'.format(result.get_id(), result.get_name())
+            elif isinstance(result, Question):
+                out += 'Question\t[{}]\t{}\n'.format(result.get_id(), result.get_question())
+            elif isinstance(result, Choice):
+                out += 'Choice\t[{}]\t{} (question {})\n'.format(result.get_id(), result.get_choice(), result.get_question_id())
+        if out:
+            return 'Results:\n{}'.format(out)
+        else:
+            return 'No results found'
+
+
+@admin_command('!create', heavy=True)
+def cmd_create(message, porg, splits):
+    userID = message.author.id
+    if len(splits) <= 2 or len(splits) > 7:
+        return 'Incorrect number of arguments. Correct usage: !create event <name> OPTIONAL: <location> <year> <month> <day>'
+    elif splits[1] != "event":
+        return 'Unknown creation type'
+    else:
+        event_name = splits[2]
+        location = "Undecided"
+        year, month, day = None, None, None
         try:
-            porg.unregister_user(message.author.id)
-            await client.send_message(message.channel, 'You have unregistered. Goodbye!')
-        except UserNotFoundError:
-            await client.send_message(message.channel, 'You have not registerd yet!')
-
-    elif content.startswith('!help'):
-        await client.send_message(message.channel, porg.get_help())
-    elif content.strip() == "!curr":
-        events = porg.get_curr_events()
-        out = "ID\tNAME\tLOCATION\tDATE\n"
-        for event in events:
-            out += shortEventInfo(event) + '\n'
-        await client.send_message(message.channel, out)
-    elif content.strip() == "!past":
-        await client.send_message(message.channel, 'Not implemented yet!')
-    elif content.strip() == "!allevents":
-        events = porg.get_all_events()
-        out = "ID\tNAME\tLOCATION\tDATE\n"
-        for event in events:
-            if event:
-                out += shortEventInfo(event) + '\n'
-        await client.send_message(message.channel, 'All Events:\n{}'.format(out))
-    elif content.strip() == "!mystatus":
-        user = porg.get_user_by_username(message.author.id)
-        if not user:
-            status_message = 'Not registered! Use !register'
+            location = splits[3]
+            year = int(splits[4])
+            month = int(splits[5])
+            day = int(splits[6])
+            time = datetime.datetime(year, month, day)
+        except IndexError:
+            year, month, day = None, None, None #if error occured somewhere above, set date back to none
+
+        u = porg.get_user_by_username(userID)
+        new_event = porg.create_event(u.get_id(), event_name, location, time)
+        event_id = new_event.get_id()
+        members = message.server.members
+        for member in members:
+            user = porg.get_user_by_username(member.id)
+            if user: #only invite registered users
+                porg.create_attendance(user.get_id(), event_id, going_status="invited")
+        return ['New event {}, with ID {} created'.format(event_name, event_id),
+                'All members of channel invited. See !mystatus to check']
+
+
+@admin_command('!edit')
+def cmd_edit(message, porg, splits):
+    userID = message.author.id
+    if len(splits) < 4:
+        return 'Incorrect number of arguments. Correct usage: !edit <eventID> <field> <new_value>'
+    else:
+        eventID = splits[1]
+        edit_event = porg.db_interface.get_obj(int(eventID), Event) if eventID.isdigit() else None
+        if not edit_event:
+            return 'Event not found'
+        elif edit_event.get_owner_id() != getattr(porg.get_user_by_username(userID), 'id', None):
+            return 'You do not have permission to modify this event'
         else:
-            status_message = 'Registered user {} with id {}.\n'.format(message.author.display_name, message.author.id)
-            status_message += "Your events:\n"
-            user_events = porg.get_events_by_user(user.get_id())
-            status_message += "ID\tNAME\tLOCATION\tDATE\tGOING\tRESPONSIBILITIES\n"
-            for event in user_events:
-                if event:
-                    event_details = shortEventInfo(event)
-                    at = porg.get_attendance(event.get_id(), user.get_id())
-                    event_details += "\t{}\t{}".format(at.get_going_status(), at.get_roles())
-                    status_message += event_details + "\n"
-
-        await client.send_message(message.channel, status_message)
-
-    else: #multi argument commands
-        splits = shlex.split(content)
-        admin_commands = ["!create", "!edit", "!delete", "!add", "!remove"]
-        cmd = splits[0]
-        if cmd == "!going" or cmd == "!notgoing":
-            if len(splits) != 2:
-                await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !going <eventid>')
-            else:
-                if porg.get_event(splits[1]):
-                    eu = porg.get_eventuser(splits[1], message.author.id)
-                    eu.set_isgoing(cmd[1:])
-                    porg.update(eu)
-                    await client.send_message(message.channel, "You are now marked as {} to event {}".format(cmd[1:], splits[1]))
-                else:
-                    await client.send_message(message.channel, 'Event not found')
-        elif cmd == "!vote":
-            if len(splits) < 2:
-                await client.send_message(message.channel, 'Usage: !vote <choieid>')
-            else:
-                userid = message.author.id
-                choiceid = splits[1]
-                res = porg.vote(userid, choiceid)
-                if res == None:
-                    await client.send_message(message.channel, 'You\'ve already voted for this choice!')
+            edit_field = splits[2].lower()
+            if edit_field == "name":
+                porg.update_event(edit_event, name=splits[3])
+                return 'Event {}\'s name updated to {}'.format(eventID, splits[3])
+            elif edit_field == "location":
+                porg.update_event(edit_event, location=splits[3])
+                return 'Event {}\'s location updated to {}'.format(eventID, splits[3])
+            elif edit_field == "date":
+                if not len(splits) == 6:
+                    return 'Invalid date format. Use <year> <month> <day>'
                 else:
-                    await client.send_message(message.channel, 'Successfully voted for choice (id: {})!'.format(choiceid))
-        elif cmd == "!ans":
-            if len(splits) != 2:
-                await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !ans <questionID>')
+                    date = datetime.datetime(int(splits[3]), int(splits[4]), int(splits[5]))
+                    porg.update_event(edit_event, time=date)
+                    return 'Event {}\'s date updated to {}'.format(eventID, date)
             else:
-                questionid = splits[1]
-                result = porg.get_result(questionid)
-                if result:
-                    await client.send_message(message.channel, 'Result: {}: {}'.format(result.get_id(), result.get_choicetext()))
-                else:
-                    await client.send_message(message.channel, 'No result found')
-        elif cmd == "!event":
-            if len(splits) != 2:
-                await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !event <eventid>')
-            else:
-                event = porg.get_event(splits[1])
-                if not event:
-                    await client.send_message(message.channel, 'Event not found')
-                else:
-                    await client.send_message(message.channel, fullEventInfo(event))
-        elif cmd == "!question":
-            if len(splits) <= 1:
-                await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !question <question id>')
-            elif not splits[1].isdigit(): # Not a number!
-                await client.send_message(message.channel, 'Incorrect question id type. Please specify a number.')
-            else:
-                out = ''
-                eventid = int(splits[1])
-                question = porg.get_question(eventid)
-                choices = porg.get_questionchoices(question.get_questionid())
-                for choice in choices:
-                    out += '\t[{}]\t{}\n'.format(choice.get_id(), choice.get_choicetext())
-                await client.send_message(message.channel, 'Question: {}\nChoices:\n{}'.format(question.get_text(), out))
-        elif cmd == "!survey": # Get all questions associated with event
-            if len(splits) <= 1:
-                await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !survey <eventid>')
-            elif not splits[1].isdigit(): # Not a number!
-                await client.send_message(message.channel, 'Incorrect event id type. Please specify a number.')
+                return 'Invalid field type'
+
+
+@admin_command('!close')
+def cmd_close(message, porg, splits):
+    if len(splits) != 2 or not splits[1].isdigit():
+        return 'Incorrect arguments. Correct usage: !close <survey id>'
+    else:
+        try:
+            porg.close_survey(int(splits[1]))
+            return 'Survey {} closed. See !results {}'.format(splits[1], splits[1])
+        except SurveyNotFoundError:
+            return 'Survey not found'
+        except SurveyClosedError:
+            return 'Survey {} is already closed'.format(splits[1])
+
+
+@admin_command('!copysurvey')
+def cmd_copysurvey(message, porg, splits):
+    if len(splits) != 3 or not splits[1].isdigit() or not splits[2].isdigit():
+        return 'Incorrect arguments. Correct usage: !copysurvey <survey id> <event id>'
+    else:
+        try:
+            survey = porg.instantiate_template(int(splits[1]), int(splits[2]))
+            return 'Created survey {} for event {}'.format(survey.get_id(), splits[2])
+        except SurveyNotFoundError:
+            return 'Survey not found'
+        except EventNotFoundError:
+            return 'Event not found'
+
+
+@admin_command('!delete')
+def cmd_delete(message, porg, splits):
+    #TODO add confirmation for deletion
+    if len(splits) != 2 or not splits[1].isdigit():
+        return 'Incorrect arguments. Correct usage: !delete <event id>'
+    else:
+        try:
+            # Hidden straight away, its attendance and surveys are deleted later by collectGarbage
+            porg.delete_event(int(splits[1]), soft=True)
+            return 'Event {} was removed'.format(splits[1])
+        except EventNotFoundError:
+            return 'Remove failed, double check your event ID'
+
+
+@admin_command('!add')
+def cmd_add(message, porg, splits):
+    # Question, choices, roles
+    cmd_type = '<question|choice|role>'
+    if len(splits) >= 2:
+        if splits[1] in ['question', 'choice', 'role']:
+            cmd_type = splits[1]
+            msg = 'Incorrect number of arguments. Correct usage: !add {} '.format(cmd_type)
+            if cmd_type == 'question':
+                msg += '<event id> <question text>'
+            elif cmd_type == 'choice':
+                msg += '<question id> <choice text>'
+            elif cmd_type == 'role':
+                msg += '<event id> <username> <role text>'
+
+            if len(splits) < 4:
+                return 'Incorrect number of arguments. Correct usage: !add {} {}'.format(cmd_type, msg)
             else:
-                out = ''
-                eventid = int(splits[1])
-                questions = porg.get_questions(eventid)
-                for question in questions:
-                    out += '{} {}\n'.format(question.get_questionid(), question.get_text())
-                    choices = porg.get_questionchoices(question.get_questionid())
-                    for choice in choices:
-                        out += '\t{} {}\n'.format(choice.get_id(), choice.get_choicetext())
-                await client.send_message(message.channel, 'Questions:\n{}'.format(out))
-        elif cmd in admin_commands:
-            userID = message.author.id
-            if True: #TODO IF IS ADMIN
-                if cmd == "!create":
-                    if len(splits) <= 2 or len(splits) > 7:
-                        await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !create event <name> OPTIONAL: <location> <year> <month> <day>')
-                    elif splits[1] != "event":
-                        await client.send_message(message.channel, 'Unknown creation type')
-                    else:
-                        event_name = splits[2]
-                        location = "Undecided"
-                        year, month, day = None, None, None
+                if cmd_type == 'question':
+                    if len(splits) >= 3:
+                        eventid = splits[2]
+                        text = splits[3]
+                        yettovote = porg.get_eventusers(int(eventid))
+                        q = porg.add_question(eventid, text, yettovote)
+                        return 'Added question with id {}'.format(q.get_questionid())
+                elif cmd_type == 'choice':
+                    if len(splits) >= 3:
+                        questionid = splits[2]
+                        choicetext = splits[3]
+                        c = porg.add_questionchoice(questionid, choicetext)
+                        return 'Added choice `{}` with id {}'.format(c.get_choicetext(), c.get_id())
+                elif cmd_type == 'role':
+                    if len(splits) >= 4:
+                        eventid = splits[2]
+                        userid = userToID(splits[3])
+                        #userid = splits[3]
+                        roletext = splits[4]
                         try:
-                            location = splits[3]
-                            year = int(splits[4])
-                            month = int(splits[5])
-                            day = int(splits[6])
-                            time = datetime.datetime(year, month, day)
-                        except IndexError:
-                            year, month, day = None, None, None #if error occured somewhere above, set date back to none
-
-                        u = porg.get_user_by_username(userID)
-                        new_event = porg.create_event(u.get_id(), event_name, location, time)
-                        event_id = new_event.get_id()
-                        await client.send_message(message.channel, 'New event {}, with ID {} created'.format(event_name, event_id))
-                        members = message.server.members
-                        for member in members:
-                            user = porg.get_user_by_username(member.id)
-                            if user: #only invite registered users
-                                porg.create_attendance(user.get_id(), event_id, going_status="invited")
-                        await client.send_message(message.channel, 'All members of channel invited. See !mystatus to check')
-                elif cmd == "!edit":
-                    if len(splits) < 4:
-                        await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !edit <eventID> <field> <new_value>')
-                    else:
-                        eventID = splits[1]
-                        edit_event = porg.get_event(eventID)
-                        if not edit_event:
-                            await client.send_message(message.channel, 'Event not found')
-                        elif edit_event.get_ownerid() != int(userID):
-                            await client.send_message(message.channel, 'You do not have permission to modify this event')
-                        else:
-                            edit_field = splits[2].lower()
-                            if edit_field == "name":
-                                edit_event.set_name(splits[3])
-                                porg.update(edit_event)
-                                await client.send_message(message.channel, 'Event {}\'s name updated to {}'.format(eventID, splits[3]))
-                            elif edit_field == "location":
-                                edit_event.set_location(splits[3])
-                                porg.update(edit_event)
-                                await client.send_message(message.channel, 'Event {}\'s location updated to {}'.format(eventID, splits[3]))
-                            elif edit_field == "date":
-                                if not len(splits) == 6:
-                                    await client.send_message(message.channel, 'Invalid date format. Use <year> <month> <day>')
-                                else:
-                                    date = datetime.date(int(splits[3]), int(splits[4]), int(splits[5]))
-                                    edit_event.set_time(date)
-                                    porg.update(edit_event)
-                                    await client.send_message(message.channel, 'Event {}\'s date updated to {}'.format(eventID, date))
-                            else:
-                                await client.send_message(message.channel, 'Invalid field type')
-                elif cmd == "!delete":
-                    #TODO add confirmation for deletion
-                    if len(splits) != 2:
-                        await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !delete <eventID>')
-                    else:
-                        eventid = splits[1]
-                        res = porg.remove_event(eventid)
-                        if res:
-                            # Remove associated event users
-                            eventusers = porg.get_eventusers(eventid)
-                            for eventuser in eventusers:
-                                porg.remove_eventuser(eventid, eventuser.get_eventuserid())
-                            await client.send_message(message.channel, 'Event {} was removed'.format(splits[1]))
-                        else:
-                            await client.send_message(message.channel, 'Remove failed, double check your event ID')
-                elif cmd == "!add":
-                    # Question, choices, roles
-                    cmd_type = '<question|choice|role>'
-                    if len(splits) >= 2:
-                        if splits[1] in ['question', 'choice', 'role']:
-                            cmd_type = splits[1]
-                            msg = 'Incorrect number of arguments. Correct usage: !add {} '.format(cmd_type)
-                            if cmd_type == 'question':
-                                msg += '<event id> <question text>'
-                            elif cmd_type == 'choice':
-                                msg += '<question id> <choice text>'
-                            elif cmd_type == 'role':
-                                msg += '<event id> <username> <role text>'
-
-                            if len(splits) < 4:
-                                await client.send_message(message.channel, 'Incorrect number of arguments. Correct usage: !add {} {}'.format(cmd_type, msg))
-                            else:
-                                if cmd_type == 'question':
-                                    if len(splits) >= 3:
-                                        eventid = splits[2]
-                                        text = splits[3]
-                                        yettovote = porg.get_eventusers(int(eventid))
-                                        q = porg.add_question(eventid, text, yettovote)
-                                        await client.send_message(message.channel, 'Added question with id {}'.format(q.get_questionid()))
-                                elif cmd_type == 'choice':
-                                    if len(splits) >= 3:
-                                        questionid = splits[2]
-                                        choicetext = splits[3]
-                                        c = porg.add_questionchoice(questionid, choicetext)
-                                        await client.send_message(message.channel, 'Added choice `{}` with id {}'.format(c.get_choicetext(), c.get_id()))
-                                elif cmd_type == 'role':
-                                    if len(splits) >= 4:
-                                        eventid = splits[2]
-                                        userid = userToID(splits[3])
-                                        #userid = splits[3]
-                                        roletext = splits[4]
-                                        eu = porg.get_eventuser(eventid, userid)
-                                        eu.add_role(roletext)
-                                        eu.roles = str(eu.roles)
-                                        porg.update(eu)
-                                        await client.send_message(message.channel, 'Added role `{}` to user {} for event {}'.format(roletext, userid, eventid))
-                        elif len(splits) < 4:
-                            await client.send_message(message.channel, 'Correct usage: !add {} <command text>'.format(cmd_type))
-                elif cmd == "!remove":
-                    await client.send_message(message.channel, 'emented yet!')
-            else:
-                await client.send_message(message.channel, 'You do not have permission to do that')
+                            porg.add_role(porg.get_user_by_username(str(userid)), int(eventid), roletext)
+                        except AttendanceNotFoundError:
+                            return 'User {} is not attending event {}'.format(userid, eventid)
+                        return 'Added role `{}` to user {} for event {}'.format(roletext, userid, eventid)
+        elif len(splits) < 4:
+            return 'Correct usage: !add {} <command text>'.format(cmd_type)
+
+
+@admin_command('!remove')
+def cmd_remove(message, porg, splits):
+    if len(splits) != 5 or splits[1] != 'role':
+        return 'Incorrect number of arguments. Correct usage: !remove role <event id> <username> <role text>'
+    else:
+        eventid = splits[2]
+        userid = userToID(splits[3])
+        roletext = splits[4]
+        try:
+            porg.remove_role(porg.get_user_by_username(str(userid)), int(eventid), roletext)
+            return 'Removed role `{}` from user {} for event {}'.format(roletext, userid, eventid)
+        except AttendanceNotFoundError:
+            return 'User {} is not attending event {}'.format(userid, eventid)
 
 
 client.run(discord_config.token)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3.5
+"""
+Columnar analytics over survey responses, choices and attendance using NumPy.
+
+Usage: python porg_analytics.py build <snapshot dir>
+       python porg_analytics.py report <snapshot dir>
+
+A Snapshot materializes the relevant columns of the database into NumPy arrays once, after which
+counts, group-bys and crosstabs are vectorized rather than looping over ORM objects. Snapshots
+can be saved to a directory of .npy files and loaded back memory-mapped.
+"""
+import argparse
+import os
+from array import array
+import numpy as np
+from DbInterface import DbInterface
+from Poorganiser import User, Event, Attendance, Question, Choice, Response, Survey
+
+# Number of rows fetched from the database at a time while building a snapshot
+SNAPSHOT_BATCH_SIZE = 10000
+
+# Stored in place of a missing (NULL) id
+NO_ID = -1
+
+# Integer representation of NaT (not a time), stored in place of a missing event time
+NAT = np.iinfo(np.int64).min
+
+
+def group_count(*keys):
+    """Counts rows by one or more equal length key arrays. Returns (unique keys, counts) where
+    unique keys has one row per distinct combination of keys, sorted."""
+    if len(keys) == 1:
+        return np.unique(keys[0], return_counts=True)
+    unique, counts = np.unique(np.column_stack(keys), axis=0, return_counts=True)
+    return unique, counts
+
+
+def crosstab(row_keys, col_keys):
+    """Counts rows by every (row key, column key) pair. Returns (row labels, column labels,
+    counts) where counts[i, j] is the number of rows with row_keys == row labels[i] and
+    col_keys == column labels[j]."""
+    row_labels, row_index = np.unique(row_keys, return_inverse=True)
+    col_labels, col_index = np.unique(col_keys, return_inverse=True)
+    counts = np.bincount(row_index * len(col_labels) + col_index,
+                         minlength=len(row_labels) * len(col_labels))
+    return row_labels, col_labels, counts.reshape(len(row_labels), len(col_labels))
+
+
+class Snapshot:
+    """Column arrays are stored in self.columns keyed by '<table>.<column>':
+        responses:        id, question_id, responder_id, survey_id, event_time
+        response_choices: response_id, question_id, responder_id, choice_id (one row per choice
+                          selected in a Response)
+        choices:          id, question_id
+        surveys:          id, event_id
+        attendance:       event_id, user_id, status (index into self.statuses)
+    """
+    def __init__(self, columns, statuses):
+        self.columns = columns
+        self.statuses = list(statuses)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def build(cls, session):
+        """Reads the database through session into a new Snapshot, streaming rows in batches. As
+        in porg_export.py, rows of soft deleted events and surveys (and the attendance of soft
+        deleted users) are left out."""
+        buffers = {}
+
+        def column(name):
+            return buffers.setdefault(name, array('q'))
+
+        responses = session.query(Response.id, Response.question_id, Response.responder_id,
+                                  Question.survey_id, Event.time, Response.choice_ids) \
+            .outerjoin(Question, Question.id == Response.question_id) \
+            .outerjoin(Survey, Survey.id == Question.survey_id) \
+            .outerjoin(Event, Event.id == Survey.event_id) \
+            .filter(Survey.deleted_time == None, Event.deleted_time == None) \
+            .yield_per(SNAPSHOT_BATCH_SIZE)
+        for response_id, question_id, responder_id, survey_id, time, choice_ids in responses:
+            column('responses.id').append(response_id)
+            column('responses.question_id').append(question_id)
+            column('responses.responder_id').append(responder_id)
+            column('responses.survey_id').append(NO_ID if survey_id is None else survey_id)
+            column('responses.event_time').append(
+                NAT if time is None else int(np.datetime64(time, 's').astype(np.int64)))
+            for choice_id in choice_ids or []:
+                column('response_choices.response_id').append(response_id)
+                column('response_choices.question_id').append(question_id)
+                column('response_choices.responder_id').append(responder_id)
+                column('response_choices.choice_id').append(choice_id)
+
+        for choice_id, question_id in session.query(Choice.id, Choice.question_id) \
+                .outerjoin(Question, Question.id == Choice.question_id) \
+                .outerjoin(Survey, Survey.id == Question.survey_id) \
+                .outerjoin(Event, Event.id == Survey.event_id) \
+                .filter(Survey.deleted_time == None, Event.deleted_time == None) \
+                .yield_per(SNAPSHOT_BATCH_SIZE):
+            column('choices.id').append(choice_id)
+            column('choices.question_id').append(question_id)
+
+        for survey_id, event_id in session.query(Survey.id, Survey.event_id) \
+                .outerjoin(Event, Event.id == Survey.event_id) \
+                .filter(Survey.deleted_time == None, Event.deleted_time == None) \
+                .yield_per(SNAPSHOT_BATCH_SIZE):
+            column('surveys.id').append(survey_id)
+            column('surveys.event_id').append(NO_ID if event_id is None else event_id)
+
+        statuses = []
+        status_codes = {}
+        for event_id, user_id, going_status in session.query(
+                Attendance.event_id, Attendance.user_id, Attendance.going_status) \
+                .outerjoin(Event, Event.id == Attendance.event_id) \
+                .outerjoin(User, User.id == Attendance.user_id) \
+                .filter(Event.deleted_time == None, User.deleted_time == None) \
+                .yield_per(SNAPSHOT_BATCH_SIZE):
+            if going_status not in status_codes:
+                status_codes[going_status] = len(statuses)
+                statuses.append(going_status)
+            column('attendance.event_id').append(event_id)
+            column('attendance.user_id').append(user_id)
+            column('attendance.status').append(status_codes[going_status])
+
+        columns = {}
+        for name in ['responses.id', 'responses.question_id', 'responses.responder_id',
+                     'responses.survey_id', 'responses.event_time',
+                     'response_choices.response_id', 'response_choices.question_id',
+                     'response_choices.responder_id', 'response_choices.choice_id',
+                     'choices.id', 'choices.question_id', 'surveys.id', 'surveys.event_id',
+                     'attendance.event_id', 'attendance.user_id', 'attendance.status']:
+            columns[name] = np.frombuffer(column(name), dtype=np.int64)
+        columns['responses.event_time'] = columns['responses.event_time'].view('datetime64[s]')
+        return cls(columns, statuses)
+
+    def save(self, path):
+        """Saves the snapshot to the directory at path as one .npy file per column."""
+        os.makedirs(path, exist_ok=True)
+        for name, values in self.columns.items():
+            np.save(os.path.join(path, name + '.npy'), values)
+        np.save(os.path.join(path, 'statuses.npy'), np.array(self.statuses, dtype=str))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a snapshot saved by save(). Columns are memory-mapped unless mmap is False."""
+        columns = {}
+        for filename in os.listdir(path):
+            if filename.endswith('.npy') and filename != 'statuses.npy':
+                columns[filename[:-len('.npy')]] = np.load(os.path.join(path, filename),
+                                                           mmap_mode='r' if mmap else None)
+        statuses = np.load(os.path.join(path, 'statuses.npy')).tolist()
+        return cls(columns, statuses)
+
+    def choice_popularity(self, question_id=None):
+        """Returns (choice ids, counts) of how many Responses selected each choice, most popular
+        first. Restricted to one question if question_id is given. Choices that were never
+        selected are not included."""
+        choice_ids = self['response_choices.choice_id']
+        if question_id is not None:
+            choice_ids = choice_ids[self['response_choices.question_id'] == question_id]
+        unique, counts = group_count(choice_ids)
+        order = np.argsort(-counts, kind='stable')
+        return unique[order], counts[order]
+
+    def choice_popularity_by_month(self):
+        """Returns (months, choice ids, counts) where counts[i, j] is the number of times choice
+        j was selected in surveys for events held in month i. Responses to surveys without a
+        dated event are not counted."""
+        choice_response_ids = self['response_choices.response_id']
+        response_order = np.argsort(self['responses.id'])
+        index = response_order[np.searchsorted(self['responses.id'], choice_response_ids,
+                                               sorter=response_order)]
+        months = self['responses.event_time'][index].astype('datetime64[M]')
+        dated = ~np.isnat(months)
+        return crosstab(months[dated], self['response_choices.choice_id'][dated])
+
+    def participation(self):
+        """Returns (survey ids, responders, attendees, rates) for each survey attached to an
+        event, where responders is the number of distinct users who responded to the survey,
+        attendees is the number of Attendances for its event and rate is responders / attendees
+        (0 if the event has no attendees)."""
+        has_event = self['surveys.event_id'] != NO_ID
+        survey_ids = self['surveys.id'][has_event]
+        event_ids = self['surveys.event_id'][has_event]
+        order = np.argsort(survey_ids)
+        survey_ids, event_ids = survey_ids[order], event_ids[order]
+
+        # Distinct responders per survey
+        pairs, _ = group_count(self['responses.survey_id'], self['responses.responder_id'])
+        responded_surveys, responder_counts = np.unique(pairs[:, 0], return_counts=True)
+        responders = np.zeros(len(survey_ids), dtype=np.int64)
+        found = np.isin(survey_ids, responded_surveys)
+        responders[found] = responder_counts[np.searchsorted(responded_surveys, survey_ids[found])]
+
+        # Attendances per event
+        attended_events, attendance_counts = group_count(self['attendance.event_id'])
+        attendees = np.zeros(len(event_ids), dtype=np.int64)
+        found = np.isin(event_ids, attended_events)
+        attendees[found] = attendance_counts[np.searchsorted(attended_events, event_ids[found])]
+
+        rates = np.divide(responders, attendees, out=np.zeros(len(responders)),
+                          where=attendees > 0)
+        return survey_ids, responders, attendees, rates
+
+    def status_counts(self, event_id=None):
+        """Returns a dict mapping going_status to the number of Attendances with that status,
+        for one event if event_id is given."""
+        statuses = self['attendance.status']
+        if event_id is not None:
+            statuses = statuses[self['attendance.event_id'] == event_id]
+        counts = np.bincount(statuses, minlength=len(self.statuses))
+        return {status: int(count) for status, count in zip(self.statuses, counts) if count}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or report on an analytics snapshot.")
+    parser.add_argument('action', choices=['build', 'report'])
+    parser.add_argument('path', help="Snapshot directory")
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        Snapshot.build(DbInterface().s).save(args.path)
+        print('Saved snapshot to {}'.format(args.path))
+    else:
+        snapshot = Snapshot.load(args.path)
+        print('SURVEY\tRESPONDERS\tATTENDEES\tPARTICIPATION')
+        for survey_id, responders, attendees, rate in zip(*snapshot.participation()):
+            print('{}\t{}\t{}\t{:.0%}'.format(survey_id, responders, attendees, rate))
+        print('\nCHOICE\tVOTES')
+        for choice_id, count in zip(*snapshot.choice_popularity()):
+            print('{}\t{}'.format(choice_id, count))
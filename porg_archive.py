@@ -0,0 +1,189 @@
+#!/usr/bin/env python3.5
+"""
+Moves past events out of the main database into an archive database.
+
+Usage: python porg_archive.py [--days N] [--vacuum]
+       python porg_archive.py --shards [--days N] [--vacuum]
+
+Events that started before the cutoff (porg_config.ARCHIVE_AFTER ago unless --days is given) are
+moved with their attendance, roles, surveys, questions, choices, responses and survey results,
+so queries on the main database only touch current data. The ids of archived objects are removed
+from their users' id lists. PorgWrapper.get_event and get_past_events read through to the archive.
+"""
+import argparse
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from sqlalchemy import or_, select, text as sql_text
+from sqlalchemy.orm import sessionmaker
+from config import porg_config
+from gen_db import create_tables, migrate_tables
+from Poorganiser import Base, User, Event, LOAD_BATCH_SIZE
+from PorgShards import ShardManager
+from PorgWrapper import PorgWrapper
+
+# Tables moved to the archive, in order: (table, column holding the id of the archived parent,
+# kind of parent id)
+ARCHIVED_TABLES = [
+    ('events', 'id', 'event'),
+    ('attendance', 'event_id', 'event'),
+    ('attendance_roles', 'event_id', 'event'),
+    ('surveys', 'event_id', 'event'),
+    ('survey_results', 'survey_id', 'survey'),
+    ('questions', 'survey_id', 'survey'),
+    ('choices', 'question_id', 'question'),
+    ('responses', 'question_id', 'question'),
+]
+
+# References from User id lists to archived rows: (User attribute, query returning (user id,
+# referenced id) for the rows selected by {}, column the rows are selected by, kind of id)
+USER_REFERENCES = [
+    ('events_organised_ids', 'SELECT owner_id, id FROM events WHERE {}', 'id', 'event'),
+    ('events_attending_ids', 'SELECT user_id, event_id FROM attendance WHERE {}', 'event_id', 'event'),
+    ('survey_ids', 'SELECT owner_id, id FROM surveys WHERE {}', 'id', 'survey'),
+    ('question_ids', 'SELECT owner_id, id FROM questions WHERE {}', 'id', 'question'),
+    ('response_ids', 'SELECT responder_id, id FROM responses WHERE {}', 'question_id', 'question'),
+]
+
+
+def _batches(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), LOAD_BATCH_SIZE):
+        yield ids[i:i + LOAD_BATCH_SIZE]
+
+
+def _in_batches(column, ids):
+    """Yields "column IN (...)" clauses covering ids, LOAD_BATCH_SIZE ids at a time."""
+    for batch in _batches(ids):
+        yield '{} IN ({})'.format(column, ', '.join(str(int(obj_id)) for obj_id in batch))
+
+
+def _select(conn, sql, column, ids):
+    """Returns the rows of sql (a SELECT with a {} placeholder for its condition) where column is
+    one of ids."""
+    rows = []
+    for condition in _in_batches(column, ids):
+        rows.extend(conn.execute(sql_text(sql.format(condition))))
+    return rows
+
+
+def create_archive(path):
+    """Creates an empty archive database at path if it does not exist, or else brings its tables
+    up to date (see gen_db.migrate_tables) so they have every column of the main database."""
+    exists = os.path.exists(path)
+    if not exists:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path)
+    if exists:
+        migrate_tables(conn.cursor())
+    else:
+        create_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+
+def archive_events(porg, before=None):
+    """Moves events that started before the datetime before (default porg_config.ARCHIVE_AFTER
+    ago) and everything belonging to them to porg's archive database, in a single transaction.
+    Returns a dict mapping table name to the number of rows moved."""
+    if before is None:
+        before = datetime.now() - porg_config.ARCHIVE_AFTER
+    archive_path = porg.archive_url[len('sqlite:///'):]
+    create_archive(archive_path)
+
+    # Objects loaded by porg may be about to move, so don't let it use them afterwards
+    porg.db_interface.s.commit()
+    porg.db_interface.s.expunge_all()
+
+    moved = {}
+    conn = porg.db_interface.s.get_bind().connect()
+    conn.execute(sql_text('ATTACH DATABASE :path AS archive'), path=archive_path)
+    try:
+        trans = conn.begin()
+        try:
+            # Take the write lock before reading which rows to move
+            conn.execute(sql_text('BEGIN IMMEDIATE'))
+
+            # Recurring events that may still have occurrences to create are kept, and soft
+            # deleted events are left to PorgWrapper.collect_garbage
+            events = Event.__table__.c
+            ids = {'event': {row[0] for row in conn.execute(
+                select([events.id]).where(events.time < before).where(events.deleted_time == None)
+                .where(or_(events.recurrence == None, events.recurrence_end < before)))}}
+            ids['survey'] = {row[0] for row in _select(
+                conn, 'SELECT id FROM surveys WHERE {}', 'event_id', ids['event'])}
+            ids['question'] = {row[0] for row in _select(
+                conn, 'SELECT id FROM questions WHERE {}', 'survey_id', ids['survey'])}
+
+            # user id -> {id list attribute: ids to remove from it}
+            removed = {}
+            for attr, sql, column, kind in USER_REFERENCES:
+                for user_id, obj_id in _select(conn, sql, column, ids[kind]):
+                    removed.setdefault(user_id, {}).setdefault(attr, set()).add(obj_id)
+
+            for table, column, kind in ARCHIVED_TABLES:
+                # Columns are listed as the archive's may be in a different order (see
+                # gen_db.migrate_tables)
+                columns = ', '.join(c.name for c in Base.metadata.tables[table].columns)
+                for condition in _in_batches(column, ids[kind]):
+                    conn.execute(sql_text('INSERT INTO archive.{0} ({1}) SELECT {1} FROM main.{0} '
+                                          'WHERE {2}'.format(table, columns, condition)))
+                    result = conn.execute(sql_text('DELETE FROM main.{} WHERE {}'.format(table, condition)))
+                    moved[table] = moved.get(table, 0) + result.rowcount
+
+            session = sessionmaker(bind=conn)()
+            for batch in _batches(removed.keys() - {None}):
+                for u in session.query(User).filter(User.id.in_(batch)):
+                    for attr, obj_ids in removed[u.get_id()].items():
+                        setattr(u, attr, [i for i in getattr(u, attr) if i not in obj_ids])
+            session.flush()
+            session.close()
+
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+    finally:
+        conn.execute(sql_text('DETACH DATABASE archive'))
+        conn.close()
+
+    return moved
+
+
+def vacuum(porg):
+    """Rebuilds porg's main database file so the space freed by archiving is returned."""
+    porg.db_interface.s.commit()
+    conn = porg.db_interface.s.get_bind().connect()
+    try:
+        conn.execute(sql_text('VACUUM'))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move past events to the archive database.")
+    parser.add_argument('--days', type=int,
+                        help="Archive events older than this many days (default {})".format(
+                            porg_config.ARCHIVE_AFTER.days))
+    parser.add_argument('--shards', action='store_true', help="Archive every shard database")
+    parser.add_argument('--vacuum', action='store_true', help="Shrink the main database afterwards")
+    args = parser.parse_args()
+
+    before = datetime.now() - (timedelta(days=args.days) if args.days is not None
+                               else porg_config.ARCHIVE_AFTER)
+    def run(name, porg):
+        moved = archive_events(porg, before)
+        if args.vacuum:
+            vacuum(porg)
+        print('{}: archived {} events ({} rows)'.format(name, moved.get('events', 0),
+                                                         sum(moved.values())))
+
+    if args.shards:
+        shards = ShardManager()
+        for shard_key in shards.get_shard_keys():
+            run(shard_key, shards.get(shard_key))
+        shards.close()
+    else:
+        porg = PorgWrapper()
+        run(porg_config.DB_NAME, porg)
+        porg.close()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3.5
+"""
+Benchmark of PorgWrapper's most frequent reads, with and without baked queries (see PorgQueries).
+
+Usage: python porg_benchmark.py [--users N] [--events N] [--attending N] [--calls N]
+
+A database of generated users, events and attendance is imported into a temporary directory.
+Each read is then timed over --calls calls with query baking turned off (every call builds and
+compiles its Query) and on, and the time saved per call is reported.
+"""
+import argparse
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from gen_db import create_tables
+from porg_import import BulkImporter
+from DbInterface import DbInterface
+from Poorganiser import User
+from PorgWrapper import PorgWrapper
+
+# (name, function of (PorgWrapper, user, event) making the call)
+HOT_READS = [
+    ('get_user_by_username', lambda porg, u, e: porg.get_user_by_username(u.get_username())),
+    ('get_attendance', lambda porg, u, e: porg.get_attendance(u, e)),
+    ('get_curr_events', lambda porg, u, e: porg.get_curr_events()),
+    ('get_curr_event_rows', lambda porg, u, e: porg.get_curr_event_rows()),
+    ('get_user_event_rows', lambda porg, u, e: porg.get_user_event_rows(u)),
+    ('get_event_headcount', lambda porg, u, e: porg.get_event_headcount(e)),
+    ('get_roster', lambda porg, u, e: porg.get_roster(e)),
+    ('get_roles_for_user', lambda porg, u, e: porg.get_roles_for_user(u)),
+]
+
+
+def generate(path, users, events, attending):
+    """Creates a database at path with users users, events events (owned by the users in turn)
+    and attendance of each user to attending events."""
+    conn = sqlite3.connect(path)
+    create_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+    tmp_dir = os.path.dirname(path)
+    start = datetime.now()
+    files = {
+        'users': (['username'], [['user{}'.format(i)] for i in range(users)]),
+        'events': (['name', 'owner', 'time'], [
+            ['event{}'.format(i), 'user{}'.format(i % users),
+             (start + timedelta(hours=i)).strftime('%Y-%m-%d %H:%M')] for i in range(events)]),
+        # Owners already attend their events
+        'attendance': (['username', 'event_id', 'going_status', 'roles'], [
+            ['user{}'.format(i), event_id, 'going', 'cook']
+            for i in range(users) for event_id in {(i + n) % events + 1 for n in range(attending)}
+            if (event_id - 1) % users != i]),
+    }
+
+    importer = BulkImporter(DbInterface('sqlite:///' + path))
+    for kind in ['users', 'events', 'attendance']:
+        file_path = os.path.join(tmp_dir, kind + '.csv')
+        with open(file_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(files[kind][0])
+            writer.writerows(files[kind][1])
+        importer.import_file(kind, file_path)
+    importer.db_interface.close()
+
+
+def time_reads(porg, calls):
+    """Returns a dict mapping each HOT_READS name to its mean time per call in seconds."""
+    users = porg.db_interface.s.query(User).all()
+    events = porg.get_all_events()
+
+    res = {}
+    for name, read in HOT_READS:
+        read(porg, users[0], events[0])  # Bake the query, load the objects
+        start = time.perf_counter()
+        for i in range(calls):
+            read(porg, users[i % len(users)], events[i % len(events)])
+        res[name] = (time.perf_counter() - start) / calls
+    return res
+
+
+def benchmark(db_url, calls):
+    """Returns {name: (time per call without baking, with baking)} for each of HOT_READS."""
+    times = []
+    for baked in [False, True]:
+        porg = PorgWrapper(db_url)
+        porg.db_interface.s.enable_baked_queries = baked
+        times.append(time_reads(porg, calls))
+        porg.close()
+    return {name: (times[0][name], times[1][name]) for name, _ in HOT_READS}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time PorgWrapper's hot reads.")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--events', type=int, default=100)
+    parser.add_argument('--attending', type=int, default=5, help="Events attended per user")
+    parser.add_argument('--calls', type=int, default=2000, help="Calls timed per read")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'benchmark.db')
+        generate(path, args.users, args.events, args.attending)
+        results = benchmark('sqlite:///' + path, args.calls)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print('{:<22} {:>10} {:>10} {:>8}'.format('read', 'unbaked', 'baked', 'saved'))
+    for name, (unbaked, baked) in results.items():
+        print('{:<22} {:>8.1f}us {:>8.1f}us {:>7.0%}'.format(name, unbaked * 1e6, baked * 1e6,
+                                                            1 - baked / unbaked))
+    total_unbaked = sum(unbaked for unbaked, _ in results.values())
+    total_baked = sum(baked for _, baked in results.values())
+    print('{:<22} {:>8.1f}us {:>8.1f}us {:>7.0%}'.format('total', total_unbaked * 1e6,
+                                                        total_baked * 1e6,
+                                                        1 - total_baked / total_unbaked))
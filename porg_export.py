@@ -0,0 +1,143 @@
+#!/usr/bin/env python3.5
+"""
+Streaming export of survey responses and attendance rosters to CSV or JSON Lines.
+
+Usage: python porg_export.py <responses|attendance> <file> [--format csv|jsonl]
+
+Rows are read from the database in batches and written as they arrive, so memory use does not
+grow with the size of the tables. The format is taken from the file extension unless given. Rows
+hidden by a soft delete (see PorgWrapper.collect_garbage) are exported as they will be once
+collected: left out, or for the responses of a deleted user, without the responder's username.
+"""
+import argparse
+import csv
+import json
+from datetime import datetime
+from sqlalchemy import and_
+from DbInterface import DbInterface
+from Poorganiser import User, Event, Attendance, Survey, Question, Choice, Response
+
+# Number of rows fetched from the database at a time
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+
+RESPONSE_FIELDS = ['response_id', 'survey_id', 'question_id', 'question', 'responder_id',
+                   'responder', 'response_text', 'choice_ids', 'choices']
+ATTENDANCE_FIELDS = ['attendance_id', 'event_id', 'event', 'event_time', 'user_id', 'username',
+                     'going_status', 'roles']
+
+
+def iter_responses(session):
+    """Yields a dict (see RESPONSE_FIELDS) for every Response not in a soft deleted survey or
+    event, with the question text, responder username and choice labels resolved. Responses are
+    ordered by question so only the current question's choices are held in memory."""
+    rows = session.query(Response.id, Question.survey_id, Response.question_id, Question.question,
+                         Response.responder_id, User.username, Response.response_text,
+                         Response.choice_ids) \
+        .outerjoin(Question, Question.id == Response.question_id) \
+        .outerjoin(Survey, Survey.id == Question.survey_id) \
+        .outerjoin(Event, Event.id == Survey.event_id) \
+        .outerjoin(User, and_(User.id == Response.responder_id, User.deleted_time == None)) \
+        .filter(Survey.deleted_time == None, Event.deleted_time == None) \
+        .order_by(Response.question_id, Response.id) \
+        .yield_per(EXPORT_BATCH_SIZE)
+
+    choice_labels = {}
+    labels_question_id = None
+    for row in rows:
+        if row.question_id != labels_question_id:
+            labels_question_id = row.question_id
+            choice_labels = dict(session.query(Choice.id, Choice.choice)
+                                 .filter(Choice.question_id == row.question_id))
+
+        choice_ids = list(row.choice_ids or [])
+        yield {'response_id': row.id, 'survey_id': row.survey_id, 'question_id': row.question_id,
+               'question': row.question, 'responder_id': row.responder_id,
+               'responder': row.username, 'response_text': row.response_text,
+               'choice_ids': choice_ids,
+               'choices': [choice_labels.get(choice_id) for choice_id in choice_ids]}
+
+
+def iter_attendance(session):
+    """Yields a dict (see ATTENDANCE_FIELDS) for every Attendance of an event and user that aren't
+    soft deleted, with the event name and time and the attendee's username resolved, ordered by
+    event then user."""
+    rows = session.query(Attendance.id, Attendance.event_id, Event.name, Event.time,
+                         Attendance.user_id, User.username, Attendance.going_status,
+                         Attendance.roles) \
+        .outerjoin(Event, Event.id == Attendance.event_id) \
+        .outerjoin(User, User.id == Attendance.user_id) \
+        .filter(Event.deleted_time == None, User.deleted_time == None) \
+        .order_by(Attendance.event_id, Attendance.user_id) \
+        .yield_per(EXPORT_BATCH_SIZE)
+
+    for row in rows:
+        yield {'attendance_id': row.id, 'event_id': row.event_id, 'event': row.name,
+               'event_time': row.time, 'user_id': row.user_id, 'username': row.username,
+               'going_status': row.going_status, 'roles': list(row.roles or [])}
+
+
+def _to_text(value):
+    if isinstance(value, list):
+        return ';'.join('' if v is None else str(v) for v in value)
+    elif isinstance(value, datetime):
+        return value.isoformat()
+    elif value is None:
+        return ''
+    return value
+
+
+def write_csv(rows, f, fields):
+    """Writes rows to the file object f as CSV with a header. List values are ';' separated.
+    Returns the number of rows written."""
+    writer = csv.writer(f)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow([_to_text(row[field]) for field in fields])
+        count += 1
+    return count
+
+
+def write_jsonl(rows, f, fields):
+    """Writes rows to the file object f as JSON Lines. Returns the number of rows written."""
+    count = 0
+    for row in rows:
+        f.write(json.dumps({field: row[field].isoformat() if isinstance(row[field], datetime)
+                            else row[field] for field in fields}) + '\n')
+        count += 1
+    return count
+
+
+def export(kind, path, fmt=None, db_interface=None):
+    """Exports every row of kind ('responses' or 'attendance') to the file at path in fmt (one
+    of EXPORT_FORMATS, by default from the file extension). Returns the number of rows written.
+    The file is left untouched if kind or fmt is invalid."""
+    if fmt is None:
+        fmt = 'csv' if path.endswith('.csv') else 'jsonl'
+    if kind not in ('responses', 'attendance'):
+        raise ValueError("Invalid export kind: {}".format(kind))
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Invalid export format: {}".format(fmt))
+
+    session = (db_interface or DbInterface()).s
+    if kind == 'responses':
+        rows, fields = iter_responses(session), RESPONSE_FIELDS
+    else:
+        rows, fields = iter_attendance(session), ATTENDANCE_FIELDS
+
+    with open(path, 'w', newline='') as f:
+        if fmt == 'csv':
+            return write_csv(rows, f, fields)
+        return write_jsonl(rows, f, fields)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export survey responses or attendance.")
+    parser.add_argument('kind', choices=['responses', 'attendance'])
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=EXPORT_FORMATS)
+    args = parser.parse_args()
+
+    print('Exported {} rows to {}'.format(export(args.kind, args.file, args.format), args.file))
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3.5
+"""
+Checks that the relationships stored twice in the database agree, and optionally repairs them.
+
+Usage: python porg_fsck.py [--repair]
+       python porg_fsck.py --shards [--repair]
+
+Relationships are stored both in id columns (e.g. Attendance.event_id) and in pickled id lists
+(e.g. Event.attendance_ids, User.events_attending_ids). A partial failure can leave the two
+disagreeing, after which looking up a listed object raises a NotFound error. Attendance roles are
+likewise stored both in the pickled Attendance.roles and in the attendance_roles table. The kinds
+of problem reported are:
+    missing_row    an id column references a row that does not exist
+    wrong_ref      an id column copied from a referenced row (e.g. attendance_roles.event_id)
+                   differs from it
+    dangling_id    an id list holds an id that no matching row references
+    missing_id     an id list lacks the id of a row that references it
+    dangling_role  attendance_roles holds a role its attendance doesn't have
+    missing_role   attendance_roles lacks a role of an attendance
+
+Tables are read FSCK_BATCH_SIZE rows at a time and the listed ids are compared with the id columns
+in temporary tables, so memory use does not grow with the size of the database. Repairs delete rows
+whose parent is missing (or clear references to missing event owners), copy id columns from their
+referenced rows again, rewrite id lists to match the id columns and rewrite attendance_roles to match
+Attendance.roles, in one transaction per LOAD_BATCH_SIZE rows. The full-text search index is
+then rebuilt from its tables.
+"""
+import argparse
+from collections import Counter, namedtuple
+from sqlalchemy import select, text as sql_text
+from sqlalchemy.orm import sessionmaker
+from config import porg_config
+from gen_db import rebuild_search_index
+from Poorganiser import User, Event, Attendance, Question, Response, Survey, LOAD_BATCH_SIZE
+from PorgShards import ShardManager
+from PorgWrapper import PorgWrapper
+
+# Number of rows read from a table at a time
+FSCK_BATCH_SIZE = 10000
+
+# A problem found by fsck. For missing_row, row_id is the id of the row in table whose column holds
+# the missing ref_id. For dangling_id and missing_id, ref_id is the id wrongly held in (or missing
+# from) the id list column of the row in table.
+Problem = namedtuple('Problem', ['kind', 'table', 'column', 'row_id', 'ref_id'])
+
+# Id columns, in the order they are checked: (table, column, referenced table, repair). Rows
+# referencing a missing row are deleted ('delete') or have the reference cleared ('null'), as
+# PorgWrapper.unregister_user does for the user's surveys and questions and organised events.
+# Parents come before their children so rows orphaned by a repair are repaired in the same run.
+# Responses outlive their responders, so responses.responder_id is not checked.
+REFERENCES = [
+    ('events', 'owner_id', 'users', 'null'),
+    ('attendance', 'user_id', 'users', 'delete'),
+    ('attendance', 'event_id', 'events', 'delete'),
+    ('attendance_roles', 'attendance_id', 'attendance', 'delete'),
+    ('surveys', 'owner_id', 'users', 'delete'),
+    ('surveys', 'event_id', 'events', 'delete'),
+    ('survey_results', 'survey_id', 'surveys', 'delete'),
+    ('questions', 'owner_id', 'users', 'delete'),
+    ('questions', 'survey_id', 'surveys', 'delete'),
+    ('choices', 'question_id', 'questions', 'delete'),
+    ('responses', 'question_id', 'questions', 'delete'),
+]
+
+# Id columns copied from a referenced row: (table, column, referencing column, referenced table). The
+# column must equal the column of the same name of the row referenced.
+COPIES = [
+    ('attendance_roles', 'user_id', 'attendance_id', 'attendance'),
+    ('attendance_roles', 'event_id', 'attendance_id', 'attendance'),
+]
+
+# Id lists duplicating an id column: (model, id list column, query selecting the (row id, listed
+# id) pairs the lists should hold). Queries may use the fsck_listed table of pairs the lists do hold.
+# Soft deleted events and surveys are removed from their owner's (and event's) lists straight away.
+ID_LISTS = [
+    (User, 'events_organised_ids', 'SELECT owner_id, id FROM events WHERE deleted_time IS NULL'),
+    (User, 'events_attending_ids', 'SELECT user_id, event_id FROM attendance'),
+    (User, 'survey_ids', 'SELECT owner_id, id FROM surveys WHERE deleted_time IS NULL'),
+    (User, 'question_ids', 'SELECT owner_id, id FROM questions'),
+    (User, 'response_ids', 'SELECT responder_id, id FROM responses'),
+    (Event, 'attendance_ids', 'SELECT event_id, id FROM attendance'),
+    (Event, 'survey_ids', 'SELECT event_id, id FROM surveys WHERE deleted_time IS NULL'),
+    (Survey, 'question_ids', 'SELECT survey_id, id FROM questions'),
+    (Question, 'allowed_choice_ids', 'SELECT question_id, id FROM choices'),
+    (Question, 'response_ids', 'SELECT question_id, id FROM responses'),
+    # Choices don't reference their responses, so only ids of choices that don't exist are wrong
+    (Response, 'choice_ids',
+     'SELECT row_id, item_id FROM fsck_listed WHERE item_id IN (SELECT id FROM choices)'),
+]
+
+
+def _iter_batches(conn):
+    """Yields the rows (rowid, kind, row_id, ref_id) of the fsck_problems table in batches of up to
+    LOAD_BATCH_SIZE rows, so each batch can be repaired in one transaction."""
+    after = 0
+    while True:
+        rows = conn.execute(sql_text('SELECT rowid, kind, row_id, ref_id FROM fsck_problems '
+                                     'WHERE rowid > :after ORDER BY rowid LIMIT :limit'),
+                            after=after, limit=LOAD_BATCH_SIZE).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def _check_reference(conn, table, column, ref_table, repair=None):
+    """Yields a list of Problems for each batch of rows of table whose column references a missing
+    row of ref_table. Each batch is repaired before the next is read if repair is 'delete' or
+    'null'."""
+    conn.execute(sql_text(
+        "CREATE TEMP TABLE fsck_problems AS SELECT 'missing_row' AS kind, id AS row_id, {1} AS ref_id "
+        'FROM main.{0} WHERE {1} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM main.{2} WHERE id = {0}.{1}) '
+        'ORDER BY id'.format(table, column, ref_table)))
+    try:
+        for rows in _iter_batches(conn):
+            yield [Problem(kind, table, column, row_id, ref_id) for _, kind, row_id, ref_id in rows]
+
+            # The reference is checked again in case it was fixed since
+            condition = 'id IN ({}) AND NOT EXISTS (SELECT 1 FROM main.{} WHERE id = {}.{})'.format(
+                ', '.join(str(int(row[2])) for row in rows), ref_table, table, column)
+            if repair == 'delete':
+                conn.execute(sql_text('DELETE FROM main.{} WHERE {}'.format(table, condition)))
+            elif repair == 'null':
+                conn.execute(sql_text('UPDATE main.{} SET {} = NULL, version_id = version_id + 1 '
+                                      'WHERE {}'.format(table, column, condition)))
+    finally:
+        conn.execute(sql_text('DROP TABLE fsck_problems'))
+
+
+def _check_copy(conn, table, column, ref_column, ref_table, repair=False):
+    """Yields a list of Problems for each batch of rows of table whose column differs from that of
+    the ref_table row referenced by ref_column. Each batch is repaired before the next is read if
+    repair is True."""
+    copied = '(SELECT {0} FROM main.{1} WHERE id = {2}.{3})'.format(column, ref_table, table, ref_column)
+    conn.execute(sql_text(
+        "CREATE TEMP TABLE fsck_problems AS SELECT 'wrong_ref' AS kind, id AS row_id, {1} AS ref_id "
+        'FROM main.{0} WHERE {1} IS NOT {2} AND EXISTS (SELECT 1 FROM main.{3} WHERE id = {0}.{4}) '
+        'ORDER BY id'.format(table, column, copied, ref_table, ref_column)))
+    try:
+        for rows in _iter_batches(conn):
+            yield [Problem(kind, table, column, row_id, ref_id) for _, kind, row_id, ref_id in rows]
+            if repair:
+                conn.execute(sql_text(
+                    'UPDATE main.{0} SET {1} = {2}, version_id = version_id + 1 WHERE id IN ({3}) '
+                    'AND EXISTS (SELECT 1 FROM main.{4} WHERE id = {0}.{5})'.format(
+                        table, column, copied, ', '.join(str(int(row[2])) for row in rows),
+                        ref_table, ref_column)))
+    finally:
+        conn.execute(sql_text('DROP TABLE fsck_problems'))
+
+
+def _check_roles(conn, repair=False):
+    """Yields a list of Problems for each batch of attendances whose rows in attendance_roles
+    differ from their pickled roles. Each batch is repaired before the next is read if repair is
+    True: dangling rows are deleted and missing rows inserted."""
+    table = Attendance.__table__
+    conn.execute(sql_text('CREATE TEMP TABLE fsck_roles (attendance_id INTEGER, role TEXT)'))
+    try:
+        with conn.begin():
+            # Unpickle the roles a batch of rows at a time, keeping only their (attendance id, role)
+            # pairs
+            after = 0
+            while True:
+                rows = conn.execute(select([table.c.id, table.c.roles]).where(table.c.id > after)
+                                    .order_by(table.c.id).limit(FSCK_BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                pairs = [{'attendance_id': attendance_id, 'role': role}
+                         for attendance_id, roles in rows for role in set(roles or [])]
+                if pairs:
+                    conn.execute(sql_text('INSERT INTO fsck_roles VALUES (:attendance_id, :role)'),
+                                 pairs)
+                after = rows[-1][0]
+
+            conn.execute(sql_text(
+                "CREATE TEMP TABLE fsck_problems AS SELECT * FROM ("
+                "SELECT 'dangling_role' AS kind, attendance_id AS row_id, role AS ref_id FROM ("
+                "SELECT attendance_id, role FROM main.attendance_roles "
+                "WHERE attendance_id IN (SELECT id FROM main.attendance) "
+                "EXCEPT SELECT attendance_id, role FROM fsck_roles) "
+                "UNION ALL SELECT 'missing_role', attendance_id, role FROM ("
+                "SELECT attendance_id, role FROM fsck_roles "
+                "EXCEPT SELECT attendance_id, role FROM main.attendance_roles)) "
+                "ORDER BY row_id, kind, ref_id"))
+
+        for rows in _iter_batches(conn):
+            yield [Problem(kind, 'attendance', 'roles', row_id, ref_id)
+                   for _, kind, row_id, ref_id in rows]
+            if not repair:
+                continue
+
+            dangling = [{'attendance_id': row_id, 'role': role}
+                        for _, kind, row_id, role in rows if kind == 'dangling_role']
+            missing = [{'attendance_id': row_id, 'role': role}
+                       for _, kind, row_id, role in rows if kind == 'missing_role']
+            with conn.begin():
+                if dangling:
+                    conn.execute(sql_text('DELETE FROM main.attendance_roles '
+                                          'WHERE attendance_id = :attendance_id AND role = :role'),
+                                 dangling)
+                if missing:
+                    conn.execute(sql_text(
+                        'INSERT OR IGNORE INTO main.attendance_roles '
+                        '(attendance_id, user_id, event_id, role) '
+                        'SELECT id, user_id, event_id, :role FROM main.attendance '
+                        'WHERE id = :attendance_id'), missing)
+    finally:
+        for temp_table in ['fsck_roles', 'fsck_problems']:
+            conn.execute(sql_text('DROP TABLE IF EXISTS ' + temp_table))
+
+
+def _check_id_list(conn, model, column, expected_sql, repair=False):
+    """Yields a list of Problems for each batch of rows of model's table whose id list column
+    differs from the pairs selected by expected_sql. Each batch is repaired before the next is
+    read if repair is True: dangling ids are removed and missing ids appended."""
+    table = model.__table__
+    conn.execute(sql_text('CREATE TEMP TABLE fsck_listed (row_id INTEGER, item_id INTEGER)'))
+    conn.execute(sql_text('CREATE TEMP TABLE fsck_expected (row_id INTEGER, item_id INTEGER)'))
+    try:
+        with conn.begin():
+            # Unpickle the lists a batch of rows at a time, keeping only their (row id, id) pairs
+            after = 0
+            while True:
+                rows = conn.execute(select([table.c.id, table.c[column]]).where(table.c.id > after)
+                                    .order_by(table.c.id).limit(FSCK_BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                pairs = [{'row_id': row_id, 'item_id': item_id}
+                         for row_id, item_ids in rows for item_id in item_ids or []]
+                if pairs:
+                    conn.execute(sql_text('INSERT INTO fsck_listed VALUES (:row_id, :item_id)'), pairs)
+                after = rows[-1][0]
+
+            conn.execute(sql_text('INSERT INTO fsck_expected ' + expected_sql))
+            conn.execute(sql_text(
+                "CREATE TEMP TABLE fsck_problems AS SELECT * FROM ("
+                "SELECT 'dangling_id' AS kind, row_id, item_id AS ref_id FROM ("
+                "SELECT row_id, item_id FROM fsck_listed EXCEPT SELECT row_id, item_id FROM fsck_expected) "
+                "UNION ALL SELECT 'missing_id', row_id, item_id FROM ("
+                "SELECT row_id, item_id FROM fsck_expected EXCEPT SELECT row_id, item_id FROM fsck_listed) "
+                "WHERE row_id IN (SELECT id FROM main.{})) ORDER BY row_id, kind, ref_id"
+                .format(table.name)))
+
+        for rows in _iter_batches(conn):
+            yield [Problem(kind, table.name, column, row_id, ref_id) for _, kind, row_id, ref_id in rows]
+            if not repair:
+                continue
+
+            changes = {}  # row id -> (dangling ids, missing ids)
+            for _, kind, row_id, ref_id in rows:
+                dangling, missing = changes.setdefault(row_id, (set(), []))
+                if kind == 'dangling_id':
+                    dangling.add(ref_id)
+                else:
+                    missing.append(ref_id)
+            with conn.begin():
+                session = sessionmaker(bind=conn)()
+                for o in session.query(model).filter(model.id.in_(changes.keys())):
+                    dangling, missing = changes[o.id]
+                    item_ids = [i for i in getattr(o, column) or [] if i not in dangling]
+                    setattr(o, column, item_ids + [i for i in missing if i not in item_ids])
+                session.flush()
+                session.close()
+    finally:
+        for temp_table in ['fsck_listed', 'fsck_expected', 'fsck_problems']:
+            conn.execute(sql_text('DROP TABLE IF EXISTS ' + temp_table))
+
+
+def fsck(porg, repair=False, report=None):
+    """Checks porg's database, calling report with each Problem found, and repairs the problems if
+    repair is True. Returns a Counter mapping (kind, table, column) to the number of problems
+    found."""
+    # Rows loaded by porg may be changed, so don't let it keep them
+    porg.db_interface.s.commit()
+
+    found = Counter()
+    conn = porg.db_interface.s.get_bind().connect()
+    try:
+        checks = [_check_reference(conn, table, column, ref_table, repair and action)
+                  for table, column, ref_table, action in REFERENCES]
+        checks += [_check_copy(conn, table, column, ref_column, ref_table, repair)
+                   for table, column, ref_column, ref_table in COPIES]
+        checks.append(_check_roles(conn, repair))
+        checks += [_check_id_list(conn, model, column, expected_sql, repair)
+                   for model, column, expected_sql in ID_LISTS]
+        for check in checks:
+            for problems in check:
+                for problem in problems:
+                    found[problem.kind, problem.table, problem.column] += 1
+                    if report:
+                        report(problem)
+
+        if repair:
+            with conn.begin():
+                rebuild_search_index(conn)
+    finally:
+        conn.close()
+
+    if repair:
+        porg.db_interface.s.expire_all()
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check (and repair) references between tables.")
+    parser.add_argument('--repair', action='store_true', help="Repair the problems found")
+    parser.add_argument('--shards', action='store_true', help="Check every shard database")
+    args = parser.parse_args()
+
+    def run(name, porg):
+        found = fsck(porg, args.repair, lambda problem: print(
+            '{}: {} {}.{} {} {}'.format(name, *problem)))
+        print('{}: {} problems{}'.format(name, sum(found.values()), ' repaired' if args.repair else ''))
+
+    if args.shards:
+        shards = ShardManager()
+        for shard_key in shards.get_shard_keys():
+            run(shard_key, shards.get(shard_key))
+        shards.close()
+    else:
+        porg = PorgWrapper()
+        run(porg_config.DB_NAME, porg)
+        porg.close()
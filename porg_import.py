@@ -0,0 +1,287 @@
+#!/usr/bin/env python3.5
+"""
+Bulk import of users, events and attendance from CSV or JSON Lines files.
+
+Usage: python porg_import.py <users|events|attendance> <file> [--batch-size N]
+
+Columns (CSV header or JSON keys) for each kind of row:
+    users:      username
+    events:     name, owner (username), location (optional), time (optional, e.g. 2017-05-21 18:00)
+    attendance: username, event_id, going_status (optional, default invited),
+                roles (optional, ';' separated in CSV or a list in JSON)
+
+Rows are inserted in batches, one transaction per batch. Rows that fail validation are reported
+with their line number and skipped without aborting the rest of the import.
+"""
+import argparse
+import csv
+import json
+import time
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from DbInterface import DbInterface
+from Poorganiser import User, Event, Attendance, AttendanceRole, insert_events
+
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+
+
+class RowError(Exception):
+    """Raised when an imported row is invalid."""
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.errors = []  # (line number, error message)
+        self.elapsed = 0.0
+
+    def __str__(self):
+        out = 'Imported {}/{} rows in {:.2f}s ({:.0f} rows/sec)'.format(
+            self.inserted, self.rows, self.elapsed, self.get_rows_per_sec())
+        for line, message in self.errors:
+            out += '\nline {}: {}'.format(line, message)
+        return out
+
+    def get_rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+
+def read_rows(path):
+    """Yields (line number, row dict) for each row in a CSV (.csv) or JSON Lines file. Rows that
+    cannot be parsed are yielded as (line number, RowError)."""
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_num, RowError("Invalid JSON: {}".format(e))
+                    continue
+                if not isinstance(row, dict):
+                    yield line_num, RowError("Expected a JSON object")
+                    continue
+                yield line_num, row
+
+
+def _get_str(row, field, required=True):
+    value = row.get(field)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise RowError("Missing {}".format(field))
+        return None
+    if not isinstance(value, str):
+        raise RowError("Invalid {}: expected text".format(field))
+    value = value.strip()
+    if len(value) > 40:
+        raise RowError("Invalid {}: longer than 40 characters".format(field))
+    return value
+
+
+def _get_time(row):
+    value = row.get('time')
+    if not value:
+        return None
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format)
+        except (TypeError, ValueError):
+            pass
+    raise RowError("Invalid time: {}".format(value))
+
+
+def _get_int(row, field):
+    value = row.get(field)
+    # int() would truncate floats and accept bools, so only whole numbers or their text are valid
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    raise RowError("Invalid {}: {}".format(field, value))
+
+
+def _get_roles(row):
+    roles = row.get('roles') or []
+    if isinstance(roles, str):
+        roles = roles.split(';')
+    if not isinstance(roles, list) or not all(isinstance(role, str) for role in roles):
+        raise RowError("Invalid roles: expected a list of text")
+    return [role.strip() for role in roles if role.strip()]
+
+
+class BulkImporter:
+    def __init__(self, db_interface=None, batch_size=1000):
+        self.db_interface = db_interface or DbInterface()
+        self.s = self.db_interface.s
+        self.batch_size = batch_size
+
+    def import_file(self, kind, path):
+        """Imports every row of the file at path as the given kind ('users', 'events' or
+        'attendance'). Returns an ImportReport."""
+        if kind == 'users':
+            return self.import_rows(read_rows(path), self._validate_user, self._insert_users)
+        elif kind == 'events':
+            return self.import_rows(read_rows(path), self._validate_event, self._insert_events)
+        elif kind == 'attendance':
+            return self.import_rows(read_rows(path), self._validate_attendance,
+                                    self._insert_attendances)
+        raise ValueError("Invalid import kind: {}".format(kind))
+
+    def import_rows(self, rows, validate, insert):
+        """Validates each (line number, row) in rows and inserts valid rows in batches. insert is
+        given a list of (line number, validated record) and returns a list of
+        (line number, error message) for records it could not insert."""
+        report = ImportReport()
+        start = time.time()
+
+        batch = []
+        for line, row in rows:
+            report.rows += 1
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                batch.append((line, validate(row)))
+            except RowError as e:
+                report.add_error(line, str(e))
+
+            if len(batch) >= self.batch_size:
+                self._insert_batch(insert, batch, report)
+                batch = []
+        if batch:
+            self._insert_batch(insert, batch, report)
+
+        report.errors.sort()
+        report.elapsed = time.time() - start
+        return report
+
+    def _insert_batch(self, insert, batch, report):
+        """Inserts batch in a single transaction. If the transaction fails, the batch is retried
+        one row at a time so only the offending rows are skipped."""
+        try:
+            errors = insert(batch)
+            self.s.commit()
+        except SQLAlchemyError as e:
+            self.s.rollback()
+            if len(batch) == 1:
+                report.add_error(batch[0][0], "Database error: {}".format(e))
+            else:
+                for record in batch:
+                    self._insert_batch(insert, [record], report)
+            return
+
+        report.inserted += len(batch) - len(errors)
+        for line, message in errors:
+            report.add_error(line, message)
+
+    def _get_users_by_username(self, usernames):
+        usernames = list(set(usernames))
+        if not usernames:
+            return {}
+        query = self.s.query(User).filter(User.username.in_(usernames), User.deleted_time == None)
+        return {u.get_username(): u for u in query}
+
+    def _validate_user(self, row):
+        return _get_str(row, 'username')
+
+    def _insert_users(self, batch):
+        existing = self._get_users_by_username([username for line, username in batch])
+
+        errors = []
+        mappings = []
+        for line, username in batch:
+            if username in existing:
+                errors.append((line, "User \"{}\" is already registered".format(username)))
+                continue
+            existing[username] = None  # Dedupe usernames within the batch
+            mappings.append({'username': username, 'events_organised_ids': [],
+                             'events_attending_ids': [], 'survey_ids': [], 'question_ids': [],
+                             'response_ids': []})
+
+        self.s.bulk_insert_mappings(User, mappings)
+        return errors
+
+    def _validate_event(self, row):
+        return {'name': _get_str(row, 'name'), 'owner': _get_str(row, 'owner'),
+                'location': _get_str(row, 'location', required=False), 'time': _get_time(row)}
+
+    def _insert_events(self, batch):
+        owners = self._get_users_by_username([event['owner'] for line, event in batch])
+
+        errors = []
+        event_mappings = []
+        for line, event in batch:
+            owner = owners.get(event['owner'])
+            if not owner:
+                errors.append((line, "User \"{}\" could not be found".format(event['owner'])))
+                continue
+            event_mappings.append({'name': event['name'], 'owner_id': owner.get_id(),
+                                   'location': event['location'], 'time': event['time'],
+                                   'survey_ids': []})
+
+        insert_events(self.db_interface, event_mappings,
+                      {owner.get_id(): owner for owner in owners.values()})
+        return errors
+
+    def _validate_attendance(self, row):
+        return {'username': _get_str(row, 'username'), 'event_id': _get_int(row, 'event_id'),
+                'going_status': _get_str(row, 'going_status', required=False) or 'invited',
+                'roles': _get_roles(row)}
+
+    def _insert_attendances(self, batch):
+        users = self._get_users_by_username([a['username'] for line, a in batch])
+        event_ids = list(set(a['event_id'] for line, a in batch))
+        events = {e.get_id(): e for e in self.s.query(Event).filter(Event.id.in_(event_ids))}
+
+        errors = []
+        attendances = []
+        for line, a in batch:
+            u = users.get(a['username'])
+            e = events.get(a['event_id'])
+            if not u:
+                errors.append((line, "User \"{}\" could not be found".format(a['username'])))
+            elif not e:
+                errors.append((line, "Event {} could not be found".format(a['event_id'])))
+            elif e.get_id() in u.get_events_attending_ids():
+                errors.append((line, "User is already attending event"))
+            else:
+                u.add_event_attending(e)  # Also dedupes attendances within the batch
+                attendances.append((u, e, {'user_id': u.get_id(), 'event_id': e.get_id(),
+                                           'going_status': a['going_status'], 'roles': a['roles']}))
+
+        # Ids are assigned up front so the rows take one executemany INSERT (see next_id)
+        attendance_mappings = [mapping for u, e, mapping in attendances]
+        for attendance_id, mapping in enumerate(attendance_mappings,
+                                                start=self.db_interface.next_id(Attendance)):
+            mapping['id'] = attendance_id
+        self.s.bulk_insert_mappings(Attendance, attendance_mappings)
+        self.s.bulk_insert_mappings(AttendanceRole, [
+            {'attendance_id': a['id'], 'user_id': a['user_id'], 'event_id': a['event_id'],
+             'role': role} for a in attendance_mappings
+            for role in sorted(set(a['roles']), key=a['roles'].index)])
+
+        for u, e, mapping in attendances:
+            e.add_attendance_id(mapping['id'])
+        return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk import users, events or attendance.")
+    parser.add_argument('kind', choices=['users', 'events', 'attendance'])
+    parser.add_argument('file', help="CSV (.csv) or JSON Lines file")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(BulkImporter(batch_size=args.batch_size).import_file(args.kind, args.file))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3.5
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from config import porg_config
+from gen_db import generate as generate_db
+from porg_analytics import Snapshot, group_count, crosstab
+from PorgWrapper import PorgWrapper
+
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        u3 = p.register_user("u3")
+        e1 = p.create_event("e1", u1, time=datetime(2017, 3, 4))
+        e2 = p.create_event("e2", u1, time=datetime(2017, 4, 1))
+        p.create_attendance(u2, e1, going_status="going")
+        p.create_attendance(u3, e1)
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+        s2 = p.create_survey("s2", u1, event_obj=e2)
+        s3 = p.create_survey("no event", u1)
+
+        q1 = p.create_question(u1, "q1", "choose_many", survey_obj=s1)
+        self.c1 = p.create_choice(q1, "c1")
+        self.c2 = p.create_choice(q1, "c2")
+        q2 = p.create_question(u1, "q2", "choose_one", survey_obj=s2)
+        self.c3 = p.create_choice(q2, "c3")
+        p.create_response(u1, q1, choice_ids=[self.c1.get_id(), self.c2.get_id()])
+        p.create_response(u2, q1, choice_ids=[self.c2.get_id()])
+        p.create_response(u1, q2, choice_ids=[self.c3.get_id()])
+
+        self.e1, self.e2, self.s1, self.s2, self.s3, self.q1 = e1, e2, s1, s2, s3, q1
+        self.snapshot = Snapshot.build(p.db_interface.s)
+
+    def test_group_count(self):
+        unique, counts = group_count(np.array([3, 1, 3, 3]))
+        self.assertEqual(unique.tolist(), [1, 3])
+        self.assertEqual(counts.tolist(), [1, 3])
+
+        unique, counts = group_count(np.array([1, 1, 2, 1]), np.array([5, 6, 5, 5]))
+        self.assertEqual(unique.tolist(), [[1, 5], [1, 6], [2, 5]])
+        self.assertEqual(counts.tolist(), [2, 1, 1])
+
+    def test_crosstab(self):
+        rows, cols, counts = crosstab(np.array([1, 1, 2, 2, 2]), np.array([7, 8, 7, 7, 9]))
+        self.assertEqual(rows.tolist(), [1, 2])
+        self.assertEqual(cols.tolist(), [7, 8, 9])
+        self.assertEqual(counts.tolist(), [[1, 1, 0], [2, 0, 1]])
+
+    def test_build(self):
+        self.assertEqual(len(self.snapshot['responses.id']), 3)
+        self.assertEqual(len(self.snapshot['response_choices.choice_id']), 4)
+        self.assertEqual(sorted(self.snapshot['surveys.event_id'].tolist()),
+                         [-1, self.e1.get_id(), self.e2.get_id()])
+        self.assertEqual(self.snapshot.status_counts(), {"going": 3, "invited": 1})
+        self.assertEqual(self.snapshot.status_counts(self.e1.get_id()), {"going": 2, "invited": 1})
+
+    def test_soft_deleted(self):
+        p.delete_event(self.e2, soft=True)
+        p.unregister_user(p.get_user_by_username("u3"), soft=True)
+        snapshot = Snapshot.build(p.db_interface.s)
+
+        # As in exports: the event's survey, responses and choices and u3's attendance are left out
+        self.assertEqual(sorted(snapshot['surveys.id'].tolist()), [self.s1.get_id(), self.s3.get_id()])
+        self.assertEqual(len(snapshot['responses.id']), 2)
+        self.assertEqual(snapshot['choices.id'].tolist(), [self.c1.get_id(), self.c2.get_id()])
+        self.assertEqual(snapshot.status_counts(), {"going": 2})
+
+    def test_choice_popularity(self):
+        choice_ids, counts = self.snapshot.choice_popularity()
+        self.assertEqual(choice_ids.tolist(), [self.c2.get_id(), self.c1.get_id(), self.c3.get_id()])
+        self.assertEqual(counts.tolist(), [2, 1, 1])
+
+        choice_ids, counts = self.snapshot.choice_popularity(self.q1.get_id())
+        self.assertEqual(choice_ids.tolist(), [self.c2.get_id(), self.c1.get_id()])
+
+    def test_choice_popularity_by_month(self):
+        months, choice_ids, counts = self.snapshot.choice_popularity_by_month()
+        self.assertEqual([str(month) for month in months], ["2017-03", "2017-04"])
+        self.assertEqual(choice_ids.tolist(), [self.c1.get_id(), self.c2.get_id(), self.c3.get_id()])
+        self.assertEqual(counts.tolist(), [[1, 2, 0], [0, 0, 1]])
+
+    def test_participation(self):
+        survey_ids, responders, attendees, rates = self.snapshot.participation()
+        self.assertEqual(survey_ids.tolist(), [self.s1.get_id(), self.s2.get_id()])
+        self.assertEqual(responders.tolist(), [2, 1])
+        self.assertEqual(attendees.tolist(), [3, 1])
+        self.assertEqual(rates.tolist(), [2 / 3, 1.0])
+
+    def test_save_load(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.snapshot.save(path)
+            loaded = Snapshot.load(path)
+            self.assertEqual(set(loaded.columns), set(self.snapshot.columns))
+            self.assertIsInstance(loaded['responses.id'], np.memmap)
+            self.assertEqual(loaded.statuses, self.snapshot.statuses)
+            self.assertEqual(loaded.participation()[3].tolist(), [2 / 3, 1.0])
+        finally:
+            shutil.rmtree(path)
+
+    def test_empty(self):
+        generate_db(c)
+        snapshot = Snapshot.build(p.db_interface.s)
+        self.assertEqual(len(snapshot.choice_popularity()[0]), 0)
+        self.assertEqual(len(snapshot.participation()[0]), 0)
+        self.assertEqual(snapshot.status_counts(), {})
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3.5
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from config import porg_config
+from gen_db import generate as generate_db, create_tables
+from porg_archive import archive_events
+from Poorganiser import Event, Attendance, Survey, Question, Choice, Response
+from PorgWrapper import PorgWrapper
+
+NOW = datetime.now()
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+        self.tmp_dir = tempfile.mkdtemp()
+        p.archive_url = 'sqlite:///' + os.path.join(self.tmp_dir, 'archive.db')
+        self.addCleanup(p.close)
+
+        self.u1 = p.register_user("bob")
+        self.u2 = p.register_user("alice")
+
+        # Old event with everything that belongs to an event
+        self.e1 = p.create_event("old", self.u1, time=NOW - timedelta(days=100))
+        p.create_attendance(self.u2, self.e1, going_status="going", roles=["cook"])
+        s1 = p.create_survey("food", self.u1, event_obj=self.e1)
+        q1 = p.create_question(self.u1, "bring?", "choose_one", survey_obj=s1)
+        c1 = p.create_choice(q1, "cake")
+        p.create_response(self.u2, q1, choice_ids=[c1.get_id()])
+        p.close_survey(s1)
+
+        self.e2 = p.create_event("recent", self.u1, time=NOW - timedelta(days=1))
+        self.e3 = p.create_event("upcoming", self.u2, time=NOW + timedelta(days=1))
+        self.e4 = p.create_event("undated", self.u2)
+        p.create_attendance(self.u2, self.e2)
+        self.ids = [e.get_id() for e in [self.e1, self.e2, self.e3, self.e4]]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_archive_events(self):
+        moved = archive_events(p)
+        self.assertEqual(moved, {'events': 1, 'attendance': 2, 'attendance_roles': 2, 'surveys': 1,
+                                 'survey_results': 1, 'questions': 1, 'choices': 1, 'responses': 1})
+
+        s = p.db_interface.s
+        self.assertEqual([e.get_id() for e in s.query(Event).order_by(Event.id)], self.ids[1:])
+        for obj_type in [Survey, Question, Choice, Response]:
+            self.assertEqual(s.query(obj_type).count(), 0)
+        self.assertEqual(s.query(Attendance).count(), 4)
+
+        # Nothing is archived twice
+        self.assertEqual(archive_events(p), {})
+
+    def test_user_ids(self):
+        archive_events(p)
+        u1 = p.get_user_by_username("bob")
+        u2 = p.get_user_by_username("alice")
+        self.assertEqual(u1.get_events_organised_ids(), self.ids[1:2])
+        self.assertEqual(u1.get_survey_ids(), [])
+        self.assertEqual(u1.get_question_ids(), [])
+        self.assertEqual(sorted(u2.get_events_attending_ids()), self.ids[1:])
+        self.assertEqual(u2.get_response_ids(), [])
+
+    def test_before(self):
+        self.assertEqual(archive_events(p, NOW)['events'], 2)
+        self.assertEqual([e.get_name() for e in p.get_all_events()], ["upcoming", "undated"])
+
+    def test_soft_deleted(self):
+        # Left for PorgWrapper.collect_garbage
+        p.delete_event(self.e1, soft=True)
+        self.assertEqual(archive_events(p), {})
+
+    def test_read_through(self):
+        self.assertIsNone(p.get_archive())
+        archive_events(p)
+
+        e1 = p.get_event(self.ids[0])
+        self.assertEqual(e1.get_name(), "old")
+        self.assertEqual(e1.get_surveys()[0].get_name(), "food")
+        self.assertEqual(p.get_event_headcount(e1), {"going": 2})
+        self.assertEqual([(row.username, row.roles) for row in p.get_roster(e1)[0]],
+                         [("bob", ["organiser"]), ("alice", ["cook"])])
+        self.assertEqual([a.get_user_id() for a in p.get_attendances(e1)],
+                         [p.get_user_by_username(name).get_id() for name in ["bob", "alice"]])
+        self.assertEqual(p.get_event(self.ids[1]).get_name(), "recent")
+        self.assertIsNone(p.get_event(self.ids[-1] + 1))
+
+        self.assertEqual([e.get_name() for e in p.get_past_events()], ["recent", "old"])
+        self.assertEqual([e.get_name() for e in p.get_past_events(limit=1)], ["recent"])
+        self.assertEqual([row.name for row in p.get_past_event_rows()], ["recent", "old"])
+
+    def test_read_through_soft_deleted_user(self):
+        u3 = p.register_user("carol")
+        p.create_attendance(u3, self.e1)
+        archive_events(p)
+        p.unregister_user("alice", soft=True)
+
+        e1 = p.get_event(self.ids[0])
+        self.assertEqual(p.get_event_headcount(e1), {"going": 1, "invited": 1})
+        self.assertEqual([row.username for row in p.get_roster(e1)[0]], ["bob", "carol"])
+        self.assertEqual([row.username for row in p.get_roster(e1, page_size=1)[0]], ["bob"])
+        self.assertEqual([row.username for row in p.get_roster_page(e1, 2, page_size=1)[0]],
+                         ["carol"])
+
+    def test_recurring(self):
+        # Recurring events are kept until their series has ended
+        p.create_event("weekly", self.u1, time=NOW - timedelta(days=200), recurrence="weekly")
+        p.create_event("ended", self.u1, time=NOW - timedelta(days=200), recurrence="weekly",
+                       recurrence_end=NOW - timedelta(days=180))
+        archive_events(p)
+        self.assertEqual([e.get_name() for e in p.db_interface.s.query(Event).filter(Event.recurrence != None)],
+                         ["weekly"])
+
+    def test_older_archive(self):
+        # An archive created before events had a version_id, which is added as its last column
+        path = p.archive_url[len('sqlite:///'):]
+        archive_conn = sqlite3.connect(path)
+        archive_conn.execute('''CREATE TABLE events(id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL, owner_id INTEGER, location TEXT, time DATETIME, attendance_ids BLOB,
+            survey_ids BLOB, recurrence TEXT, recurrence_end DATETIME, recurrence_count INTEGER,
+            materialized_until DATETIME, series_id INTEGER, deleted_time DATETIME);''')
+        create_tables(archive_conn.cursor())
+        archive_conn.commit()
+        archive_conn.close()
+
+        u1_id = self.u1.get_id()
+        self.assertEqual(archive_events(p)['events'], 1)
+        e1 = p.get_event(self.ids[0])
+        self.assertEqual((e1.get_name(), e1.get_owner_id()), ("old", u1_id))
+
+    def test_ids_not_reused(self):
+        archive_events(p, NOW + timedelta(days=2))
+        # Objects loaded before archiving are detached, so look the user up again
+        e = p.create_event("new", p.get_user_by_username("bob"))
+        self.assertGreater(e.get_id(), self.ids[2])
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3.5
+import unittest
+from Poorganiser import AttendanceRole
+
+
+class TestAttendanceRole(unittest.TestCase):
+    def test_constructor_assertions(self):
+        # Incorrect attendance_id type
+        with self.assertRaises(AssertionError):
+            AttendanceRole('blah', 1, 2, 'cook')
+
+        with self.assertRaises(AssertionError):
+            AttendanceRole(None, 1, 2, 'cook')
+
+        # Incorrect user_id type
+        with self.assertRaises(AssertionError):
+            AttendanceRole(3, 4.3, 2, 'cook')
+
+        # Incorrect event_id type
+        with self.assertRaises(AssertionError):
+            AttendanceRole(3, 1, list(), 'cook')
+
+        # Incorrect role type
+        with self.assertRaises(AssertionError):
+            AttendanceRole(3, 1, 2, ['cook'])
+
+        with self.assertRaises(AssertionError):
+            AttendanceRole(3, 1, 2, None)
+
+    def test_getters(self):
+        ar = AttendanceRole(3, 1, 2, 'cook')
+        self.assertIsNone(ar.get_id())
+        self.assertEqual(ar.get_attendance_id(), 3)
+        self.assertEqual(ar.get_user_id(), 1)
+        self.assertEqual(ar.get_event_id(), 2)
+        self.assertEqual(ar.get_role(), 'cook')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3.5
+import asyncio
+import io
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+from CommandRouter import CommandRouter, WorkerPool, ShardExecutors, TokenBucket, RateLimiter, \
+    RequestCoalescer
+
+
+class TestCommandRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = CommandRouter()
+
+        @self.router.command('!event', heavy=True)
+        async def cmd_event(message, porg, splits):
+            pass
+
+        @self.router.command('!events')
+        async def cmd_events(message, porg, splits):
+            pass
+
+        self.cmd_event = cmd_event
+        self.cmd_events = cmd_events
+
+    def test_find(self):
+        self.assertEqual(self.router.find('!event 1').handler, self.cmd_event)
+        self.assertTrue(self.router.find('!event 1').heavy)
+        self.assertEqual(self.router.find('!events').handler, self.cmd_events)
+        self.assertFalse(self.router.find('!events').heavy)
+
+        # Prefixes and extensions of command names do not match
+        self.assertIsNone(self.router.find('!even'))
+        self.assertIsNone(self.router.find('!eventsx'))
+        self.assertIsNone(self.router.find('!'))
+
+        # Messages without the prefix are rejected
+        self.assertIsNone(self.router.find('event 1'))
+        self.assertIsNone(self.router.find(''))
+
+    def test_cached(self):
+        self.router.add_command('!curr', self.cmd_events, cached=True)
+        self.assertTrue(self.router.find('!curr').cached)
+        self.assertFalse(self.router.find('!event').cached)
+
+    def test_dispatch(self):
+        command, splits = self.router.dispatch('!event "my picnic" 2')
+        self.assertEqual(command.name, '!event')
+        self.assertEqual(splits, ['!event', 'my picnic', '2'])
+
+        self.assertIsNone(self.router.dispatch('hello there'))
+        self.assertIsNone(self.router.dispatch('!unknown "unbalanced'))
+
+        with self.assertRaises(ValueError):
+            self.router.dispatch('!event "unbalanced')
+
+    def test_add_command_invalid(self):
+        with self.assertRaises(ValueError):
+            self.router.add_command('event', self.cmd_event)
+
+        with self.assertRaises(ValueError):
+            self.router.add_command('!two words', self.cmd_event)
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_pool(self, pool, submissions):
+        """Submits each (user key, guild key) in submissions to pool, runs the jobs to completion
+        and returns (accepted flags, keys of the jobs that ran)."""
+        ran = []
+
+        def make_job(keys):
+            async def job():
+                await asyncio.sleep(0)
+                ran.append(keys)
+            return job
+
+        async def run():
+            pool.start()
+            accepted = [pool.submit(make_job(keys), *keys) for keys in submissions]
+            await pool.stop()
+            return accepted
+
+        return self.loop.run_until_complete(run()), ran
+
+    def test_runs_jobs(self):
+        pool = WorkerPool(2, 10, 5, 10)
+        accepted, ran = self.run_pool(pool, [('u1', 'g1'), ('u2', 'g1'), ('u3', 'g2')])
+        self.assertEqual(accepted, [True, True, True])
+        self.assertEqual(sorted(ran), [('u1', 'g1'), ('u2', 'g1'), ('u3', 'g2')])
+
+    def test_per_user_limit(self):
+        pool = WorkerPool(2, 10, 2, 10)
+        accepted, ran = self.run_pool(pool, [('u1', 'g1'), ('u1', 'g1'), ('u1', 'g1'), ('u2', 'g1')])
+        self.assertEqual(accepted, [True, True, False, True])
+        self.assertEqual(len(ran), 3)
+
+    def test_per_guild_limit(self):
+        pool = WorkerPool(2, 10, 5, 2)
+        accepted, ran = self.run_pool(pool, [('u1', 'g1'), ('u2', 'g1'), ('u3', 'g1'), ('u4', 'g2')])
+        self.assertEqual(accepted, [True, True, False, True])
+
+    def test_queue_limit(self):
+        pool = WorkerPool(1, 2, 5, 10)
+        accepted, ran = self.run_pool(pool, [('u1', 'g1'), ('u2', 'g2'), ('u3', 'g3')])
+        self.assertEqual(accepted, [True, True, False])
+
+    def test_limits_released(self):
+        pool = WorkerPool(1, 10, 1, 10)
+
+        async def failing_job():
+            raise RuntimeError("handler failed")
+
+        async def run():
+            pool.start()
+            self.assertTrue(pool.submit(failing_job, 'u1', 'g1'))
+            self.assertFalse(pool.submit(failing_job, 'u1', 'g1'))
+            await pool.stop()
+            # Count is released even though the job raised
+            self.assertTrue(pool.submit(failing_job, 'u1', 'g1'))
+            pool.start()
+            await pool.stop()
+
+        # Silence the traceback printed for the failed jobs
+        with redirect_stderr(io.StringIO()):
+            self.loop.run_until_complete(run())
+
+
+class TestShardExecutors(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executors = ShardExecutors()
+
+    def tearDown(self):
+        self.executors.shutdown()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_threads(self):
+        async def run():
+            return [await self.executors.run(key, threading.get_ident) for key in ['g1', 'g1', 'g2']]
+
+        # Each key's calls share a thread of its own
+        g1, g1_again, g2 = self.loop.run_until_complete(run())
+        self.assertEqual(g1, g1_again)
+        self.assertNotEqual(g1, g2)
+        self.assertNotIn(threading.get_ident(), [g1, g2])
+
+    def test_blocking_call(self):
+        release = threading.Event()
+        ran = []
+
+        async def run():
+            blocked = asyncio.ensure_future(self.executors.run('g1', release.wait, 5))
+            queued = asyncio.ensure_future(self.executors.run('g1', ran.append, 'g1'))
+            # Other keys and the event loop carry on while g1's call blocks
+            await self.executors.run('g2', ran.append, 'g2')
+            await asyncio.sleep(0.01)
+            ran.append('loop')
+            release.set()
+            await blocked
+            await queued
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(ran, ['g2', 'loop', 'g1'])
+
+    def test_submit(self):
+        ran = []
+
+        async def run():
+            # Queued before the coroutine below starts, though it is awaited after
+            submitted = self.executors.submit('g1', ran.append, 'submitted')
+            await self.executors.run('g1', ran.append, 'run')
+            await submitted
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(ran, ['submitted', 'run'])
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1, capacity=2, now=0)
+        self.assertTrue(bucket.consume(now=0))
+        self.assertTrue(bucket.consume(now=0))
+        self.assertFalse(bucket.consume(now=0))
+        self.assertFalse(bucket.consume(now=0.5))
+        self.assertTrue(bucket.consume(now=1))
+        self.assertFalse(bucket.consume(now=1))
+
+        # Never refills past capacity
+        self.assertTrue(bucket.consume(now=100))
+        self.assertTrue(bucket.consume(now=100))
+        self.assertFalse(bucket.consume(now=100))
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=0.5, burst=2)
+        self.assertEqual([limiter.allow('u1', now=0) for i in range(3)], [True, True, False])
+        self.assertTrue(limiter.allow('u2', now=0))  # Each user has their own bucket
+        self.assertFalse(limiter.allow('u1', now=1))
+        self.assertTrue(limiter.allow('u1', now=2))
+
+    def test_prune(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        limiter.allow('u1', now=0)
+        limiter.allow('u2', now=9)
+        limiter.prune(now=9.5)
+        self.assertEqual(list(limiter._buckets), ['u2'])
+
+
+class TestRequestCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.calls = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def make_fn(self, result):
+        async def fn():
+            self.calls.append(result)
+            await asyncio.sleep(0.01)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return fn
+
+    def test_coalesces_concurrent(self):
+        coalescer = RequestCoalescer(ttl=60)
+
+        async def run():
+            return await asyncio.gather(*[coalescer.run('g1', ('!event', '1'), self.make_fn(i))
+                                          for i in range(5)])
+
+        self.assertEqual(self.loop.run_until_complete(run()), [0] * 5)
+        self.assertEqual(self.calls, [0])
+
+    def test_caches_result(self):
+        coalescer = RequestCoalescer(ttl=60)
+        run = coalescer.run
+        self.assertEqual(self.loop.run_until_complete(run('g1', 'k', self.make_fn("a"))), "a")
+        self.assertEqual(self.loop.run_until_complete(run('g1', 'k', self.make_fn("b"))), "a")
+        # Different keys and namespaces are separate
+        self.assertEqual(self.loop.run_until_complete(run('g1', 'k2', self.make_fn("c"))), "c")
+        self.assertEqual(self.loop.run_until_complete(run('g2', 'k', self.make_fn("d"))), "d")
+
+        coalescer.invalidate('g1')
+        self.assertEqual(self.loop.run_until_complete(run('g1', 'k', self.make_fn("e"))), "e")
+        self.assertEqual(self.loop.run_until_complete(run('g2', 'k', self.make_fn("f"))), "d")
+        self.assertEqual(self.calls, ["a", "c", "d", "e"])
+
+    def test_invalidate_while_running(self):
+        coalescer = RequestCoalescer(ttl=60)
+
+        async def run():
+            first = asyncio.ensure_future(coalescer.run('g1', 'k', self.make_fn("a")))
+            await asyncio.sleep(0)
+            coalescer.invalidate('g1')  # e.g. a write finished while "a" was being read
+            # Requests after the invalidation don't share the running request's result
+            second = await coalescer.run('g1', 'k', self.make_fn("b"))
+            return await first, second
+
+        self.assertEqual(self.loop.run_until_complete(run()), ("a", "b"))
+        self.assertEqual(self.loop.run_until_complete(coalescer.run('g1', 'k', self.make_fn("c"))), "b")
+        self.assertEqual(self.calls, ["a", "b"])
+        self.assertEqual(coalescer._in_flight, {})
+
+    def test_expires(self):
+        coalescer = RequestCoalescer(ttl=0)
+        self.assertEqual(self.loop.run_until_complete(coalescer.run('g1', 'k', self.make_fn("a"))), "a")
+        self.assertEqual(self.loop.run_until_complete(coalescer.run('g1', 'k', self.make_fn("b"))), "b")
+        coalescer.prune()
+        self.assertEqual(coalescer._results, {})
+
+    def test_exception(self):
+        coalescer = RequestCoalescer(ttl=60)
+
+        async def run():
+            return await asyncio.gather(coalescer.run('g1', 'k', self.make_fn(RuntimeError("failed"))),
+                                        coalescer.run('g1', 'k', self.make_fn("b")),
+                                        return_exceptions=True)
+
+        results = self.loop.run_until_complete(run())
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertIs(results[0], results[1])
+
+        # Failures are not cached
+        self.assertEqual(self.loop.run_until_complete(coalescer.run('g1', 'k', self.make_fn("c"))), "c")
+
+
+if __name__ == '__main__':
+    unittest.main()
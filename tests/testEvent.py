@@ -152,6 +152,71 @@ class TestEvent(unittest.TestCase):
         with self.assertRaises(AssertionError):
             e1.set_time("01/01/2001")
 
+    def test_set_recurrence(self):
+        e1 = Event("BBQ", 0, "Parra Park", datetime(2016, 10, 1))
+        self.assertFalse(e1.is_recurring())
+        e1.set_recurrence("weekly", end=datetime(2016, 12, 1), count=3)
+        self.assertTrue(e1.is_recurring())
+        self.assertEqual(e1.get_recurrence(), "weekly")
+        self.assertEqual(e1.get_recurrence_end(), datetime(2016, 12, 1))
+        self.assertEqual(e1.get_recurrence_count(), 3)
+        e1.set_recurrence(None)
+        self.assertFalse(e1.is_recurring())
+
+        with self.assertRaises(AssertionError):
+            e1.set_recurrence("yearly")
+
+        with self.assertRaises(AssertionError):
+            e1.set_recurrence("daily", end="tomorrow")
+
+        with self.assertRaises(AssertionError):
+            e1.set_recurrence("daily", count=1.5)
+
+    def test_iter_occurrences(self):
+        e1 = Event("BBQ", 0, "Parra Park", datetime(2016, 1, 31, 18))
+        self.assertEqual(list(e1.iter_occurrences()), [datetime(2016, 1, 31, 18)])
+        self.assertEqual(list(Event("BBQ", 0).iter_occurrences()), [])
+
+        e1.set_recurrence("daily", count=3)
+        self.assertEqual(list(e1.iter_occurrences()), [datetime(2016, 1, 31, 18), datetime(2016, 2, 1, 18),
+                                                       datetime(2016, 2, 2, 18)])
+
+        e1.set_recurrence("weekly", end=datetime(2016, 2, 14, 18))
+        self.assertEqual(list(e1.iter_occurrences()), [datetime(2016, 1, 31, 18), datetime(2016, 2, 7, 18),
+                                                       datetime(2016, 2, 14, 18)])
+
+        # Months without the event's day get the last day of the month instead
+        e1.set_recurrence("monthly", count=4)
+        self.assertEqual(list(e1.iter_occurrences()), [datetime(2016, 1, 31, 18), datetime(2016, 2, 29, 18),
+                                                       datetime(2016, 3, 31, 18), datetime(2016, 4, 30, 18)])
+
+        # Series without an end are generated lazily
+        e1.set_recurrence("monthly")
+        occurrences = e1.iter_occurrences()
+        for i in range(12):
+            next(occurrences)
+        self.assertEqual(next(occurrences), datetime(2017, 1, 31, 18))
+
+    def test_iter_occurrences_after(self):
+        e1 = Event("BBQ", 0, "Parra Park", datetime(2016, 1, 31, 18))
+        self.assertEqual(list(e1.iter_occurrences(after=datetime(2016, 1, 31, 18))), [])
+        self.assertEqual(list(e1.iter_occurrences(after=datetime(2016, 1, 1))), [datetime(2016, 1, 31, 18)])
+
+        # Occurrences later than after, counted from the first occurrence
+        e1.set_recurrence("daily", count=3)
+        self.assertEqual(list(e1.iter_occurrences(after=datetime(2016, 2, 1, 18))), [datetime(2016, 2, 2, 18)])
+        self.assertEqual(list(e1.iter_occurrences(after=datetime(2016, 3, 1))), [])
+
+        e1.set_recurrence("weekly")
+        occurrences = e1.iter_occurrences(after=datetime(2116, 2, 1))
+        self.assertEqual(next(occurrences), datetime(2116, 2, 2, 18))
+
+        e1.set_recurrence("monthly", end=datetime(2016, 4, 30, 18))
+        self.assertEqual(list(e1.iter_occurrences(after=datetime(2016, 2, 29, 18))),
+                         [datetime(2016, 3, 31, 18), datetime(2016, 4, 30, 18)])
+        self.assertEqual(list(e1.iter_occurrences(after=datetime(2016, 3, 1))),
+                         [datetime(2016, 3, 31, 18), datetime(2016, 4, 30, 18)])
+
     def test_add_attendance_id(self):
         e1 = Event("BBQ", 0,  "Parra Park", datetime(2016, 10, 1))
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3.5
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from config import porg_config
+from gen_db import generate as generate_db
+from porg_export import export, iter_responses, iter_attendance
+from PorgWrapper import PorgWrapper
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.u1 = p.register_user("bob")
+        self.u2 = p.register_user("alice")
+        self.e1 = p.create_event("picnic", self.u1, time=datetime(2017, 5, 21, 18, 0))
+        p.create_attendance(self.u2, self.e1, roles=["cook", "driver"])
+        self.s1 = p.create_survey("food", self.u1, event_obj=self.e1)
+        self.q1 = p.create_question(self.u1, "bring?", "choose_many", survey_obj=self.s1)
+        self.c1 = p.create_choice(self.q1, "cake")
+        self.c2 = p.create_choice(self.q1, "chips")
+        self.q2 = p.create_question(self.u1, "comments?", "free", survey_obj=self.s1)
+        self.r1 = p.create_response(self.u2, self.q2, response_text="none")
+        self.r2 = p.create_response(self.u2, self.q1, choice_ids=[self.c1.get_id(), self.c2.get_id()])
+        self.r3 = p.create_response(self.u1, self.q1, choice_ids=[self.c2.get_id()])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_iter_responses(self):
+        rows = list(iter_responses(p.db_interface.s))
+        self.assertEqual([row['response_id'] for row in rows],
+                         [self.r2.get_id(), self.r3.get_id(), self.r1.get_id()])
+        self.assertEqual(rows[0], {'response_id': self.r2.get_id(), 'survey_id': self.s1.get_id(),
+                                   'question_id': self.q1.get_id(), 'question': "bring?",
+                                   'responder_id': self.u2.get_id(), 'responder': "alice",
+                                   'response_text': None,
+                                   'choice_ids': [self.c1.get_id(), self.c2.get_id()],
+                                   'choices': ["cake", "chips"]})
+        self.assertEqual(rows[1]['responder'], "bob")
+        self.assertEqual(rows[1]['choices'], ["chips"])
+        self.assertEqual(rows[2]['question'], "comments?")
+        self.assertEqual(rows[2]['response_text'], "none")
+        self.assertEqual(rows[2]['choices'], [])
+
+    def test_iter_attendance(self):
+        rows = list(iter_attendance(p.db_interface.s))
+        self.assertEqual([(row['username'], row['going_status'], row['roles']) for row in rows],
+                         [("bob", "going", ["organiser"]), ("alice", "invited", ["cook", "driver"])])
+        self.assertEqual(rows[0]['event'], "picnic")
+        self.assertEqual(rows[0]['event_time'], datetime(2017, 5, 21, 18, 0))
+
+    def test_export_csv(self):
+        path = os.path.join(self.tmp_dir, 'responses.csv')
+        self.assertEqual(export('responses', path, db_interface=p.db_interface), 3)
+
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['choices'], "cake;chips")
+        self.assertEqual(rows[0]['response_text'], "")
+        self.assertEqual(rows[2]['response_text'], "none")
+
+    def test_export_jsonl(self):
+        path = os.path.join(self.tmp_dir, 'attendance.jsonl')
+        self.assertEqual(export('attendance', path, db_interface=p.db_interface), 2)
+
+        with open(path) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[1]['roles'], ["cook", "driver"])
+        self.assertEqual(rows[1]['event_time'], "2017-05-21T18:00:00")
+
+    def test_soft_deleted(self):
+        e2 = p.create_event("party", self.u2)
+        s2 = p.create_survey("drinks", self.u2, event_obj=e2)
+        q3 = p.create_question(self.u2, "which?", "free", survey_obj=s2)
+        p.create_response(self.u1, q3, response_text="juice")
+        p.delete_event(e2, soft=True)
+        p.unregister_user(self.u2, soft=True)
+
+        # As once collected: alice's attendance is gone but her responses are kept
+        rows = list(iter_attendance(p.db_interface.s))
+        self.assertEqual([(row['event_id'], row['username']) for row in rows],
+                         [(self.e1.get_id(), "bob")])
+        rows = list(iter_responses(p.db_interface.s))
+        self.assertEqual([(row['response_id'], row['responder']) for row in rows],
+                         [(self.r2.get_id(), None), (self.r3.get_id(), "bob"), (self.r1.get_id(), None)])
+
+        p.delete_survey(self.s1, soft=True)
+        self.assertEqual(list(iter_responses(p.db_interface.s)), [])
+
+    def test_export_invalid(self):
+        path = os.path.join(self.tmp_dir, 'out.csv')
+        with open(path, 'w') as f:
+            f.write('keep')
+        with self.assertRaises(ValueError):
+            export('users', path, db_interface=p.db_interface)
+
+        with self.assertRaises(ValueError):
+            export('responses', path, fmt='parquet', db_interface=p.db_interface)
+
+        # The file isn't truncated
+        with open(path) as f:
+            self.assertEqual(f.read(), 'keep')
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
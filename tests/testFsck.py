@@ -0,0 +1,192 @@
+#!/usr/bin/env python3.5
+import sqlite3
+import unittest
+
+import porg_fsck
+from config import porg_config
+from gen_db import generate as generate_db, backfill_attendance_roles, migrate
+from porg_fsck import fsck, Problem
+from Poorganiser import User, Event, Attendance, AttendanceRole, Survey, Question, Response
+from PorgWrapper import PorgWrapper
+
+
+class TestFsck(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+
+        self.u1 = p.register_user("bob")
+        self.u2 = p.register_user("alice")
+        self.e1 = p.create_event("picnic", self.u1)
+        self.e2 = p.create_event("party", self.u2)
+        self.a1 = p.create_attendance(self.u2, self.e1, roles=["cook"])
+        self.s1 = p.create_survey("food", self.u1, event_obj=self.e1)
+        self.q1 = p.create_question(self.u1, "bring?", "choose_many", survey_obj=self.s1)
+        self.c1 = p.create_choice(self.q1, "cake")
+        self.c2 = p.create_choice(self.q1, "chips")
+        self.r1 = p.create_response(self.u2, self.q1, choice_ids=[self.c1.get_id(), self.c2.get_id()])
+        p.close_survey(self.s1)
+
+    def execute(self, sql):
+        """Changes the database behind the PorgWrapper's back, as a partial failure would."""
+        p.db_interface.s.execute(sql)
+        p.db_interface.s.commit()
+
+    def test_consistent(self):
+        s2 = p.clone_survey(self.s1, event_obj=self.e2)
+        q2 = p.db_interface.get_obj(s2.get_question_ids()[0], Question)
+        u3 = p.register_user("carol")
+        p.create_event("gone", u3)
+        p.create_response(u3, q2, choice_ids=q2.get_allowed_choice_ids()[:1])
+        p.unregister_user(u3)  # Leaves the response
+        self.assertEqual(fsck(p), {})
+
+    def test_soft_deleted(self):
+        # Soft deleted objects are consistent before, while and after being collected
+        p.delete_event(self.e1, soft=True)
+        p.unregister_user(self.u2, soft=True)
+        self.assertEqual(fsck(p), {})
+        p.collect_garbage(limit=2)
+        self.assertEqual(fsck(p), {})
+        while p.collect_garbage():
+            pass
+        self.assertEqual(fsck(p), {})
+
+    def test_missing_row(self):
+        s1_id, e1_id = self.s1.get_id(), self.e1.get_id()
+        self.execute('DELETE FROM events WHERE id = {}'.format(e1_id))
+        problems = []
+        found = fsck(p, report=problems.append)
+
+        self.assertEqual(found[('missing_row', 'attendance', 'event_id')], 2)
+        self.assertEqual(found[('missing_row', 'surveys', 'event_id')], 1)
+        self.assertEqual(found[('dangling_id', 'users', 'events_organised_ids')], 1)
+        self.assertIn(Problem('missing_row', 'surveys', 'event_id', s1_id, e1_id), problems)
+        self.assertEqual(sum(found.values()), len(problems))
+
+        # Nothing is changed unless repairing
+        self.assertEqual(fsck(p), found)
+
+    def test_repair(self):
+        e2_id = self.e2.get_id()
+        self.execute('DELETE FROM events WHERE id = {}'.format(self.e1.get_id()))
+        found = fsck(p, repair=True)
+        # Rows orphaned by the repair are found (and repaired) in the same run
+        self.assertEqual(found[('missing_row', 'attendance_roles', 'attendance_id')], 2)
+        self.assertEqual(found[('dangling_id', 'users', 'events_attending_ids')], 2)
+        self.assertEqual(found[('missing_row', 'questions', 'survey_id')], 1)
+        self.assertEqual(found[('missing_row', 'responses', 'question_id')], 1)
+        self.assertEqual(fsck(p), {})
+
+        s = p.db_interface.s
+        self.assertEqual(s.query(Attendance).count(), 1)
+        self.assertEqual(s.query(AttendanceRole).count(), 1)
+        self.assertEqual(s.query(Survey).count(), 0)
+        u1 = p.get_user_by_username("bob")
+        u2 = p.get_user_by_username("alice")
+        self.assertEqual(u1.get_events_organised_ids(), [])
+        self.assertEqual(u1.get_survey_ids(), [])
+        self.assertEqual(u1.get_question_ids(), [])
+        self.assertEqual(u2.get_events_attending_ids(), [e2_id])
+        self.assertEqual(u2.get_response_ids(), [])
+
+    def test_repair_owner(self):
+        self.execute('DELETE FROM users WHERE id = {}'.format(self.u1.get_id()))
+        found = fsck(p, repair=True)
+        self.assertEqual(found[('missing_row', 'events', 'owner_id')], 1)
+        self.assertEqual(found[('missing_row', 'attendance', 'user_id')], 1)
+        self.assertEqual(found[('missing_row', 'surveys', 'owner_id')], 1)
+        self.assertEqual(found[('missing_row', 'questions', 'owner_id')], 1)
+        self.assertEqual(fsck(p), {})
+
+        # As when the owner unregisters, the event is kept without an owner
+        e1 = p.get_event(self.e1.get_id())
+        self.assertIsNone(e1.get_owner_id())
+        self.assertEqual(e1.get_attendance_ids(), [self.a1.get_id()])
+        self.assertEqual(p.get_event_headcount(e1), {"invited": 1})
+
+    def test_repair_id_list(self):
+        e1_id, a1_id, r1_id = self.e1.get_id(), self.a1.get_id(), self.r1.get_id()
+        self.e1.attendance_ids = [a1_id, 99]
+        p.db_interface.update(self.e1)
+        p.delete_choice(self.c2)  # Leaves the choice id in the response
+        version_id = self.e1.version_id
+
+        problems = []
+        found = fsck(p, repair=True, report=problems.append)
+        self.assertEqual(problems, [Problem('dangling_id', 'events', 'attendance_ids', e1_id, 99),
+                                    Problem('missing_id', 'events', 'attendance_ids', e1_id, 1),
+                                    Problem('dangling_id', 'responses', 'choice_ids',
+                                            r1_id, self.c2.get_id())])
+        self.assertEqual(fsck(p), {})
+
+        self.assertEqual(p.get_event(e1_id).get_attendance_ids(), [a1_id, 1])
+        self.assertEqual(p.db_interface.s.query(Event).get(e1_id).version_id, version_id + 1)
+        self.assertEqual(p.db_interface.get_obj(r1_id, Response).get_choice_ids(), [self.c1.get_id()])
+
+    def test_repair_roles(self):
+        a1_id, e1_id, u2_id = self.a1.get_id(), self.e1.get_id(), self.u2.get_id()
+        self.execute("DELETE FROM attendance_roles WHERE role = 'cook'")
+        self.execute("INSERT INTO attendance_roles (attendance_id, user_id, event_id, role) "
+                     "VALUES ({}, {}, {}, 'driver')".format(a1_id, u2_id, e1_id))
+        self.execute("UPDATE attendance_roles SET event_id = 99 WHERE event_id = {} "
+                     "AND role = 'organiser'".format(e1_id))
+        organiser_role = p.db_interface.s.query(AttendanceRole).filter_by(event_id=99).one()
+
+        problems = []
+        fsck(p, repair=True, report=problems.append)
+        self.assertEqual(problems, [Problem('wrong_ref', 'attendance_roles', 'event_id',
+                                            organiser_role.id, 99),
+                                    Problem('dangling_role', 'attendance', 'roles', a1_id, 'driver'),
+                                    Problem('missing_role', 'attendance', 'roles', a1_id, 'cook')])
+        self.assertEqual(fsck(p), {})
+
+        self.assertEqual(organiser_role.event_id, e1_id)
+        self.assertEqual(p.get_attendees_by_role(self.e1, "cook"), [self.u2])
+        self.assertEqual(p.get_attendees_by_role(self.e1, "driver"), [])
+
+    def test_backfill_roles(self):
+        # As in a database created before the attendance_roles table
+        p.db_interface.s.commit()
+        c.execute('DROP TABLE attendance_roles')
+        conn.commit()
+
+        self.assertEqual(migrate(c), 3)
+        conn.commit()
+        self.assertEqual(backfill_attendance_roles(c), 0)
+        conn.commit()
+        self.assertEqual(fsck(p), {})
+        self.assertEqual(p.get_attendees_by_role(self.e1, "cook"), [self.u2])
+        self.assertEqual(p.get_attendees_by_role(self.e2, "organiser"), [self.u2])
+
+    def test_repair_search_index(self):
+        self.execute('DELETE FROM search_index')
+        self.assertEqual(p.search("chips"), [])
+        fsck(p, repair=True)
+        self.assertEqual(p.search("chips"), [self.c2])
+        self.assertEqual(p.search("picnic"), [p.get_event(self.e1.get_id())])
+
+    def test_batches(self):
+        self.addCleanup(setattr, porg_fsck, 'FSCK_BATCH_SIZE', porg_fsck.FSCK_BATCH_SIZE)
+        self.addCleanup(setattr, porg_fsck, 'LOAD_BATCH_SIZE', porg_fsck.LOAD_BATCH_SIZE)
+        porg_fsck.FSCK_BATCH_SIZE = porg_fsck.LOAD_BATCH_SIZE = 1
+
+        for i in range(3):
+            p.create_attendance(p.register_user("user{}".format(i)), self.e2)
+        self.execute('UPDATE users SET events_attending_ids = NULL')
+        found = fsck(p, repair=True)
+        self.assertEqual(found, {('missing_id', 'users', 'events_attending_ids'): 6})
+        self.assertEqual(fsck(p), {})
+        self.assertEqual([u.get_events_attending_ids() for u in p.db_interface.s.query(User)],
+                         [[1], [1, 2], [2], [2], [2]])
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3.5
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from gen_db import generate, migrate
+from Poorganiser import User, Event, Attendance
+from PorgWrapper import PorgWrapper
+
+# Schema written by gen_db.py before version columns, attendance roles, search, survey results,
+# recurring events and soft deletes were added
+BASELINE_SCHEMA = [
+    '''CREATE TABLE events(id INTEGER PRIMARY KEY, name TEXT NOT NULL, owner_id INTEGER,
+        location TEXT, time DATETIME, attendance_ids BLOB, survey_ids BLOB);''',
+    '''CREATE TABLE users(id INTEGER PRIMARY KEY, username TEXT NOT NULL, events_organised_ids BLOB,
+        events_attending_ids BLOB, survey_ids BLOB, question_ids BLOB, response_ids BLOB);''',
+    '''CREATE TABLE attendance(id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,
+        event_id INTEGER NOT NULL, going_status TEXT NOT NULL, roles BLOB);''',
+    '''CREATE TABLE surveys(id INTEGER PRIMARY KEY, name TEXT NOT NULL, owner_id INTEGER,
+        event_id INTEGER, question_ids BLOB);''',
+    '''CREATE TABLE questions(id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL,
+        question TEXT NOT NULL, question_type TEXT NOT NULL, survey_id INTEGER,
+        allowed_choice_ids BLOB, response_ids BLOB);''',
+    '''CREATE TABLE choices(id INTEGER PRIMARY KEY, question_id INTEGER NOT NULL,
+        choice text NOT NULL);''',
+    '''CREATE TABLE responses(id INTEGER PRIMARY KEY, response_text TEXT,
+        responder_id INTEGER NOT NULL, question_id INTEGER NOT NULL, choice_ids BLOB);''',
+]
+
+
+def _ids(*ids):
+    return pickle.dumps(list(ids))
+
+
+class TestGenDb(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'old.db')
+
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        for definition in BASELINE_SCHEMA:
+            c.execute(definition)
+        c.execute('INSERT INTO users VALUES (1, "bob", ?, ?, ?, ?, ?)',
+                  (_ids(1), _ids(1), _ids(), _ids(), _ids()))
+        c.execute('INSERT INTO users VALUES (2, "alice", ?, ?, ?, ?, ?)',
+                  (_ids(), _ids(1), _ids(), _ids(), _ids()))
+        c.execute('INSERT INTO events VALUES (1, "picnic", 1, "park", NULL, ?, ?)', (_ids(1, 2), _ids()))
+        c.execute('INSERT INTO attendance VALUES (1, 1, 1, "going", ?)', (_ids('organiser'),))
+        c.execute('INSERT INTO attendance VALUES (2, 2, 1, "invited", ?)', (_ids('cook'),))
+        conn.commit()
+        self.conn = conn
+
+    def migrate(self):
+        self.assertEqual(migrate(self.conn.cursor()), 2)  # Attendance roles backfilled
+        self.conn.commit()
+        self.conn.close()
+        p = PorgWrapper('sqlite:///' + self.path)
+        self.addCleanup(p.close)
+        return p
+
+    def test_migrate(self):
+        p = self.migrate()
+        bob = p.get_user_by_username("bob")
+        self.assertEqual(bob.version_id, 1)
+        e1 = p.get_event(1)
+        self.assertEqual(e1.get_attendance_ids(), [1, 2])
+        self.assertIsNone(e1.get_deleted_time())
+        self.assertEqual(p.get_attendees_by_role(e1, "cook"), [p.get_user_by_username("alice")])
+        self.assertEqual(p.search("park"), [e1])  # Rows from before the search index are indexed
+
+        # Existing rows can be updated, and new rows are inserted after the existing ones
+        p.update_event(e1, location="beach")
+        self.assertEqual(p.get_event(1).version_id, 2)
+        e2 = p.create_event("party", bob)
+        self.assertEqual(e2.get_id(), 2)
+        self.assertEqual(p.db_interface.next_id(Event), 3)
+        self.assertEqual(p.db_interface.next_id(Attendance), 4)
+
+        # Ids are not reused after the last row is deleted
+        p.delete_event(e2)
+        self.assertEqual(p.create_event("party", bob).get_id(), 3)
+
+    def test_migrate_again(self):
+        migrate(self.conn.cursor())
+        self.conn.commit()
+        schema = self.conn.execute('SELECT sql FROM sqlite_master ORDER BY name').fetchall()
+        self.assertEqual(migrate(self.conn.cursor()), 0)
+        self.conn.commit()
+        self.conn.close()
+        p = PorgWrapper('sqlite:///' + self.path)
+        self.addCleanup(p.close)
+        self.assertEqual(p.get_event(1).get_name(), "picnic")
+
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        self.assertEqual(conn.execute('SELECT sql FROM sqlite_master ORDER BY name').fetchall(), schema)
+        self.assertEqual(conn.execute("SELECT count(*) FROM sqlite_sequence WHERE name = 'events'")
+                         .fetchone(), (1,))
+
+    def test_generate_partial(self):
+        migrate(self.conn.cursor())
+        self.conn.execute('DROP TABLE events')
+        generate(self.conn.cursor())  # Tables after a missing one are still dropped
+        for table in ['users', 'attendance', 'attendance_roles', 'search_index']:
+            self.assertEqual(self.conn.execute('SELECT count(*) FROM {}'.format(table)).fetchone(),
+                             (0,))
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
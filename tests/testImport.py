@@ -0,0 +1,184 @@
+#!/usr/bin/env python3.5
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from sqlalchemy import event
+
+from config import porg_config
+from gen_db import generate as generate_db
+from porg_import import BulkImporter
+from PorgWrapper import PorgWrapper
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+        self.importer = BulkImporter(p.db_interface, batch_size=2)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_users(self):
+        p.register_user("bob")
+        path = self.write_file('users.csv', 'username\nalice\nbob\ncarol\nalice\n\n  \ndave\n')
+
+        report = self.importer.import_file('users', path)
+        self.assertEqual(report.rows, 6)
+        self.assertEqual(report.inserted, 3)
+        self.assertEqual(report.errors, [(3, 'User "bob" is already registered'),
+                                         (5, 'User "alice" is already registered'),
+                                         (7, 'Missing username')])
+
+        for username in ["alice", "carol", "dave"]:
+            u = p.get_user_by_username(username)
+            self.assertEqual(u.get_events_organised_ids(), [])
+            self.assertEqual(u.get_response_ids(), [])
+
+    def test_import_soft_deleted_users(self):
+        p.register_user("bob")
+        p.unregister_user("bob", soft=True)
+        path = self.write_file('users.csv', 'username\nbob\n')
+        self.assertEqual(self.importer.import_file('users', path).inserted, 1)
+        self.assertIsNotNone(p.get_user_by_username("bob"))
+
+        p.unregister_user("bob", soft=True)
+        path = self.write_file('events.csv', 'name,owner\npicnic,bob\n')
+        report = self.importer.import_file('events', path)
+        self.assertEqual(report.inserted, 0)
+        self.assertEqual([line for line, message in report.errors], [2])
+
+    def test_import_events(self):
+        bob = p.register_user("bob")
+        rows = [{'name': 'picnic', 'owner': 'bob', 'location': 'park', 'time': '2017-05-21 18:00'},
+                {'name': 'no owner', 'owner': 'nobody'},
+                {'name': 'bad time', 'owner': 'bob', 'time': 'tomorrow'},
+                {'name': 'meeting', 'owner': 'bob'}]
+        path = self.write_file('events.jsonl',
+                               '\n'.join(json.dumps(row) for row in rows) + '\n{not json\n[]\n')
+
+        report = self.importer.import_file('events', path)
+        self.assertEqual(report.rows, 6)
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual([line for line, message in report.errors], [2, 3, 5, 6])
+
+        e1, e2 = p.get_all_events()
+        self.assertEqual(e1.get_name(), "picnic")
+        self.assertEqual(e1.get_location(), "park")
+        self.assertEqual(e1.get_time(), datetime(2017, 5, 21, 18, 0))
+        self.assertEqual(e2.get_name(), "meeting")
+
+        # Check owner attendances and id lists were created as with create_event
+        for e in [e1, e2]:
+            a = p.get_attendance(bob, e)
+            self.assertEqual(e.get_owner_id(), bob.get_id())
+            self.assertEqual(e.get_attendance_ids(), [a.get_id()])
+            self.assertEqual(a.get_going_status(), "going")
+            self.assertEqual(p.get_attendees_by_role(e, "organiser"), [bob])
+        self.assertEqual(bob.get_events_organised_ids(), [e1.get_id(), e2.get_id()])
+        self.assertEqual(bob.get_events_attending_ids(), [e1.get_id(), e2.get_id()])
+
+    def test_import_attendance(self):
+        bob = p.register_user("bob")
+        alice = p.register_user("alice")
+        carol = p.register_user("carol")
+        e1 = p.create_event("e1", bob)
+        path = self.write_file('attendance.csv',
+                               'username,event_id,going_status,roles\n'
+                               'alice,{0},going,cook;driver\n'
+                               'bob,{0},,\n'
+                               'carol,{0},,\n'
+                               'carol,{0},going,\n'
+                               'nobody,{0},,\n'
+                               'alice,1234,,\n'
+                               'alice,abc,,\n'.format(e1.get_id()))
+
+        report = self.importer.import_file('attendance', path)
+        self.assertEqual(report.rows, 7)
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual([line for line, message in report.errors], [3, 5, 6, 7, 8])
+
+        a_alice = p.get_attendance(alice, e1)
+        a_carol = p.get_attendance(carol, e1)
+        self.assertEqual(a_alice.get_going_status(), "going")
+        self.assertEqual(a_alice.get_roles(), ["cook", "driver"])
+        self.assertEqual(a_carol.get_going_status(), "invited")
+        self.assertEqual(p.get_attendees_by_role(e1, "driver"), [alice])
+        self.assertEqual(len(e1.get_attendance_ids()), 3)
+        self.assertEqual(alice.get_events_attending_ids(), [e1.get_id()])
+        self.assertEqual(p.get_event_headcount(e1), {"going": 2, "invited": 1})
+
+    def test_import_attendance_executemany(self):
+        bob = p.register_user("bob")
+        e1 = p.create_event("e1", bob)
+        e2 = p.create_event("e2", bob)
+        for name in ["alice", "carol"]:
+            p.register_user(name)
+        rows = [{'username': name, 'event_id': e.get_id(), 'roles': ['cook']}
+                for name in ["alice", "carol"] for e in [e1, e2]]
+        path = self.write_file('attendance.jsonl', '\n'.join(json.dumps(row) for row in rows))
+
+        queries = []
+
+        def on_execute(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        event.listen(p.db_interface._engine, 'before_cursor_execute', on_execute)
+        self.addCleanup(event.remove, p.db_interface._engine, 'before_cursor_execute', on_execute)
+        report = self.importer.import_file('attendance', path)
+        self.assertEqual(report.inserted, 4)
+        # One INSERT per batch of 2 rows rather than one per row
+        self.assertEqual(len([q for q in queries if q.startswith('INSERT INTO attendance ')]), 2)
+
+        e1 = p.get_event(e1.get_id())
+        self.assertEqual(len(e1.get_attendance_ids()), 3)
+        self.assertEqual(p.get_attendees_by_role(e1, "cook"),
+                         [p.get_user_by_username("alice"), p.get_user_by_username("carol")])
+
+    def test_import_invalid_values(self):
+        bob = p.register_user("bob")
+        e1 = p.create_event("e1", bob)
+        rows = [{'username': 'bob', 'event_id': float(e1.get_id())},
+                {'username': 'bob', 'event_id': e1.get_id() + 0.5},
+                {'username': 'bob', 'event_id': True},
+                {'username': '  ' + 'a' * 40 + '  ', 'event_id': e1.get_id()},
+                {'username': 'a' * 41, 'event_id': e1.get_id()}]
+        path = self.write_file('attendance.jsonl', '\n'.join(json.dumps(row) for row in rows))
+
+        report = self.importer.import_file('attendance', path)
+        self.assertEqual(report.inserted, 0)
+        self.assertEqual([message for line, message in report.errors][:3],
+                         ["Invalid event_id: {}".format(float(e1.get_id())),
+                          "Invalid event_id: {}".format(e1.get_id() + 0.5),
+                          "Invalid event_id: True"])
+        # Surrounding whitespace doesn't count towards the length
+        self.assertEqual(report.errors[3], (4, 'User "{}" could not be found'.format('a' * 40)))
+        self.assertEqual(report.errors[4], (5, "Invalid username: longer than 40 characters"))
+
+    def test_import_invalid_kind(self):
+        path = self.write_file('users.csv', 'username\nalice\n')
+        with self.assertRaises(ValueError):
+            self.importer.import_file('surveys', path)
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
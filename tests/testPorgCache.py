@@ -0,0 +1,46 @@
+#!/usr/bin/env python3.5
+import unittest
+
+from PorgCache import RenderCache
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = RenderCache(max_size=2)
+        self.renders = []
+
+    def render(self, text):
+        def fn():
+            self.renders.append(text)
+            return text
+        return fn
+
+    def test_get(self):
+        self.assertEqual(self.cache.get(('event', 1), 1, self.render("a")), "a")
+        self.assertEqual(self.cache.get(('event', 1), 1, self.render("b")), "a")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # A new version re-renders
+        self.assertEqual(self.cache.get(('event', 1), 2, self.render("c")), "c")
+        self.assertEqual(self.cache.get(('event', 1), 2, self.render("d")), "c")
+        self.assertEqual(self.renders, ["a", "c"])
+
+    def test_max_size(self):
+        self.cache.get(1, 1, self.render("a"))
+        self.cache.get(2, 1, self.render("b"))
+        self.cache.get(1, 1, self.render("a"))  # 2 is now least recently used
+        self.cache.get(3, 1, self.render("c"))
+        self.assertEqual(len(self.cache), 2)
+
+        self.assertEqual(self.cache.get(1, 1, self.render("x")), "a")
+        self.assertEqual(self.cache.get(2, 1, self.render("y")), "y")
+
+    def test_clear(self):
+        self.cache.get(1, 1, self.render("a"))
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.get(1, 1, self.render("b")), "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
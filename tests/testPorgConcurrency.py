@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.5
+import sqlite3
+import unittest
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from config import porg_config
+from gen_db import generate as generate_db
+from Poorganiser import Event
+from PorgConcurrency import ConflictStats, retry_on_conflict
+from PorgWrapper import PorgWrapper
+
+
+class TestConflictStats(unittest.TestCase):
+    def test_get_conflict_rate(self):
+        stats = ConflictStats()
+        self.assertEqual(stats.get_conflict_rate(), 0.0)
+        stats.calls['a'] += 4
+        stats.calls['b'] += 4
+        stats.conflicts['a'] += 2
+        self.assertEqual(stats.get_conflict_rate('a'), 0.5)
+        self.assertEqual(stats.get_conflict_rate('b'), 0.0)
+        self.assertEqual(stats.get_conflict_rate(), 0.25)
+
+        stats.clear()
+        self.assertEqual(stats.get_conflict_rate('a'), 0.0)
+
+
+class TestRetryOnConflict(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        for porg in [p, p2]:
+            porg.db_interface.s.expunge_all()
+            porg.conflict_stats.clear()
+
+        self.u1 = p.register_user("u1")
+        self.e1 = p.create_event("e1", self.u1)
+
+    def test_version_id(self):
+        self.assertEqual(self.e1.version_id, 2)  # Updated with the organiser's attendance
+        p.update_event(self.e1, name="renamed")
+        self.assertEqual(self.e1.version_id, 3)
+
+    def test_lost_update(self):
+        # Both wrappers add an attendance to the event, starting from the same version
+        self.e1.get_attendance_ids()
+        u2 = p2.register_user("u2")
+        u3 = p.register_user("u3")
+        self.e1.get_attendance_ids()
+        p2.create_attendance(u2.get_id(), self.e1.get_id())
+        p.create_attendance(u3, self.e1)
+
+        self.assertEqual(p.conflict_stats.conflicts['create_attendance'], 1)
+        self.assertEqual(p.conflict_stats.get_conflict_rate('create_attendance'), 1.0)
+        self.assertEqual(p.conflict_stats.failures['create_attendance'], 0)
+
+        # The retry saw the other process's attendance, so neither was lost
+        p2.db_interface.s.expire_all()
+        e1 = p2.db_interface.get_obj(self.e1.get_id(), Event)
+        self.assertEqual(len(e1.get_attendance_ids()), 3)
+        self.assertEqual(p2.get_event_headcount(e1), {"going": 1, "invited": 2})
+
+    def test_retries_exhausted(self):
+        attempts = []
+
+        @retry_on_conflict
+        def always_conflicts(porg):
+            attempts.append(porg.db_interface.in_transaction())
+            raise StaleDataError("conflict")
+
+        with self.assertRaises(StaleDataError):
+            always_conflicts(p)
+        self.assertEqual(attempts, [True] * (porg_config.CONFLICT_RETRIES + 1))
+        self.assertEqual(p.conflict_stats.calls['always_conflicts'], 1)
+        self.assertEqual(p.conflict_stats.conflicts['always_conflicts'], porg_config.CONFLICT_RETRIES + 1)
+        self.assertEqual(p.conflict_stats.failures['always_conflicts'], 1)
+
+    def test_single_transaction(self):
+        # A failing call leaves nothing behind, even after some of its changes were flushed
+        @retry_on_conflict
+        def half_done(porg):
+            porg.update_event(self.e1, name="renamed")
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            half_done(p)
+        self.assertEqual(self.e1.get_name(), "e1")
+        self.assertEqual(p.conflict_stats.calls['update_event'], 0)  # Part of half_done's call
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrappers standing in for two processes
+p = PorgWrapper()
+p2 = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3.5
+import io
+import unittest
+from contextlib import redirect_stderr
+
+from PorgEvents import *
+
+
+class TestChangeEvent(unittest.TestCase):
+    def test_fields(self):
+        change = AttendanceAdded(1, 2, 3)
+        self.assertEqual((change.attendance_id, change.event_id, change.user_id), (1, 2, 3))
+        self.assertEqual(repr(change), "AttendanceAdded(attendance_id=1, event_id=2, user_id=3)")
+
+        with self.assertRaises(TypeError):
+            EventCreated(1)
+
+    def test_equality(self):
+        self.assertEqual(EventUpdated(1), EventUpdated(1))
+        self.assertNotEqual(EventUpdated(1), EventUpdated(2))
+        self.assertNotEqual(EventUpdated(1), EventDeleted(1))
+        self.assertEqual(len({EventUpdated(1), EventUpdated(1), EventDeleted(1)}), 2)
+
+
+class TestEventBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = EventBus()
+        self.received = []
+
+    def test_subscribe(self):
+        self.bus.subscribe(self.received.append)
+        self.bus.publish(EventCreated(1, 2))
+        self.bus.publish(EventUpdated(1))
+        self.assertEqual(self.received, [EventCreated(1, 2), EventUpdated(1)])
+
+    def test_types(self):
+        self.bus.subscribe(self.received.append, types=[EventUpdated, EventDeleted])
+        self.bus.publish(EventCreated(1, 2))
+        self.bus.publish(EventUpdated(1))
+        self.bus.publish(EventDeleted(1))
+        self.assertEqual(self.received, [EventUpdated(1), EventDeleted(1)])
+
+    def test_unsubscribe(self):
+        subscription = self.bus.subscribe(self.received.append)
+        self.bus.publish(EventUpdated(1))
+        self.bus.unsubscribe(subscription)
+        self.bus.publish(EventUpdated(2))
+        self.assertEqual(self.received, [EventUpdated(1)])
+
+    def test_batches(self):
+        self.bus.subscribe(self.received.append, batch_size=3)
+        self.bus.publish(EventUpdated(1))
+        self.bus.publish(EventUpdated(1))  # Duplicates are coalesced
+        self.bus.publish(EventUpdated(2))
+        self.assertEqual(self.received, [])
+
+        self.bus.publish(EventDeleted(2))
+        self.assertEqual(self.received, [[EventUpdated(1), EventUpdated(2), EventDeleted(2)]])
+
+        self.bus.publish(EventUpdated(1))
+        self.bus.flush()
+        self.bus.flush()  # Nothing pending, so no empty batch
+        self.assertEqual(self.received[1:], [[EventUpdated(1)]])
+
+        with self.assertRaises(ValueError):
+            self.bus.subscribe(self.received.append, batch_size=0)
+
+    def test_failing_subscriber(self):
+        def fail(change):
+            raise RuntimeError("subscriber failed")
+
+        self.bus.subscribe(fail)
+        self.bus.subscribe(self.received.append)
+        with redirect_stderr(io.StringIO()):
+            self.bus.publish(EventUpdated(1))
+        self.assertEqual(self.received, [EventUpdated(1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
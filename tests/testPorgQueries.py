@@ -0,0 +1,57 @@
+#!/usr/bin/env python3.5
+import sqlite3
+import unittest
+
+import PorgQueries
+from config import porg_config
+from gen_db import generate as generate_db
+from PorgWrapper import PorgWrapper
+
+
+class TestPorgQueries(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+        self.addCleanup(setattr, p.db_interface.s, 'enable_baked_queries', True)
+
+        self.u1 = p.register_user("bob")
+        self.u2 = p.register_user("alice")
+        self.e1 = p.create_event("picnic", self.u1)
+        self.e2 = p.create_event("party", self.u2)
+        p.create_attendance(self.u2, self.e1, going_status="going", roles=["cook"])
+        p.create_attendance(self.u1, self.e2)
+
+    def reads(self):
+        """Returns the results of each read using PorgQueries."""
+        page, cursor = p.get_roster(self.e1, page_size=1)
+        return [p.get_user_by_username("alice"), p.get_user_by_username("carol"),
+                p.get_attendance(self.u2, self.e1), p.get_attendance(self.u2, self.e2),
+                p.get_all_events(), p.get_curr_events(), p.get_all_event_rows(),
+                p.get_curr_event_rows(), p.get_user_event_rows(self.u1),
+                p.get_event_headcount(self.e2), page,
+                p.get_roster(self.e1, after=cursor, page_size=1), p.get_roles_for_user(self.u2)]
+
+    def test_same_results(self):
+        baked = self.reads()
+        p.db_interface.s.enable_baked_queries = False
+        self.assertEqual(self.reads(), baked)
+
+    def test_cached(self):
+        # Different parameters reuse the same compiled queries
+        self.reads()
+        size = len(PorgQueries.bakery.cache)
+        self.u1, self.u2 = self.u2, self.u1
+        self.e1, self.e2 = self.e2, self.e1
+        self.reads()
+        self.assertEqual(len(PorgQueries.bakery.cache), size)
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,42 @@
 #!/usr/bin/env python3.5
+import itertools
 import sqlite3
 import unittest
 from datetime import datetime, timedelta
 
 from config import porg_config
 from gen_db import generate as generate_db
-from Poorganiser import User, Event, Attendance, Question, Survey, Choice, Response
+from sqlalchemy import event
+from Poorganiser import User, Event, Attendance, Question, Survey, SurveyResult, Choice, Response, \
+    preload
 from PorgWrapper import PorgWrapper
+from PorgCache import VersionTracker
+from PorgEvents import *
 from PorgExceptions import *
+from PorgRows import RosterRow, EventRow, UserEventRow
 
 
 class TestPorgWrapper(unittest.TestCase):
     def setUp(self):
         generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()  # Forget objects loaded from the previous database
 
     def tearDown(self):
         # generate_db(c)  # Generate blank database
         pass
 
+    def count_queries(self):
+        """Returns a list that has each statement executed by p appended to it until the end of
+        the test."""
+        queries = []
+
+        def on_execute(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        event.listen(p.db_interface._engine, 'before_cursor_execute', on_execute)
+        self.addCleanup(event.remove, p.db_interface._engine, 'before_cursor_execute', on_execute)
+        return queries
+
     def test_get_user_by_username(self):
         self.assertIsNone(p.get_user_by_username("bob"))
         self.assertIsNone(p.get_user_by_username("jane"))
@@ -474,6 +493,82 @@ class TestPorgWrapper(unittest.TestCase):
         self.assertIsNone(p.get_attendance(u1, "asdf"))
         self.assertIsNone(p.get_attendance(3, e1))
 
+    def test_event_rows(self):
+        u1 = p.register_user("user 1")
+        u2 = p.register_user("user 2")
+        now = datetime.now()
+        e1 = p.create_event("past", u1, "park", now - timedelta(days=2))
+        e2 = p.create_event("soon", u2, "hall", now + timedelta(days=2))
+        e3 = p.create_event("undated", u1)
+        p.create_attendance(u2, e1, roles=["cook"])
+
+        row = EventRow(e1.get_id(), "past", "park", e1.get_time())
+        self.assertEqual(p.get_all_event_rows(), [row, EventRow(e2.get_id(), "soon", "hall", e2.get_time()),
+                                                  EventRow(e3.get_id(), "undated", None, None)])
+        self.assertEqual(row.name, "past")
+        self.assertEqual([row.id for row in p.get_curr_event_rows()], [e2.get_id(), e3.get_id()])
+        self.assertEqual(p.get_past_event_rows(), [row])
+        self.assertEqual(p.get_past_event_rows(limit=1), [row])
+
+        self.assertEqual(p.get_user_event_rows(u2), [
+            UserEventRow(e1.get_id(), "past", "park", e1.get_time(), "invited", ["cook"]),
+            UserEventRow(e2.get_id(), "soon", "hall", e2.get_time(), "going", ["organiser"])])
+        self.assertEqual([row.going_status for row in p.get_user_event_rows(u1.get_id())], ["going", "going"])
+
+        with self.assertRaises(UserNotFoundError):
+            p.get_user_event_rows(1234)
+
+    def test_get_roster(self):
+        users = [p.register_user("user {}".format(i)) for i in range(7)]
+        e1 = p.create_event("e1", users[0])
+        for i, u in enumerate(users[1:], 1):
+            p.create_attendance(u, e1, going_status="going" if i % 2 else "invited")
+
+        rows, cursor = p.get_roster(e1, page_size=3)
+        self.assertEqual(rows[0], RosterRow(e1.get_attendance_ids()[0], users[0].get_id(), "user 0",
+                                            "going", ["organiser"]))
+        pages = [rows]
+        while cursor:
+            rows, cursor = p.get_roster(e1.get_id(), after=cursor, page_size=3)
+            pages.append(rows)
+        self.assertEqual([[row.username for row in rows] for rows in pages],
+                         [["user 0", "user 1", "user 3"], ["user 5", "user 2", "user 4"], ["user 6"]])
+
+        # A full last page has no cursor after it
+        rows, cursor = p.get_roster(e1, page_size=7)
+        self.assertEqual((len(rows), cursor), (7, None))
+
+        with self.assertRaises(EventNotFoundError):
+            p.get_roster(1234)
+
+    def test_get_roster_page(self):
+        users = [p.register_user("user {}".format(i)) for i in range(5)]
+        e1 = p.create_event("e1", users[0])
+        for u in users[1:]:
+            p.create_attendance(u, e1)
+
+        self.assertEqual([[row.username for row in p.get_roster_page(e1, page, page_size=2)[0]]
+                          for page in [3, 1, 2, 4, 0]],
+                         [["user 4"], ["user 0", "user 1"], ["user 2", "user 3"], [], []])
+        self.assertEqual(p.get_roster_page(e1, 1, page_size=2)[1], 3)
+
+        # Remembered page cursors are dropped when the roster changes
+        p.set_going_status(users[1], e1, "going")
+        self.assertEqual([row.username for row in p.get_roster_page(e1, 2, page_size=2)[0]],
+                         ["user 2", "user 3"])
+        p.delete_attendance(p.get_attendance(users[2], e1))
+        self.assertEqual([row.username for row in p.get_roster_page(e1, 2, page_size=2)[0]],
+                         ["user 3", "user 4"])
+        self.assertEqual(p.get_roster_page(e1, 3, page_size=2), ([], 2))
+
+    def test_get_roster_page_cursors_bounded(self):
+        u = p.register_user("u")
+        events = [p.create_event("e{}".format(i), u) for i in range(5)]
+        p._roster_cursors.max_size = 2
+        for e in events:
+            self.assertEqual([row.username for row in p.get_roster_page(e, 1, page_size=2)[0]], ["u"])
+        self.assertEqual(len(p._roster_cursors), 2)
+
     def test_get_attendances(self):
         # Create some users
         u1 = p.register_user("u1")
@@ -513,6 +608,38 @@ class TestPorgWrapper(unittest.TestCase):
         with self.assertRaises(TypeError):
             p.get_attendances("event 1")
 
+    def test_get_event_headcount(self):
+        # Create some users
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        u3 = p.register_user("u3")
+
+        # Owner is automatically marked as going
+        e1 = p.create_event("e1", u1)
+        self.assertEqual(p.get_event_headcount(e1), {"going": 1})
+
+        p.create_attendance(u2, e1)
+        a3 = p.create_attendance(u3, e1, going_status="not_going")
+        self.assertEqual(p.get_event_headcount(e1), {"going": 1, "invited": 1, "not_going": 1})
+
+        a3.set_going_status("going")
+        p.db_interface.update(a3)
+        self.assertEqual(p.get_event_headcount(e1.get_id()), {"going": 2, "invited": 1})
+
+        # Counts are per event
+        e2 = p.create_event("e2", u2)
+        self.assertEqual(p.get_event_headcount(e2), {"going": 1})
+
+        p.delete_attendance(a3)
+        self.assertEqual(p.get_event_headcount(e1), {"going": 1, "invited": 1})
+
+        # Try get headcount for events that don't exist
+        with self.assertRaises(EventNotFoundError):
+            p.get_event_headcount(1234)
+
+        with self.assertRaises(EventNotFoundError):
+            p.get_event_headcount(Event("nonexistant event", u1.get_id()))
+
     def test_create_attendance(self):
         # Create some users
         u1 = p.register_user("u1")
@@ -622,6 +749,102 @@ class TestPorgWrapper(unittest.TestCase):
         with self.assertRaises(AttendanceNotFoundError):
             p.delete_attendance(Attendance(u1.get_id(), e1.get_id()))
 
+    def test_add_role(self):
+        # Create some users
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+
+        e1 = p.create_event("e1", u1)
+        a2 = p.create_attendance(u2, e1, roles=["driver"])
+
+        a2 = p.add_role(u2, e1, "cook")
+        self.assertEqual(a2.get_roles(), ["driver", "cook"])
+        self.assertEqual(p.get_attendees_by_role(e1, "cook"), [u2])
+
+        # Adding an existing role does nothing
+        p.add_role(u2.get_id(), e1.get_id(), "cook")
+        self.assertEqual(a2.get_roles(), ["driver", "cook"])
+        self.assertEqual(p.get_attendees_by_role(e1, "cook"), [u2])
+
+        # Try add roles to attendances that don't exist
+        u3 = p.register_user("u3")
+        with self.assertRaises(AttendanceNotFoundError):
+            p.add_role(u3, e1, "cook")
+
+        with self.assertRaises(AttendanceNotFoundError):
+            p.add_role(u1, 1234, "cook")
+
+    def test_remove_role(self):
+        # Create some users
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+
+        e1 = p.create_event("e1", u1)
+        a2 = p.create_attendance(u2, e1, roles=["driver", "cook"])
+
+        a2 = p.remove_role(u2, e1, "driver")
+        self.assertEqual(a2.get_roles(), ["cook"])
+        self.assertEqual(p.get_attendees_by_role(e1, "driver"), [])
+        self.assertEqual(p.get_attendees_by_role(e1, "cook"), [u2])
+
+        # Removing a role the user does not have does nothing
+        p.remove_role(u2, e1, "driver")
+        self.assertEqual(a2.get_roles(), ["cook"])
+
+        p.remove_role(u1, e1, "organiser")
+        self.assertEqual(p.get_attendees_by_role(e1, "organiser"), [])
+
+        # Try remove roles from attendances that don't exist
+        u3 = p.register_user("u3")
+        with self.assertRaises(AttendanceNotFoundError):
+            p.remove_role(u3, e1, "cook")
+
+    def test_get_attendees_by_role(self):
+        # Create some users
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        u3 = p.register_user("u3")
+
+        e1 = p.create_event("e1", u1)
+        e2 = p.create_event("e2", u2)
+        self.assertEqual(p.get_attendees_by_role(e1, "organiser"), [u1])
+        self.assertEqual(p.get_attendees_by_role(e2, "organiser"), [u2])
+
+        p.create_attendance(u2, e1, roles=["volunteer"])
+        a3 = p.create_attendance(u3, e1, roles=["volunteer", "volunteer"])
+        self.assertEqual(p.get_attendees_by_role(e1, "volunteer"), [u2, u3])
+        self.assertEqual(p.get_attendees_by_role(e2, "volunteer"), [])
+        self.assertEqual(p.get_attendees_by_role(e1, "nonexistant role"), [])
+
+        # Roles are removed along with their attendance
+        p.delete_attendance(a3)
+        self.assertEqual(p.get_attendees_by_role(e1, "volunteer"), [u2])
+
+        p.delete_event(e1)
+        with self.assertRaises(EventNotFoundError):
+            p.get_attendees_by_role(e1, "volunteer")
+
+    def test_get_roles_for_user(self):
+        # Create some users
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        self.assertEqual(p.get_roles_for_user(u1), {})
+
+        e1 = p.create_event("e1", u1)
+        e2 = p.create_event("e2", u2)
+        p.create_attendance(u1, e2)
+        self.assertEqual(p.get_roles_for_user(u1), {e1.get_id(): ["organiser"]})
+
+        p.add_role(u1, e1, "cook")
+        p.add_role(u1, e2, "driver")
+        self.assertEqual(p.get_roles_for_user(u1.get_id()),
+                         {e1.get_id(): ["organiser", "cook"], e2.get_id(): ["driver"]})
+        self.assertEqual(p.get_roles_for_user(u2), {e2.get_id(): ["organiser"]})
+
+        # Try get roles for users that don't exist
+        with self.assertRaises(UserNotFoundError):
+            p.get_roles_for_user(1234)
+
     def test_create_choice(self):
         u1 = p.register_user("user1")
         q = p.create_question(u1, "Hello?", "free")
@@ -715,14 +938,15 @@ class TestPorgWrapper(unittest.TestCase):
 
     def test_create_response(self):
         u1 = p.register_user("USER 1")
-        q1 = p.create_question(u1, "QUESTION?", "free")
-        r1 = p.create_response(u1, q1)
+        q1 = p.create_question(u1, "QUESTION?", "choose_many")
+        c1 = p.create_choice(q1, "choice 1")
+        r1 = p.create_response(u1, q1, choice_ids=[c1.get_id()])
 
         self.assertEqual(r1.get_id(), 1)
         self.assertEqual(r1.get_responder_id(), u1.get_id())
         self.assertEqual(r1.get_question_id(), q1.get_id())
         self.assertEqual(r1.get_response_text(), None)
-        self.assertEqual(r1.get_choice_ids(), [])
+        self.assertEqual(r1.get_choice_ids(), [c1.get_id()])
 
         # Check response_id was added to User.response_ids
         self.assertEqual(u1.get_response_ids(), [r1.get_id()])
@@ -730,12 +954,12 @@ class TestPorgWrapper(unittest.TestCase):
         # Check response_id was added to Question.response_ids
         self.assertEqual(q1.get_response_ids(), [r1.get_id()])
 
-        r2 = p.create_response(u1, q1, response_text="lololol")
+        r2 = p.create_response(u1, q1, response_text="lololol", choice_ids=[c1.get_id()])
         self.assertEqual(r2.get_id(), 2)
         self.assertEqual(r2.get_responder_id(), u1.get_id())
         self.assertEqual(r2.get_question_id(), q1.get_id())
         self.assertEqual(r2.get_response_text(), "lololol")
-        self.assertEqual(r2.get_choice_ids(), [])
+        self.assertEqual(r2.get_choice_ids(), [c1.get_id()])
 
         # Check response_id was added to User.response_ids
         self.assertEqual(u1.get_response_ids(), [r1.get_id(), r2.get_id()])
@@ -743,15 +967,15 @@ class TestPorgWrapper(unittest.TestCase):
         # Check response_id was added to Question.response_ids
         self.assertEqual(q1.get_response_ids(), [r1.get_id(), r2.get_id()])
 
-        q2 = p.create_question(u1, "trick?", "free")
-        c1 = p.create_choice(q1, "choice 1")
+        q2 = p.create_question(u1, "trick?", "choose_many")
         c2 = p.create_choice(q2, "choice 2")
-        r3 = p.create_response(u1, q1, response_text="k", choice_ids=[c1.get_id()])
+        c3 = p.create_choice(q1, "choice 3")
+        r3 = p.create_response(u1, q1, response_text="k", choice_ids=[c3.get_id()])
         self.assertEqual(r3.get_id(), 3)
         self.assertEqual(r3.get_responder_id(), u1.get_id())
         self.assertEqual(r3.get_question_id(), q1.get_id())
         self.assertEqual(r3.get_response_text(), "k")
-        self.assertEqual(r3.get_choice_ids(), [c1.get_id()])
+        self.assertEqual(r3.get_choice_ids(), [c3.get_id()])
 
         # Check response_id was added to User.response_ids
         self.assertEqual(u1.get_response_ids(), [r1.get_id(), r2.get_id(), r3.get_id()])
@@ -763,6 +987,15 @@ class TestPorgWrapper(unittest.TestCase):
         with self.assertRaises(InvalidQuestionIdError):
             p.create_response(u1, q1, response_text="k", choice_ids=[c1.get_id(), c2.get_id()])
 
+        # Test adding a choice that doesn't exist
+        with self.assertRaises(ChoiceNotFoundError):
+            p.create_response(u1, q1, choice_ids=[1234])
+
+        # Invalid responses are not added
+        with self.assertRaises(InvalidResponseError):
+            p.create_response(u1, q1, response_text="no choice")
+        self.assertEqual(q1.get_response_ids(), [r1.get_id(), r2.get_id(), r3.get_id()])
+
         # Test creation with non-existant responders (User)
         with self.assertRaises(UserNotFoundError):
             p.create_response(User("nonexistant user"), q1)
@@ -777,6 +1010,177 @@ class TestPorgWrapper(unittest.TestCase):
         with self.assertRaises(QuestionNotFoundError):
             p.create_response(u1, Question(1, "lol?", "free"))
 
+
+    def test_clone_survey(self):
+        u1 = p.register_user("user 1")
+        u2 = p.register_user("user 2")
+        e1 = p.create_event("weekly", u2)
+        s1 = p.create_survey("food", u1)
+        q1 = p.create_question(u1, "bring?", "choose_many", survey_obj=s1)
+        q2 = p.create_question(u1, "comments?", "free", survey_obj=s1)
+        c1 = p.create_choice(q1, "cake")
+        c2 = p.create_choice(q1, "chips")
+        p.create_response(u1, q1, choice_ids=[c2.get_id()])
+        q3 = p.create_question(u1, "gone?", "free")
+        p.delete_question(q3)
+
+        # Questions and choices are each copied by one statement
+        queries = self.count_queries()
+        s2 = p.clone_survey(s1, event_obj=e1, name="food again")
+        self.assertEqual(len([q for q in queries if q.startswith('INSERT INTO questions')]), 1)
+        self.assertEqual(len([q for q in queries if q.startswith('INSERT INTO choices')]), 1)
+        self.assertNotEqual(s2.get_id(), s1.get_id())
+        self.assertEqual(s2.get_name(), "food again")
+        self.assertEqual(s2.get_owner_id(), u1.get_id())
+        self.assertEqual(s2.get_event_id(), e1.get_id())
+        self.assertEqual(e1.get_survey_ids(), [s2.get_id()])
+        self.assertEqual(u1.get_survey_ids(), [s1.get_id(), s2.get_id()])
+
+        questions = s2.get_questions()
+        self.assertEqual([(q.get_question(), q.get_question_type(), q.get_survey_id(), q.get_response_ids())
+                          for q in questions],
+                         [("bring?", "choose_many", s2.get_id(), []), ("comments?", "free", s2.get_id(), [])])
+        self.assertGreater(questions[0].get_id(), q3.get_id())  # Deleted ids aren't reused
+        self.assertEqual(set(p.search("bring")), {q1, questions[0]})
+        self.assertEqual(u1.get_question_ids(), [q1.get_id(), q2.get_id()] + s2.get_question_ids())
+        self.assertEqual([c.get_choice() for c in questions[0].get_choices()], ["cake", "chips"])
+        self.assertEqual({c.get_question_id() for c in questions[0].get_choices()}, {questions[0].get_id()})
+        self.assertEqual(questions[1].get_allowed_choice_ids(), [])
+
+        # The original is unchanged, and the copy takes responses of its own
+        self.assertEqual(q1.get_allowed_choice_ids(), [c1.get_id(), c2.get_id()])
+        p.create_response(u2, questions[0], choice_ids=[questions[0].get_allowed_choice_ids()[0]])
+        self.assertEqual(len(q1.get_response_ids()), 1)
+
+        # Check the changes were committed
+        p.db_interface.s.expire_all()
+        self.assertEqual(p.db_interface.get_obj(s2, Survey).get_question_ids(),
+                         [q.get_id() for q in questions])
+
+        with self.assertRaises(SurveyNotFoundError):
+            p.clone_survey(1234)
+
+        with self.assertRaises(EventNotFoundError):
+            p.clone_survey(s1, event_obj=1234)
+
+    def test_instantiate_template(self):
+        u1 = p.register_user("user 1")
+        u2 = p.register_user("user 2")
+        template = p.create_survey("template", u1)
+        q1 = p.create_question(u1, "pick one", "choose_one", survey_obj=template)
+        p.create_choice(q1, "a")
+        e1 = p.create_event("weekly", u2)
+
+        s1 = p.instantiate_template(template, e1.get_id())
+        self.assertEqual(s1.get_name(), "template")
+        self.assertEqual(s1.get_owner_id(), u2.get_id())
+        self.assertEqual(e1.get_surveys(), [s1])
+        self.assertEqual(u2.get_question_ids(), s1.get_question_ids())
+        self.assertEqual([c.get_choice() for c in s1.get_questions()[0].get_choices()], ["a"])
+
+        # An empty survey can be cloned too
+        s2 = p.instantiate_template(p.create_survey("empty", u1), e1)
+        self.assertEqual(s2.get_question_ids(), [])
+
+    def test_submit_survey(self):
+        u1 = p.register_user("user 1")
+        u2 = p.register_user("user 2")
+        s1 = p.create_survey("s1", u1)
+        q1 = p.create_question(u1, "comments?", "free", survey_obj=s1)
+        q2 = p.create_question(u1, "pick one", "choose_one", survey_obj=s1)
+        q3 = p.create_question(u1, "pick some", "choose_many", survey_obj=s1)
+        q4 = p.create_question(u1, "elsewhere", "free")
+        c1 = p.create_choice(q2, "a")
+        c2 = p.create_choice(q3, "b")
+        c3 = p.create_choice(q3, "c")
+
+        # Nothing is added if any answer is invalid
+        responses, errors = p.submit_survey(u2, s1, {q1: "", q2: [c1.get_id()], q3: [c1.get_id()],
+                                                     q4.get_id(): "hi"})
+        self.assertEqual(responses, [])
+        self.assertEqual(sorted(errors), [q1.get_id(), q3.get_id(), q4.get_id()])
+        self.assertIsInstance(errors[q1.get_id()], InvalidResponseError)
+        self.assertIsInstance(errors[q3.get_id()], InvalidQuestionIdError)
+        self.assertIsInstance(errors[q4.get_id()], InvalidQuestionIdError)
+        self.assertEqual(u2.get_response_ids(), [])
+        self.assertEqual(p.db_interface.s.query(Response).count(), 0)
+
+        responses, errors = p.submit_survey(u2, s1, {q1.get_id(): "hi", q2: [c1.get_id()],
+                                                     q3: ("both", [c2.get_id(), c3.get_id()])})
+        self.assertEqual(errors, {})
+        self.assertEqual([(r.get_question_id(), r.get_response_text(), r.get_choice_ids()) for r in responses],
+                         [(q1.get_id(), "hi", []), (q2.get_id(), None, [c1.get_id()]),
+                          (q3.get_id(), "both", [c2.get_id(), c3.get_id()])])
+        self.assertEqual(u2.get_response_ids(), [r.get_id() for r in responses])
+        self.assertEqual(q3.get_response_ids(), [responses[2].get_id()])
+
+        # Check the changes were committed
+        p.db_interface.s.expire_all()
+        self.assertEqual(p.get_user_by_username("user 2").get_response_ids(), [r.get_id() for r in responses])
+        self.assertEqual(p.db_interface.get_obj(q1, Question).get_response_ids(), [responses[0].get_id()])
+
+        # The same question given as a Question and as its id is only answered once
+        responses, errors = p.submit_survey(u1, s1, {q1: "one", q1.get_id(): "two"})
+        self.assertEqual(responses, [])
+        self.assertEqual(list(errors), [q1.get_id()])
+        self.assertIsInstance(errors[q1.get_id()], InvalidResponseError)
+        self.assertEqual(u1.get_response_ids(), [])
+
+        p.close_survey(s1)
+        with self.assertRaises(SurveyClosedError):
+            p.submit_survey(u1, s1, {q1: "late"})
+
+        with self.assertRaises(SurveyNotFoundError):
+            p.submit_survey(u1, 1234, {})
+
+    def test_transaction(self):
+        db = p.db_interface
+        with db.transaction():
+            u1 = p.register_user("user 1")
+            with db.transaction():
+                p.register_user("user 2")
+            self.assertIsNotNone(u1.get_id())  # Flushed, not committed
+        db.s.rollback()  # Nothing to roll back once the outermost block has committed
+        self.assertEqual(db.s.query(User).count(), 2)
+
+        with self.assertRaises(UserRegisteredError):
+            with db.transaction():
+                p.register_user("user 3")
+                with db.transaction():
+                    p.register_user("user 1")
+        self.assertEqual([u.get_username() for u in db.s.query(User).order_by(User.id)], ["user 1", "user 2"])
+
+    def test_validate_response(self):
+        u1 = p.register_user("user 1")
+        free = p.create_question(u1, "comments?", "free")
+        one = p.create_question(u1, "pick one", "choose_one")
+        many = p.create_question(u1, "pick some", "choose_many")
+        c1 = p.create_choice(one, "a")
+        c2 = p.create_choice(one, "b")
+        c3 = p.create_choice(many, "c")
+        c4 = p.create_choice(many, "d")
+
+        p.validate_response(free, "text")
+        p.validate_response(one, choice_ids=[c2.get_id()])
+        p.validate_response(many, "comment", [c3.get_id(), c4.get_id()])
+
+        for question, response_text, choice_ids in [(free, None, []), (free, "", []),
+                                                    (free, "text", [c1.get_id()]),
+                                                    (one, None, []), (one, None, [c1.get_id(), c2.get_id()]),
+                                                    (many, "text", []), (many, None, [c3.get_id(), c3.get_id()]),
+                                                    (one, None, [str(c1.get_id())])]:
+            with self.assertRaises(InvalidResponseError):
+                p.validate_response(question, response_text, choice_ids)
+
+        with self.assertRaises(InvalidQuestionIdError):
+            p.validate_response(one, choice_ids=[c3.get_id()])
+
+        with self.assertRaises(ChoiceNotFoundError):
+            p.validate_response(many, choice_ids=[c3.get_id(), 1234])
+
+        with self.assertRaises(QuestionNotFoundError):
+            p.validate_response(1234, "text")
+
     def test_create_survey(self):
         u1 = p.register_user("Bob")
         s = p.create_survey("survey 1", u1)
@@ -949,13 +1353,15 @@ class TestPorgWrapper(unittest.TestCase):
         u1 = p.register_user("USER 1")
         self.assertEqual(u1.get_response_ids(), [])
 
-        q1 = p.create_question(u1, "QUESTION?", "free")
-        r1 = p.create_response(u1, q1)
+        q1 = p.create_question(u1, "QUESTION?", "choose_many")
+        c1 = p.create_choice(q1, "choice 1")
+        c2 = p.create_choice(q1, "choice 2")
+        r1 = p.create_response(u1, q1, choice_ids=[c1.get_id()])
 
         # Check response_id was added to Question.response_ids
         self.assertEqual(q1.get_response_ids(), [r1.get_id()])
 
-        r2 = p.create_response(u1, q1, response_text="lololol")
+        r2 = p.create_response(u1, q1, response_text="lololol", choice_ids=[c2.get_id()])
         # Check User.response_ids was updated
         self.assertEqual(u1.get_response_ids(), [r1.get_id(), r2.get_id()])
 
@@ -969,8 +1375,6 @@ class TestPorgWrapper(unittest.TestCase):
         # Check response_id was removed from Question.response_ids
         self.assertEqual(q1.get_response_ids(), [r1.get_id()])
 
-        c1 = p.create_choice(q1, "choice 1")
-        c2 = p.create_choice(q1, "choice 2")
         r3 = p.create_response(u1, q1, response_text="k", choice_ids=[c1.get_id(), c2.get_id()])
 
         # Check response_id was added to Question.response_ids
@@ -1013,12 +1417,12 @@ class TestPorgWrapper(unittest.TestCase):
         self.assertIsNone(p.db_interface.get_obj(s, Survey))
 
 
-        q1 = p.create_question(u1, "q1", "free")
+        q1 = p.create_question(u1, "q1", "choose_one")
         q2 = p.create_question(u1.get_id(), "q2", "free")
         c1 = p.create_choice(q1, "choice 1")
-        r1 = p.create_response(u1, q1)
+        r1 = p.create_response(u1, q1, choice_ids=[c1.get_id()])
         r2 = p.create_response(u2, q1, choice_ids=[c1.get_id()])
-        r3 = p.create_response(u2, q2)
+        r3 = p.create_response(u2, q2, "answer")
         e1 = p.create_event("event 1", u1)
         s = p.create_survey("s", u1, question_ids=[q1.get_id(), q2.get_id()], event_obj=e1.get_id())
         self.assertEqual(u1.get_survey_ids(), [s.get_id()])
@@ -1044,14 +1448,221 @@ class TestPorgWrapper(unittest.TestCase):
         with self.assertRaises(SurveyNotFoundError):
             p.delete_survey(9923)
 
+        # Event surveys are removed from the event
+        s = p.create_survey("s", u1, event_obj=e1)
+        p.delete_survey(s)
+        self.assertEqual(e1.get_survey_ids(), [])
+
+    def test_soft_delete_event(self):
+        u1 = p.register_user("Bob")
+        u2 = p.register_user("Jane")
+        e1 = p.create_event("event 1", u1, time=datetime.now() + timedelta(days=1))
+        e2 = p.create_event("event 2", u2)
+        a2 = p.create_attendance(u2, e1, roles=["cook"])
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+        q1 = p.create_question(u1, "q1", "free", survey_obj=s1)
+        r1 = p.create_response(u2, q1, "answer")
+
+        changes = []
+        p.events.subscribe(changes.append)
+        p.delete_event(e1, soft=True)
+        self.assertEqual(changes, [EventDeleted(e1.get_id())])
+
+        # Hidden straight away, but nothing else is deleted yet
+        self.assertIsNone(p.get_event(e1.get_id()))
+        with self.assertRaises(EventNotFoundError):
+            p.delete_event(e1.get_id())
+        self.assertEqual(p.get_all_events(), [e2])
+        self.assertEqual(p.get_curr_events(), [e2])
+        self.assertEqual([row.id for row in p.get_all_event_rows()], [e2.get_id()])
+        self.assertEqual([row.id for row in p.get_user_event_rows(u2)], [e2.get_id()])
+        self.assertEqual(p.get_attendances(u2), [p.get_attendance(u2, e2)])
+        self.assertEqual(p.get_roles_for_user(u2), {e2.get_id(): ["organiser"]})
+        self.assertEqual(p.get_events_by_user(u1), [])
+        self.assertEqual(p.search("event"), [e2])
+        self.assertEqual(p.search("q1"), [])  # The event's questions are hidden with it
+        with self.assertRaises(QuestionNotFoundError):
+            p.create_response(u1, q1, "late")
+        with self.assertRaises(SurveyNotFoundError):
+            p.submit_survey(u1, s1, {q1: "late"})
+        self.assertEqual(u1.get_events_organised_ids(), [])
+        self.assertEqual(u2.get_events_attending_ids(), [e2.get_id(), e1.get_id()])
+        self.assertIsNotNone(p.db_interface.get_obj(a2, Attendance))
+
+        # Collected in batches, surveys after their event
+        self.assertEqual(p.collect_garbage(limit=1), 1)
+        self.assertIsNone(p.db_interface.get_obj(s1, Survey))  # Soft deleted by the first batch
+        self.assertEqual(p.collect_garbage(), 5)  # Attendance, event, response, question, survey
+        self.assertEqual(p.collect_garbage(), 0)
+
+        s = p.db_interface.s
+        self.assertIsNone(s.query(Event).get(e1.get_id()))
+        self.assertIsNone(s.query(Survey).get(s1.get_id()))
+        self.assertIsNone(s.query(Response).get(r1.get_id()))
+        self.assertEqual(s.query(Attendance).count(), 1)
+        self.assertEqual(u1.get_events_attending_ids(), [])
+        self.assertEqual(u2.get_events_attending_ids(), [e2.get_id()])
+        self.assertEqual(u2.get_response_ids(), [])
+        self.assertEqual(u1.get_question_ids(), [])
+
+    def test_soft_deleted_organised_event(self):
+        u1 = p.register_user("Bob")
+        e1 = p.create_event("event 1", u1)
+        e2 = p.create_event("event 2", u1)
+        p.delete_event(e1, soft=True)
+
+        # Still listed, as by a partial failure or a concurrent soft delete
+        u1.add_event_organised(e1)
+        p.db_interface.update(u1)
+        self.assertEqual(p.get_events_by_user(u1), [e2])
+
+        p.unregister_user(u1)
+        self.assertIsNone(p.get_event(e2.get_id()).get_owner_id())
+        self.assertEqual(p.db_interface.s.query(Attendance).count(), 0)
+        while p.collect_garbage():
+            pass
+        self.assertEqual(p.get_all_events(), [e2])
+
+    def test_hard_delete_with_soft_deleted_attendee(self):
+        u1 = p.register_user("Bob")
+        u2 = p.register_user("Alice")
+        u3 = p.register_user("Carol")
+        e1 = p.create_event("event 1", u1)
+        e2 = p.create_event("event 2", u1)
+        p.create_attendance(u2, e1)
+        p.create_attendance(u3, e1)
+        p.create_attendance(u2, e2)
+        p.unregister_user(u2, soft=True)
+
+        p.delete_event(e1, soft=False)
+        self.assertEqual(p.get_all_events(), [e2])
+        self.assertEqual(p.get_events_by_user(u3), [])
+        with p.db_interface.showing_deleted():
+            self.assertEqual(p.db_interface.get_obj(u2.get_id(), User).get_events_attending_ids(),
+                             [e2.get_id()])
+
+        p.unregister_user(u1, delete_events=True)
+        self.assertEqual(p.get_all_events(), [])
+        self.assertEqual(p.db_interface.s.query(Attendance).count(), 0)
+        while p.collect_garbage():
+            pass
+        self.assertEqual(p.db_interface.s.query(User).all(), [u3])
+
+    def test_soft_delete_survey(self):
+        u1 = p.register_user("Bob")
+        e1 = p.create_event("event 1", u1)
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+        q1 = p.create_question(u1, "q1", "choose_one", survey_obj=s1)
+        c1 = p.create_choice(q1, "c1")
+        p.create_response(u1, q1, choice_ids=[c1.get_id()])
+        p.close_survey(s1)
+
+        p.delete_survey(s1, soft=True)
+        self.assertIsNone(p.db_interface.get_obj(s1, Survey))
+        self.assertEqual(p.search("q1"), [])
+        self.assertEqual(p.search("c1"), [])
+        with self.assertRaises(QuestionNotFoundError):
+            p.create_response(u1, q1, choice_ids=[c1.get_id()])
+        self.assertEqual(p.get_surveys(e1), [])
+        self.assertEqual(p.get_surveys(u1), [])
+        self.assertEqual(p.get_questions(u1), [q1])  # Until collected
+
+        self.assertEqual(p.collect_garbage(), 3)
+        s = p.db_interface.s
+        for obj_type in [Survey, SurveyResult, Question, Choice, Response]:
+            self.assertEqual(s.query(obj_type).count(), 0)
+        self.assertEqual(u1.get_question_ids(), [])
+        self.assertEqual(u1.get_response_ids(), [])
+
+    def test_collect_garbage_dangling_ids(self):
+        u1 = p.register_user("Bob")
+        e1 = p.create_event("event 1", u1)
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+        q1 = p.create_question(u1, "q1", "choose_one", survey_obj=s1)
+        c1 = p.create_choice(q1, "c1")
+        p.create_response(u1, q1, choice_ids=[c1.get_id()])
+
+        # Ids of rows that don't exist, as left by a partial failure
+        e1.add_attendance_id(999)
+        s1.add_question_id(999)
+        q1.add_response_id(999)
+        q1.add_allowed_choice_id(999)
+        u1.add_question_id(998)
+        for o in [e1, s1, q1, u1]:
+            p.db_interface.update(o)
+
+        p.delete_event(e1, soft=True)
+        p.unregister_user(u1, soft=True)
+        while p.collect_garbage(limit=2):
+            pass
+
+        s = p.db_interface.s
+        for obj_type in [User, Event, Attendance, Survey, Question, Choice, Response]:
+            self.assertEqual(s.query(obj_type).count(), 0)
+
+    def test_soft_unregister_user(self):
+        u1 = p.register_user("Bob")
+        u2 = p.register_user("Jane")
+        e1 = p.create_event("event 1", u1)
+        e2 = p.create_event("event 2", u2)
+        e3 = p.create_event("event 3", u1)
+        p.create_attendance(u1, e2, roles=["cook"])
+        s1 = p.create_survey("s1", u1, event_obj=e2)
+        q1 = p.create_question(u1, "q1", "free", survey_obj=s1)
+        p.create_response(u2, q1, "answer")
+        r2 = p.create_response(u1, q1, "mine")
+        u1_id = u1.get_id()
+
+        p.unregister_user(u1, soft=True)
+        self.assertIsNone(p.get_user_by_username("Bob"))
+        self.assertIsNone(p.db_interface.get_obj(u1_id, User))
+        self.assertEqual([row.user_id for row in p.get_roster(e2)[0]], [u2.get_id()])
+        self.assertEqual(p.get_attendees_by_role(e2, "cook"), [])
+        self.assertEqual(p.get_event_headcount(e2), {"going": 1})
+        self.assertEqual(p.get_attendances(e2), [p.get_attendance(u2, e2)])
+        rows, page_count = p.get_roster_page(e2, 1, page_size=1)
+        self.assertEqual(([row.user_id for row in rows], page_count), ([u2.get_id()], 1))
+
+        # The username can be registered again straight away
+        u3 = p.register_user("Bob")
+        self.assertNotEqual(u3.get_id(), u1_id)
+
+        while p.collect_garbage(limit=2):
+            pass
+        self.assertIsNone(p.db_interface.s.query(User).get(u1_id))
+        self.assertEqual([e.get_owner_id() for e in p.get_all_events()], [None, u2.get_id(), None])
+        self.assertEqual(p.get_attendances(e2), [p.get_attendance(u2, e2)])
+        self.assertIsNone(p.db_interface.get_obj(s1, Survey))
+        self.assertEqual(e2.get_survey_ids(), [])
+        self.assertEqual(u2.get_response_ids(), [])
+        self.assertIsNone(p.db_interface.get_obj(r2, Response))  # Deleted with the user's question
+
+        # Organised events can be soft deleted with the user
+        p.unregister_user(u2, delete_events=True, soft=True)
+        self.assertEqual([e.get_id() for e in p.get_all_events()], [e1.get_id(), e3.get_id()])
+
+    def test_soft_unregister_user_roster(self):
+        u1 = p.register_user("Bob")
+        e1 = p.create_event("event 1", u1)
+        users = [p.register_user(name) for name in ["Jane", "Sam", "Ann"]]
+        for u in users:
+            p.create_attendance(u, e1)
+        p.unregister_user(users[0], soft=True)
+
+        # Pages are found without counting the soft deleted user
+        pages = [p.get_roster_page(e1, page, page_size=1) for page in [1, 2, 3, 4]]
+        self.assertEqual([[row.user_id for row in rows] for rows, page_count in pages],
+                         [[u1.get_id()], [users[1].get_id()], [users[2].get_id()], []])
+        self.assertEqual({page_count for rows, page_count in pages}, {3})
+
     def test_get_responder(self):
         u1 = p.register_user("user 1")
         u2 = p.register_user("user 2")
 
-        q1 = p.create_question(u1, "question 1", "free")
+        q1 = p.create_question(u1, "question 1", "choose_one")
         c1 = p.create_choice(q1, "choice 1")
 
-        r1 = p.create_response(u1, q1, "ceebs")
+        r1 = p.create_response(u1, q1, "ceebs", choice_ids=[c1.get_id()])
         r2 = p.create_response(u2, q1, "nup", choice_ids=[c1.get_id()])
 
         self.assertEqual(p.get_responder(r1), u1)
@@ -1068,11 +1679,12 @@ class TestPorgWrapper(unittest.TestCase):
         u1 = p.register_user("user 1")
         u2 = p.register_user("user 2")
 
-        q1 = p.create_question(u1, "question 1", "free")
+        q1 = p.create_question(u1, "question 1", "choose_many")
+        q2 = p.create_question(u1, "question 2", "free")
         c1 = p.create_choice(q1, "choice 1")
         c2 = p.create_choice(q1, "choice 2")
 
-        r1 = p.create_response(u1, q1, "ceebs")
+        r1 = p.create_response(u1, q2, "ceebs")
         r2 = p.create_response(u2, q1, "nup", choice_ids=[c1.get_id()])
         r2.add_choice_id(c2)
         p.db_interface.update(r2)
@@ -1108,13 +1720,13 @@ class TestPorgWrapper(unittest.TestCase):
         u1 = p.register_user("user 1")
         u2 = p.register_user("user 2")
 
-        q1 = p.create_question(u1, "question 1", "free")
+        q1 = p.create_question(u1, "question 1", "choose_one")
         self.assertEqual(p.get_responses(q1), [])
         self.assertEqual(p.get_responses(u1), [])
         self.assertEqual(p.get_responses(u2), [])
 
         c1 = p.create_choice(q1, "choice 1")
-        r1 = p.create_response(u1, q1, "ceebs")
+        r1 = p.create_response(u1, q1, "ceebs", choice_ids=[c1.get_id()])
         r2 = p.create_response(u2, q1, "nup", choice_ids=[c1.get_id()])
         self.assertEqual(p.get_responses(q1), [r1, r2])
         self.assertEqual(p.get_responses(u1), [r1])
@@ -1250,6 +1862,462 @@ class TestPorgWrapper(unittest.TestCase):
         self.assertEqual(p.get_surveys(e2), [s4])
         self.assertEqual(p.get_surveys(e3), [s5])
 
+    def test_search(self):
+        u1 = p.register_user("u1")
+        self.assertEqual(p.search("picnic"), [])
+
+        e1 = p.create_event("Summer picnic", u1, location="Hyde Park")
+        e2 = p.create_event("Board games", u1, location="Picnic area")
+        s1 = p.create_survey("Picnic food survey", u1, event_obj=e1)
+        q1 = p.create_question(u1, "What should we bring?", "choose_one", survey_obj=s1)
+        c1 = p.create_choice(q1, "Picnic blanket")
+        c2 = p.create_choice(q1, "Sandwiches")
+
+        # Check every object type is searchable
+        self.assertEqual(set(p.search("picnic")), {e1, e2, s1, c1})
+        self.assertEqual(p.search("hyde"), [e1])
+        self.assertEqual(p.search("bring"), [q1])
+        self.assertEqual(p.search("sandwiches"), [c2])
+
+        # Words are prefix matched and must all be present
+        self.assertEqual(p.search("sandw"), [c2])
+        self.assertEqual(p.search("summer pic"), [e1])
+        self.assertEqual(p.search("summer board"), [])
+
+        # Query syntax in user input is treated as plain text
+        self.assertEqual(p.search('"picnic" OR'), [])
+        self.assertEqual(p.search("NOT"), [])
+        self.assertEqual(set(p.search("picnic*")), {e1, e2, s1, c1})
+        self.assertEqual(p.search("   "), [])
+
+        # Restrict results by type and limit
+        self.assertEqual(set(p.search("picnic", types=[Event])), {e1, e2})
+        self.assertEqual(set(p.search("picnic", types=[Survey, Choice])), {s1, c1})
+        self.assertEqual(len(p.search("picnic", limit=2)), 2)
+        self.assertEqual(p.search("picnic", types=[]), [])
+
+        with self.assertRaises(TypeError):
+            p.search("picnic", types=[User])
+
+        # Check index follows updates and deletes
+        e2.set_name("Chess club")
+        e2.set_location("Library")
+        p.db_interface.update(e2)
+        self.assertEqual(p.search("chess"), [e2])
+        self.assertEqual(set(p.search("picnic")), {e1, s1, c1})
+
+        p.delete_event(e1)
+        self.assertEqual(p.search("picnic"), [])
+        self.assertEqual(p.search("sandwiches"), [])
+
+    def test_search_soft_deleted(self):
+        u1 = p.register_user("u1")
+        # The live event ranks last, as its text is the longest
+        events = [p.create_event("picnic", u1, location="lake") for i in range(3)] + \
+            [p.create_event("picnic and board games", u1, location="in the park")]
+        s1 = p.create_survey("picnic", u1, event_obj=events[0])
+        q1 = p.create_question(u1, "picnic question", "choose_one", survey_obj=s1)
+        p.create_choice(q1, "picnic")
+        for e in events[:3]:
+            p.delete_event(e, soft=True)
+
+        # Hidden matches don't take the place of live ones within the limit
+        self.assertEqual(p.search("picnic", limit=1), [events[3]])
+        self.assertEqual(p.search("picnic"), [events[3]])
+
+    def test_related_accessors(self):
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        e1 = p.create_event("e1", u1)
+        a2 = p.create_attendance(u2, e1)
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+        q1 = p.create_question(u1, "q1", "choose_one", survey_obj=s1)
+        c1 = p.create_choice(q1, "c1")
+        c2 = p.create_choice(q1, "c2")
+        r1 = p.create_response(u2, q1, choice_ids=[c2.get_id()])
+
+        a1 = p.get_attendance(u1, e1)
+        self.assertEqual(e1.get_owner(), u1)
+        self.assertEqual(e1.get_attendances(), [a1, a2])
+        self.assertEqual(e1.get_surveys(), [s1])
+        self.assertEqual(u1.get_events_organised(), [e1])
+        self.assertEqual(u2.get_events_attending(), [e1])
+        self.assertEqual(u1.get_surveys(), [s1])
+        self.assertEqual(u1.get_questions(), [q1])
+        self.assertEqual(u2.get_responses(), [r1])
+        self.assertEqual(s1.get_owner(), u1)
+        self.assertEqual(s1.get_event(), e1)
+        self.assertEqual(s1.get_questions(), [q1])
+        self.assertEqual(q1.get_owner(), u1)
+        self.assertEqual(q1.get_survey(), s1)
+        self.assertEqual(q1.get_choices(), [c1, c2])
+        self.assertEqual(q1.get_responses(), [r1])
+        self.assertEqual(r1.get_responder(), u2)
+        self.assertEqual(r1.get_question(), q1)
+        self.assertEqual(r1.get_choices(), [c2])
+
+        # Related objects are memoized until the referenced ids change
+        queries = self.count_queries()
+        self.assertEqual(e1.get_attendances(), [a1, a2])
+        self.assertEqual(len(queries), 0)
+
+        p.delete_attendance(a2)
+        self.assertEqual(e1.get_attendances(), [a1])
+
+        # Missing related objects are skipped
+        self.assertIsNone(Survey("s", 1).get_event())
+        self.assertEqual(Event("e", 1).get_attendances(), [])
+        p.unregister_user(u1)
+        self.assertIsNone(e1.get_owner())
+
+    def test_preload(self):
+        u1 = p.register_user("u1")
+        events = [p.create_event("e{}".format(i), u1) for i in range(5)]
+        for i, e in enumerate(events):
+            p.create_attendance(p.register_user("user {}".format(i)), e)
+
+        events = p.get_all_events()
+        queries = self.count_queries()
+        self.assertEqual(preload(events, 'owner', 'attendances'), events)
+        self.assertEqual(len(queries), 2)  # One query per relation
+
+        # Preloaded relations don't query the database again
+        del queries[:]
+        for e in events:
+            self.assertEqual(e.get_owner(), u1)
+            self.assertEqual(len(e.get_attendances()), 2)
+        self.assertEqual(len(queries), 0)
+
+        self.assertEqual(preload([], 'owner'), [])
+
+    def test_get_surveys_preloaded(self):
+        u1 = p.register_user("u1")
+        e1 = p.create_event("e1", u1)
+        for i in range(3):
+            s = p.create_survey("s{}".format(i), u1, event_obj=e1)
+            for j in range(2):
+                q = p.create_question(u1, "q{}".format(j), "choose_one", survey_obj=s)
+                p.create_choice(q, "c")
+        e1_id = e1.get_id()
+        p.db_interface.s.expunge_all()
+        e1 = p.get_event(e1_id)
+
+        # As when rendering !survey: surveys, questions and choices take one query each
+        queries = self.count_queries()
+        surveys = p.get_surveys(e1)
+        for s in surveys:
+            for q in p.get_questions(s):
+                self.assertEqual([c.get_choice() for c in q.get_choices()], ["c"])
+        self.assertEqual(len(surveys), 3)
+        self.assertEqual(len(queries), 3)
+
+    def test_create_recurring_event(self):
+        u1 = p.register_user("user 1")
+        start = datetime.now() + timedelta(days=1)
+        e1 = p.create_event("weekly", u1, "park", start, recurrence="weekly")
+
+        # Occurrences within the horizon are created straight away
+        occurrences = p.db_interface.s.query(Event).filter(Event.series_id == e1.get_id()) \
+            .order_by(Event.time).all()
+        self.assertEqual([e.get_time() for e in occurrences],
+                         [start + timedelta(weeks=n) for n in range(1, 4)])
+        self.assertEqual(e1.get_materialized_until(), occurrences[-1].get_time())
+        self.assertEqual([(e.get_name(), e.get_location(), e.get_owner_id()) for e in occurrences],
+                         [("weekly", "park", u1.get_id())] * 3)
+        self.assertEqual([p.get_attendance(u1, e).get_roles() for e in occurrences], [["organiser"]] * 3)
+        self.assertEqual(u1.get_events_organised_ids(), [e1.get_id()] + [e.get_id() for e in occurrences])
+
+        with self.assertRaises(InvalidRecurrenceError):
+            p.create_event("yearly", u1, time=start, recurrence="yearly")
+
+        with self.assertRaises(InvalidRecurrenceError):
+            p.create_event("whenever", u1, recurrence="daily")
+
+    def test_materialize_occurrences(self):
+        u1 = p.register_user("user 1")
+        now = datetime(2017, 5, 1, 12)
+        day = timedelta(days=1)
+        e1 = p.create_event("daily", u1, time=now - 2 * day, recurrence="daily", recurrence_count=10)
+        e2 = p.create_event("monthly", u1, time=now - 2 * day, recurrence="monthly",
+                            recurrence_end=now + 40 * day)
+        p.db_interface.s.query(Event).filter(Event.series_id != None).delete()
+        for e in [e1, e2]:
+            e.materialized_until = None
+
+        # Occurrences already past are skipped
+        queries = self.count_queries()
+        ids = p.materialize_occurrences(until=now + 3 * day, now=now)
+        self.assertEqual([q.split()[2] for q in queries if q.startswith('INSERT')],
+                         ['events', 'attendance', 'attendance_roles'])  # One statement per table
+        times = sorted(p.db_interface.get_obj(event_id, Event).get_time() for event_id in ids)
+        self.assertEqual(times, [now + day, now + 2 * day, now + 3 * day])
+        e3 = p.db_interface.get_obj(ids[0], Event)
+        self.assertEqual(p.get_attendances(e3), [p.get_attendance(u1, e3)])
+        self.assertEqual(p.get_roles_for_user(u1)[ids[0]], ["organiser"])
+        self.assertIn(ids[0], u1.get_events_organised_ids())
+        self.assertIn(ids[0], u1.get_events_attending_ids())
+        self.assertEqual(e1.get_materialized_until(), now + 3 * day)
+        self.assertIsNone(e2.get_materialized_until())
+
+        # Nothing is created twice, and series end
+        self.assertEqual(p.materialize_occurrences(until=now + 3 * day, now=now), [])
+        ids = p.materialize_occurrences(until=now + 100 * day, now=now)
+        times = sorted(p.db_interface.get_obj(event_id, Event).get_time() for event_id in ids)
+        self.assertEqual(times, [now + n * day for n in range(4, 8)] + [datetime(2017, 5, 29, 12)])
+
+        with self.assertRaises(EventNotFoundError):
+            p.materialize_occurrences(event_obj=1234)
+
+    def test_iter_occurrences(self):
+        u1 = p.register_user("user 1")
+        now = datetime.now()
+        week = timedelta(weeks=1)
+        e1 = p.create_event("weekly", u1, time=now + timedelta(hours=1), recurrence="weekly")
+        e2 = p.create_event("once", u1, time=now + 5 * week)
+        e3 = p.create_event("monthly", u1, time=now + 2 * week, recurrence="monthly", recurrence_count=2)
+        p.create_event("past", u1, time=now - week)
+        p.create_event("undated", u1)
+
+        occurrences = list(itertools.islice(p.iter_occurrences(), 8))
+        self.assertEqual([(e.get_name(), time) for e, time in occurrences],
+                         [("weekly", e1.get_time()), ("weekly", e1.get_time() + week),
+                          ("monthly", e3.get_time())] +
+                         [("weekly", e1.get_time() + n * week) for n in range(2, 5)] +
+                         [("once", e2.get_time()), ("weekly", e1.get_time() + 5 * week)])
+        # Created occurrences have their own Event, later ones use the recurring Event
+        self.assertEqual(occurrences[1][0].get_series_id(), e1.get_id())
+        self.assertIs(occurrences[5][0], e1)
+
+        self.assertEqual(len(list(p.iter_occurrences(end=now + 2 * week))), 3)
+
+    def test_update_event(self):
+        u1 = p.register_user("u1")
+        e1 = p.create_event("e1", u1, location="park")
+
+        self.assertEqual(p.update_event(e1, name="e2"), e1)
+        self.assertEqual(e1.get_name(), "e2")
+        self.assertEqual(e1.get_location(), "park")  # Fields that aren't given are unchanged
+
+        p.update_event(e1.get_id(), location="beach", time=datetime(2017, 5, 21))
+        e1 = p.db_interface.get_obj(e1.get_id(), Event)
+        self.assertEqual((e1.get_name(), e1.get_location(), e1.get_time()),
+                         ("e2", "beach", datetime(2017, 5, 21)))
+
+        with self.assertRaises(EventNotFoundError):
+            p.update_event(1234, name="e3")
+
+    def test_set_going_status(self):
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        e1 = p.create_event("e1", u1)
+        p.create_attendance(u2, e1)
+
+        a = p.set_going_status(u2, e1, "going")
+        self.assertEqual(a.get_going_status(), "going")
+        self.assertEqual(p.get_event_headcount(e1), {"going": 2})
+
+        with self.assertRaises(AttendanceNotFoundError):
+            p.set_going_status(u2, 1234, "going")
+
+    def test_get_version(self):
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        e1 = p.create_event("e1", u1)
+        e2 = p.create_event("e2", u1)
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+
+        def changes(obj, fn):
+            before = p.get_version(obj)
+            fn()
+            return p.get_version(obj) != before
+
+        # Event versions change with the event, its attendances and roles
+        self.assertTrue(changes(e1, lambda: p.update_event(e1, name="e1 renamed")))
+        self.assertTrue(changes(e1, lambda: p.create_attendance(u2, e1)))
+        self.assertTrue(changes(e1, lambda: p.set_going_status(u2, e1, "going")))
+        self.assertTrue(changes(e1, lambda: p.add_role(u2, e1, "cook")))
+        self.assertTrue(changes(e1, lambda: p.remove_role(u2, e1, "cook")))
+        self.assertTrue(changes(e1, lambda: p.delete_attendance(p.get_attendance(u2, e1))))
+        self.assertFalse(changes(e2, lambda: p.update_event(e1, name="e1")))
+
+        # Survey versions change with its questions and choices
+        q1 = p.create_question(u1, "q1", "choose_one", survey_obj=s1)
+        self.assertTrue(changes(s1, lambda: p.create_question(u1, "q2", "free", survey_obj=s1)))
+        self.assertTrue(changes(s1, lambda: p.create_choice(q1, "c1")))
+        self.assertTrue(changes(s1, lambda: p.delete_choice(q1.get_allowed_choice_ids()[0])))
+        self.assertTrue(changes(s1, lambda: p.delete_question(q1)))
+        self.assertFalse(changes(s1, lambda: p.create_question(u1, "q3", "free")))
+
+        # Soft unregistering an attendee hides them from the event
+        p.create_attendance(u2, e2)
+        self.assertTrue(changes(e2, lambda: p.unregister_user(u2, soft=True)))
+
+        # Changes committed by another writer are seen once the event is reloaded
+        def other_writer():
+            c.execute("UPDATE events SET name = 'e2 renamed', version_id = version_id + 1 "
+                      "WHERE id = ?", (e2.get_id(),))
+            conn.commit()
+            p.db_interface.s.expire(e2)
+        self.assertTrue(changes(e2, other_writer))
+
+        with self.assertRaises(TypeError):
+            p.get_version(u1)
+
+    def test_version_tracker_size(self):
+        tracker = VersionTracker(EventBus(), max_size=2)
+        tracker.bump(Event, 1)
+        before = tracker.get(Event, 1)
+        tracker.bump(Event, 1)
+        tracker.bump(Event, 2)
+        tracker.bump(Event, 3)
+        self.assertEqual(len(tracker._versions), 2)
+        # Event 1's stamp was dropped, but it doesn't go back to the one before its last change
+        self.assertNotEqual(tracker.get(Event, 1), before)
+        versions = [tracker.get(Event, event_id) for event_id in [1, 2, 3, 4]]
+        tracker.bump(Event, 4)
+        tracker.bump(Event, 5)
+        self.assertNotEqual(tracker.get(Event, 4), versions[3])
+        self.assertEqual(len(tracker._versions), 2)
+
+    def test_get_rendered(self):
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        e1 = p.create_event("e1", u1)
+        renders = []
+
+        def render(event):
+            renders.append(event.get_id())
+            return "{} ({} people)".format(event.get_name(), len(event.get_attendance_ids()))
+
+        self.assertEqual(p.get_rendered(e1, 'summary', render), "e1 (1 people)")
+        self.assertEqual(p.get_rendered(e1, 'summary', render), "e1 (1 people)")
+        self.assertEqual(len(renders), 1)
+
+        # Re-rendered after a change
+        p.create_attendance(u2, e1)
+        self.assertEqual(p.get_rendered(e1, 'summary', render), "e1 (2 people)")
+        self.assertEqual(len(renders), 2)
+
+        # Kinds are cached separately
+        self.assertEqual(p.get_rendered(e1, 'name', lambda event: event.get_name()), "e1")
+
+    def test_close_survey(self):
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        u3 = p.register_user("u3")
+        s1 = p.create_survey("s1", u1)
+        q1 = p.create_question(u1, "q1", "choose_one", survey_obj=s1)
+        q2 = p.create_question(u1, "q2", "free", survey_obj=s1)
+        c1 = p.create_choice(q1, "c1")
+        c2 = p.create_choice(q1, "c2")
+        c3 = p.create_choice(q1, "c3")
+        p.create_response(u1, q1, choice_ids=[c1.get_id()])
+        p.create_response(u2, q1, choice_ids=[c1.get_id()])
+        p.create_response(u3, q1, choice_ids=[c2.get_id()])
+        p.create_response(u2, q2, response_text="hello")
+
+        result = p.close_survey(s1, closed_time=datetime(2017, 5, 21))
+        self.assertTrue(s1.is_closed())
+        self.assertEqual(s1.get_closed_time(), datetime(2017, 5, 21))
+        self.assertEqual(result.get_closed_time(), datetime(2017, 5, 21))
+        self.assertEqual(result.get_response_count(q1.get_id()), 3)
+        self.assertEqual(result.get_response_count(q2.get_id()), 1)
+        self.assertEqual(result.get_choice_counts(q1.get_id()),
+                         {c1.get_id(): 2, c2.get_id(): 1, c3.get_id(): 0})
+        self.assertEqual(result.get_choice_counts(q2.get_id()), {})
+
+        # Closed surveys don't accept responses or closing again
+        with self.assertRaises(SurveyClosedError):
+            p.create_response(u3, q2, response_text="too late")
+
+        with self.assertRaises(SurveyClosedError):
+            p.close_survey(s1)
+
+        # Questions outside the survey still accept responses
+        q3 = p.create_question(u1, "q3", "free")
+        p.create_response(u3, q3, response_text="fine")
+
+        # Try close surveys that don't exist
+        with self.assertRaises(SurveyNotFoundError):
+            p.close_survey(1234)
+
+        with self.assertRaises(SurveyNotFoundError):
+            p.close_survey(Survey("nonexistant survey", u1.get_id()))
+
+    def test_get_survey_results(self):
+        u1 = p.register_user("u1")
+        s1 = p.create_survey("s1", u1)
+        q1 = p.create_question(u1, "q1", "choose_many", survey_obj=s1)
+        c1 = p.create_choice(q1, "c1")
+        c2 = p.create_choice(q1, "c2")
+        p.create_response(u1, q1, choice_ids=[c1.get_id(), c2.get_id()])
+
+        # Open surveys are counted on each call
+        result = p.get_survey_results(s1)
+        self.assertIsNone(result.get_closed_time())
+        self.assertEqual(result.get_choice_counts(q1.get_id()), {c1.get_id(): 1, c2.get_id(): 1})
+        self.assertEqual(p.db_interface.s.query(SurveyResult).count(), 0)
+
+        # Closed surveys are read from the stored result without counting responses
+        p.close_survey(s1)
+        s1.get_name()  # Reload the survey, expired by the commit
+        queries = self.count_queries()
+        result = p.get_survey_results(s1)
+        self.assertEqual(len(queries), 1)
+        self.assertIsNotNone(result.get_closed_time())
+        self.assertEqual(result.get_response_count(q1.get_id()), 1)
+
+        # Survey results are deleted with the survey
+        p.delete_survey(s1)
+        self.assertEqual(p.db_interface.s.query(SurveyResult).count(), 0)
+
+        # Surveys without questions have empty results
+        s2 = p.create_survey("s2", u1)
+        self.assertEqual(p.close_survey(s2).response_counts, {})
+
+    def test_change_events(self):
+        changes = []
+        subscription = p.events.subscribe(changes.append)
+        self.addCleanup(p.events.unsubscribe, subscription)
+
+        u1 = p.register_user("u1")
+        u2 = p.register_user("u2")
+        e1 = p.create_event("e1", u1)
+        a1 = p.get_attendance(u1, e1)
+        a2 = p.create_attendance(u2, e1)
+        p.set_going_status(u2, e1, "going")
+        p.update_event(e1, name="picnic")
+        self.assertEqual(changes, [UserRegistered(u1.get_id()), UserRegistered(u2.get_id()),
+                                   EventCreated(e1.get_id(), u1.get_id()),
+                                   AttendanceAdded(a1.get_id(), e1.get_id(), u1.get_id()),
+                                   AttendanceAdded(a2.get_id(), e1.get_id(), u2.get_id()),
+                                   AttendanceChanged(a2.get_id(), e1.get_id(), u2.get_id()),
+                                   EventUpdated(e1.get_id())])
+
+        del changes[:]
+        s1 = p.create_survey("s1", u1, event_obj=e1)
+        q1 = p.create_question(u1, "q1", "choose_one", survey_obj=s1)
+        c1 = p.create_choice(q1, "c1")
+        r1 = p.create_response(u2, q1, choice_ids=[c1.get_id()])
+        p.close_survey(s1)
+        self.assertEqual(changes, [SurveyCreated(s1.get_id(), e1.get_id()),
+                                   QuestionAdded(q1.get_id(), s1.get_id()),
+                                   ChoiceAdded(c1.get_id(), q1.get_id(), s1.get_id()),
+                                   ResponseAdded(r1.get_id(), q1.get_id(), u2.get_id()),
+                                   SurveyClosed(s1.get_id(), e1.get_id())])
+
+        # Deletes publish a change for every object removed
+        del changes[:]
+        p.delete_event(e1)
+        self.assertEqual(set(changes), {AttendanceRemoved(a1.get_id(), e1.get_id(), u1.get_id()),
+                                        AttendanceRemoved(a2.get_id(), e1.get_id(), u2.get_id()),
+                                        SurveyDeleted(s1.get_id(), e1.get_id()),
+                                        QuestionDeleted(q1.get_id(), s1.get_id()),
+                                        ChoiceDeleted(c1.get_id(), q1.get_id(), s1.get_id()),
+                                        ResponseDeleted(r1.get_id(), q1.get_id(), u2.get_id()),
+                                        EventDeleted(e1.get_id())})
+        self.assertEqual(changes[-1], EventDeleted(e1.get_id()))
+
 # Generate empty test database
 conn = sqlite3.connect(porg_config.DB_NAME)
 c = conn.cursor()
@@ -101,6 +101,16 @@ class TestQuestion(unittest.TestCase):
         q = Question(12, "Do you like", "choose_many", survey_id=24, allowed_choice_ids=[34, 45])
         self.assertEqual(q.get_allowed_choice_ids(), [34, 45])
 
+    def test_get_allowed_choice_set(self):
+        q = Question(12, "Do you like", "choose_many", survey_id=24, allowed_choice_ids=[34, 45])
+        choices = q.get_allowed_choice_set()
+        self.assertEqual(choices, frozenset([34, 45]))
+
+        q.add_allowed_choice_id(50)
+        self.assertEqual(q.get_allowed_choice_set(), frozenset([34, 45, 50]))
+        q.remove_allowed_choice_id(34)
+        self.assertEqual(q.get_allowed_choice_set(), frozenset([45, 50]))
+
     def test_get_response_ids(self):
         q = Question(52, "hello?", "free")
         self.assertEqual(q.get_response_ids(), [])
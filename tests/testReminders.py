@@ -0,0 +1,189 @@
+#!/usr/bin/env python3.5
+import asyncio
+import sqlite3
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from config import porg_config
+from gen_db import generate as generate_db
+from Poorganiser import Event
+from PorgReminders import ReminderScheduler
+from PorgWrapper import PorgWrapper
+
+DAY = timedelta(days=1)
+HOUR = timedelta(hours=1)
+NOW = datetime(2017, 5, 1, 12, 0)
+
+
+class TestReminderScheduler(unittest.TestCase):
+    def setUp(self):
+        generate_db(c)  # Generate blank database
+        p.db_interface.s.expunge_all()
+
+        self.sent = []
+        self.scheduler = ReminderScheduler(lambda key: p, self.callback, offsets=[HOUR, DAY])
+        self.addCleanup(self.scheduler.unwatch)
+
+        self.u1 = p.register_user("u1")
+        self.u2 = p.register_user("u2")
+        self.u3 = p.register_user("u3")
+
+    def callback(self, shard_key, event, offset, attendees):
+        self.sent.append((event.get_name(), offset, [u.get_username() for u in attendees]))
+
+    def test_watch(self):
+        p.create_event("past", self.u1, time=NOW - HOUR)
+        p.create_event("soon", self.u1, time=NOW + 2 * HOUR)
+        p.create_event("later", self.u1, time=NOW + 2 * DAY)
+        p.create_event("undated", self.u1)
+
+        self.scheduler.watch(p, now=NOW)
+        self.assertEqual(self.scheduler.get_next_time(), NOW + HOUR)
+
+        # Reminders already past when the event is scheduled are skipped (soon's one day reminder)
+        due = [(p.db_interface.get_obj(event_id, Event).get_name(), offset)
+               for shard_key, event_id, offset in self.scheduler.pop_due(NOW + 3 * DAY)]
+        self.assertEqual(due, [("soon", HOUR), ("later", DAY), ("later", HOUR)])
+        self.assertIsNone(self.scheduler.get_next_time())
+
+    def test_watch_threaded(self):
+        e1 = p.create_event("soon", self.u1, time=NOW + 2 * HOUR)
+        p.create_event("later", self.u1, time=NOW + 2 * DAY)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        scheduler = ReminderScheduler(lambda key: p, self.callback, offsets=[HOUR], loop=loop)
+        self.addCleanup(scheduler.unwatch)
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+
+        # Read on the shard's thread, then scheduled on the loop in order with later changes
+        async def run():
+            watched = loop.run_in_executor(executor, scheduler.watch, p, None, NOW)
+            deleted = loop.run_in_executor(executor, p.delete_event, e1, False)
+            await watched
+            await deleted
+            await asyncio.sleep(0)
+
+        loop.run_until_complete(run())
+        due = [(p.db_interface.get_obj(event_id, Event).get_name(), offset)
+               for shard_key, event_id, offset in scheduler.pop_due(NOW + 3 * DAY)]
+        self.assertEqual(due, [("later", HOUR)])
+
+    def test_send_due(self):
+        e1 = p.create_event("e1", self.u1, time=NOW + 2 * DAY)
+        p.create_attendance(self.u2, e1, going_status="going")
+        p.create_attendance(self.u3, e1)  # Invited, not going
+        self.scheduler.watch(p, now=NOW)
+
+        self.assertEqual(self.scheduler.send_due(NOW + DAY - HOUR), [])
+        self.scheduler.send_due(NOW + DAY)
+        self.assertEqual(self.sent, [("e1", DAY, ["u1", "u2"])])
+
+        # Reminders are only sent once
+        self.scheduler.send_due(NOW + DAY)
+        self.scheduler.send_due(NOW + 2 * DAY)
+        self.assertEqual(self.sent[1:], [("e1", HOUR, ["u1", "u2"])])
+
+    def test_follows_changes(self):
+        self.scheduler.watch(p, now=NOW)
+        self.assertIsNone(self.scheduler.get_next_time())
+
+        # Times are checked against the current time, so use events in the future
+        start = datetime.now() + 10 * DAY
+        e1 = p.create_event("e1", self.u1, time=start)
+        self.assertEqual(self.scheduler.get_next_time(), start - DAY)
+
+        # Moving the event replaces its reminders
+        p.update_event(e1, time=start + DAY)
+        self.assertEqual(self.scheduler.get_next_time(), start)
+        self.assertEqual([offset for key, event_id, offset in self.scheduler.pop_due(start + DAY)],
+                         [DAY, HOUR])
+
+        # Changes that don't move the event don't reschedule it
+        e2 = p.create_event("e2", self.u1, time=start)
+        p.update_event(e2, name="renamed")
+        self.assertEqual(len(self.scheduler.pop_due(start)), 2)
+
+        p.create_event("e3", self.u1, time=start)
+        p.delete_event(p.get_all_events()[-1])
+        self.assertIsNone(self.scheduler.get_next_time())
+
+    def test_unwatch(self):
+        self.scheduler.watch(p, now=NOW)
+        self.scheduler.unwatch()
+        p.create_event("e1", self.u1, time=datetime.now() + 10 * DAY)
+        self.assertIsNone(self.scheduler.get_next_time())
+
+    def test_run(self):
+        sent = []
+
+        async def callback(shard_key, event, offset, attendees):
+            sent.append(event.get_name())
+
+        scheduler = ReminderScheduler(lambda key: p, callback, offsets=[timedelta(milliseconds=50)])
+        self.addCleanup(scheduler.unwatch)
+        scheduler.watch(p)
+
+        async def run():
+            task = asyncio.ensure_future(scheduler.run())
+            await asyncio.sleep(0)
+            # Created after run() started sleeping, which wakes it up to reschedule
+            p.create_event("e1", self.u1, time=datetime.now() + timedelta(milliseconds=100))
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(run())
+        self.assertEqual(sent, ["e1"])
+
+    def test_run_threaded(self):
+        sent = []
+
+        async def callback(shard_key, event, offset, attendees):
+            sent.append(event.get_name())
+
+        scheduler = ReminderScheduler(lambda key: p, callback, offsets=[timedelta(milliseconds=50)])
+        self.addCleanup(scheduler.unwatch)
+        scheduler.watch(p)
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        threads = []
+
+        def in_shard(fn, *args):
+            threads.append(threading.get_ident())
+            return fn(*args)
+
+        async def run_in_shard(shard_key, fn, *args):
+            return await asyncio.get_event_loop().run_in_executor(executor, in_shard, fn, *args)
+
+        async def run():
+            task = asyncio.ensure_future(scheduler.run(run_in_shard))
+            await asyncio.sleep(0)
+            # Created on another thread, as commands are (see CommandRouter.ShardExecutors)
+            await run_in_shard(None, lambda: p.create_event(
+                "e1", self.u1, time=datetime.now() + timedelta(milliseconds=100)))
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(run())
+        self.assertEqual(sent, ["e1"])
+        # The due reminder was read on the shard's thread too
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+# Generate empty test database
+conn = sqlite3.connect(porg_config.DB_NAME)
+c = conn.cursor()
+generate_db(c)
+
+# Create PorgWrapper
+p = PorgWrapper()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3.5
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from CommandRouter import ShardExecutors
+from gen_db import generate as generate_db
+from Poorganiser import User
+from PorgShards import ShardManager
+from PorgWrapper import PorgWrapper
+
+
+class TestShardManager(unittest.TestCase):
+    def setUp(self):
+        self.shard_dir = tempfile.mkdtemp()
+        self.shards = ShardManager(self.shard_dir, max_open=2)
+
+    def tearDown(self):
+        self.shards.close()
+        shutil.rmtree(self.shard_dir)
+
+    def test_get(self):
+        p1 = self.shards.get(1234)
+        self.assertTrue(os.path.exists(os.path.join(self.shard_dir, 'porg_1234.db')))
+        self.assertIs(self.shards.get("1234"), p1)
+
+        # Shards are independent databases
+        p2 = self.shards.get(5678)
+        u1 = p1.register_user("bob")
+        self.assertIsNone(p2.get_user_by_username("bob"))
+        p2.register_user("bob")
+        self.assertEqual(p1.create_event("e1", u1).get_id(), 1)
+        self.assertEqual(p1.search("e1"), [p1.get_all_events()[0]])
+
+    def test_get_invalid_key(self):
+        with self.assertRaises(ValueError):
+            self.shards.get("../porg")
+
+        with self.assertRaises(ValueError):
+            self.shards.get("")
+
+    def test_lru_eviction(self):
+        p1 = self.shards.get("a")
+        p1.register_user("bob")
+        self.shards.get("b")
+        self.shards.get("a")  # Mark "a" as recently used
+        self.shards.get("c")
+        self.assertEqual(self.shards.get_open_shard_keys(), ["a", "c"])
+
+        # Evicted shards are reopened with their data intact
+        self.shards.get("b").register_user("jane")
+        self.assertEqual(self.shards.get_open_shard_keys(), ["c", "b"])
+        self.assertIsNotNone(self.shards.get("a").get_user_by_username("bob"))
+        self.assertIsNotNone(self.shards.get("b").get_user_by_username("jane"))
+
+    def test_pinned(self):
+        with self.shards.pinned("a") as p1:
+            with self.shards.pinned("a") as p1_again:
+                self.assertIs(p1_again, p1)
+            self.shards.get("b")
+            self.shards.get("c")
+            # "a" is least recently used but still in use, so "b" is closed instead
+            self.assertEqual(self.shards.get_open_shard_keys(), ["a", "c"])
+            p1.register_user("bob")
+
+            with self.shards.pinned("c"):
+                # Too many shards are pinned to close any
+                self.shards.get("d")
+                self.assertEqual(self.shards.get_open_shard_keys(), ["a", "c", "d"])
+            self.assertEqual(self.shards.get_open_shard_keys(), ["a", "d"])
+            self.assertIsNotNone(p1.get_user_by_username("bob"))
+
+        # Closed once unpinned if too many are open
+        self.shards.get("e")
+        self.assertEqual(self.shards.get_open_shard_keys(), ["d", "e"])
+
+    def test_pin(self):
+        p1 = self.shards.pin("a")
+        self.assertIs(self.shards.pin("a"), p1)
+        self.shards.get("b")
+        self.shards.get("c")
+        self.shards.unpin("a")
+        self.assertEqual(self.shards.get_open_shard_keys(), ["a", "c"])
+        self.shards.unpin("a")
+        self.shards.get("d")
+        self.assertEqual(self.shards.get_open_shard_keys(), ["c", "d"])
+
+    def test_import_db(self):
+        path = os.path.join(self.shard_dir, 'porg.db')
+        archive_path = os.path.join(self.shard_dir, 'porg_archive.db')
+        conn = sqlite3.connect(path)
+        generate_db(conn.cursor())
+        conn.commit()
+        conn.close()
+        porg = PorgWrapper('sqlite:///' + path, 'sqlite:///' + archive_path)
+        porg.create_event("e1", porg.register_user("bob"))
+
+        # Databases may be imported while in use
+        self.shards.import_db("a", path, archive_path)
+        porg.close()
+        p1 = self.shards.get("a")
+        self.assertEqual([e.get_name() for e in p1.get_all_events()], ["e1"])
+        self.assertEqual(self.shards.get_shard_keys(), ["a"])
+        self.assertFalse(os.path.exists(self.shards.get_archive_path("a")))
+
+        with self.assertRaises(ValueError):
+            self.shards.import_db("a", path)
+        with self.assertRaises(ValueError):
+            self.shards.import_db("b", os.path.join(self.shard_dir, 'missing.db'))
+        self.assertEqual(self.shards.get_shard_keys(), ["a"])
+
+    def test_query_all(self):
+        self.assertEqual(list(self.shards.query_all(lambda porg: 1)), [])
+
+        for key, usernames in [("g1", ["bob"]), ("g2", ["bob", "jane"]), ("g3", [])]:
+            self.shards.get(key)
+            for username in usernames:
+                self.shards.get(key).register_user(username)
+
+        counts = self.shards.query_all(lambda porg: porg.db_interface.s.query(User).count())
+        self.assertEqual(list(counts), [("g1", 1), ("g2", 2), ("g3", 0)])
+        self.assertEqual(self.shards.get_shard_keys(), ["g1", "g2", "g3"])
+        self.assertLessEqual(len(self.shards.get_open_shard_keys()), 2)
+
+    def test_on_open(self):
+        opened = []
+        self.shards.on_open = lambda key, porg: opened.append((key, porg))
+
+        p1 = self.shards.get("a")
+        self.shards.get("a")
+        self.assertEqual(opened, [("a", p1)])
+
+        # Called again when an evicted shard is reopened
+        self.shards.get("b")
+        self.shards.get("c")
+        p1 = self.shards.get("a")
+        self.assertEqual([key for key, porg in opened], ["a", "b", "c", "a"])
+        self.assertIs(opened[-1][1], p1)
+
+    def test_on_close(self):
+        closed = []
+        self.shards.on_close = lambda key, porg: closed.append((key, porg))
+
+        p1 = self.shards.get("a")
+        p2 = self.shards.get("b")
+        self.shards.get("c")
+        self.assertEqual(closed, [("a", p1)])
+
+        self.shards.close()
+        self.assertEqual([key for key, porg in closed], ["a", "c", "b"])
+        self.assertIs(closed[-1][1], p2)
+
+    def test_on_close_executors(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        executors = ShardExecutors()
+        self.addCleanup(executors.shutdown)
+        self.shards.on_close = lambda key, porg: executors.shutdown(key, wait=False)
+
+        async def run(key):
+            with self.shards.pinned(key) as porg:
+                return await executors.run(key, lambda: (porg.get_all_events(),
+                                                         threading.current_thread())[1])
+
+        threads = [loop.run_until_complete(run(key)) for key in ["a", "b", "c"]]
+        # Evicting "a" stopped its thread, while the open shards keep theirs
+        threads[0].join(5)
+        self.assertFalse(threads[0].is_alive())
+        self.assertTrue(threads[2].is_alive())
+        self.assertIsNot(loop.run_until_complete(run("a")), threads[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+from datetime import datetime
 from Poorganiser import Survey, Question, Event
 
 
@@ -84,6 +85,22 @@ class TestSurvey(unittest.TestCase):
         s = Survey("s3", 339, question_ids=[3, 5, 7, 9, 11], event_id=10)
         self.assertEqual(s.get_event_id(), 10)
 
+    def test_closed_time(self):
+        s = Survey("s1", 2)
+        self.assertIsNone(s.get_closed_time())
+        self.assertFalse(s.is_closed())
+
+        s.set_closed_time(datetime(2017, 5, 21, 18, 0))
+        self.assertEqual(s.get_closed_time(), datetime(2017, 5, 21, 18, 0))
+        self.assertTrue(s.is_closed())
+
+        # Test setting closed time with invalid type
+        with self.assertRaises(AssertionError):
+            s.set_closed_time("2017-05-21")
+
+        with self.assertRaises(AssertionError):
+            s.set_closed_time(None)
+
     def test_set_name(self):
         s = Survey("s1", 2)
         self.assertEqual(s.get_name(), "s1")
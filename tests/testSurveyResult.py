@@ -0,0 +1,39 @@
+#!/usr/bin/env python3.5
+import unittest
+from datetime import datetime
+from Poorganiser import SurveyResult
+
+
+class TestSurveyResult(unittest.TestCase):
+    def test_constructor_assertions(self):
+        # Incorrect survey_id type
+        with self.assertRaises(AssertionError):
+            SurveyResult("1", None, {}, {})
+
+        # Incorrect closed_time type
+        with self.assertRaises(AssertionError):
+            SurveyResult(1, "yesterday", {}, {})
+
+        # Incorrect counts types
+        with self.assertRaises(AssertionError):
+            SurveyResult(1, None, [], {})
+
+        with self.assertRaises(AssertionError):
+            SurveyResult(1, None, {}, None)
+
+    def test_getters(self):
+        sr = SurveyResult(3, datetime(2017, 5, 21), {1: 2, 2: 0}, {1: {10: 2, 11: 1}, 2: {}})
+        self.assertIsNone(sr.get_id())
+        self.assertEqual(sr.get_survey_id(), 3)
+        self.assertEqual(sr.get_closed_time(), datetime(2017, 5, 21))
+        self.assertEqual(sr.get_response_count(1), 2)
+        self.assertEqual(sr.get_response_count(2), 0)
+        self.assertEqual(sr.get_choice_counts(1), {10: 2, 11: 1})
+        self.assertEqual(sr.get_choice_counts(2), {})
+
+        # Questions that aren't in the survey have no responses
+        self.assertEqual(sr.get_response_count(5), 0)
+        self.assertEqual(sr.get_choice_counts(5), {})
+
+if __name__ == '__main__':
+    unittest.main()